@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from app.models import db, Configuracion
+from app.services.catalogo import marcar_catalogo_modificado
 import os
 
 admin_bp = Blueprint('admin', __name__)
@@ -79,6 +80,7 @@ def actualizar_configuracion():
             business_address_config = Configuracion(clave='business_address', valor=business_address)
             db.session.add(business_address_config)
         
+        marcar_catalogo_modificado()
         db.session.commit()
         
         # Actualizar también el archivo .env si existe
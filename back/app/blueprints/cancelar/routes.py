@@ -1,6 +1,12 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
 from app.models import db, Cancha, Horario, Reserva, Estado, Cliente
+from app.services.slots import SLOTS
+from app.services.disponibilidad import cargar_ocupacion
+from app.services.turnos_fijos import buscar_ocurrencia
+from app.services.cierres import motivo_cierre
+from app.services.retenciones import ESTADO_RETENIDA, liberar_retenciones_vencidas
 
 cancelar_bp = Blueprint('cancelar', __name__, url_prefix='/api/cancelar')
 
@@ -30,35 +36,21 @@ def obtener_horarios_fecha():
         
         # Obtener horarios filtrados por el día de la semana para evitar duplicados del grid semanal
         horarios = Horario.query.filter_by(dia=dia_nombre).order_by(Horario.hora).all()
+        mascara_dia = SLOTS.mascara(h.hora for h in horarios)
         
-        # Obtener reservas existentes para esa fecha
-        reservas = Reserva.query.filter_by(fecha=fecha_obj).all()
-        
-        # Mapear reservas por cancha_id y hora
-        reservas_map = {}
-        for r in reservas:
-            key = (r.cancha_id, r.hora)
-            estado = Estado.query.get(r.estado_id)
-            reservas_map[key] = estado.nombre
+        # Ocupación del día en una sola consulta (las canceladas ya cuentan como disponibles)
+        _, estados = cargar_ocupacion([c.id for c in canchas], fecha_obj, fecha_obj, mascara_dia)
             
         # Construir respuesta
         grid = []
-        for h in horarios:
+        for indice in SLOTS.indices(mascara_dia):
             # La hora ya es un rango string "08:00-09:00"
-            time_str = h.hora
-            
-            fila = {'hora': time_str, 'canchas': []}
+            fila = {'hora': SLOTS.rango(indice), 'canchas': []}
             for c in canchas:
-                estado_actual = reservas_map.get((c.id, h.hora), 'disponible')
-                
-                # Si está cancelada, cuenta como disponible
-                if estado_actual == 'cancelada':
-                    estado_actual = 'disponible'
-                    
                 fila['canchas'].append({
                     'cancha_id': c.id,
                     'cancha_nombre': c.nombre,
-                    'estado': estado_actual
+                    'estado': estados.get((c.id, fecha_obj, indice), 'disponible')
                 })
             grid.append(fila)
             
@@ -84,6 +76,9 @@ def toggle_bloqueo():
         # Si envía solo la hora de inicio, podríamos normalizarlo, pero asumiremos que el frontend
         # envía lo que recibió en GET /horarios_fecha.
         
+        # Una retención vencida (la grilla ya la muestra disponible) no debe ocupar el turno
+        liberar_retenciones_vencidas(int(cancha_id), fecha_obj, hora_str)
+        
         # Buscar reserva existente
         reserva = Reserva.query.filter_by(
             cancha_id=cancha_id, 
@@ -102,10 +97,20 @@ def toggle_bloqueo():
             # Usemos 'cancelada' para ser consistentes con el sistema.
             if reserva.estado.nombre == 'bloqueada':
                 estado_cancelada = Estado.query.filter_by(nombre='cancelada').first()
-                reserva.estado_id = estado_cancelada.id
+                reserva.cambiar_estado(estado_cancelada)
                 accion = 'desbloqueada'
+            elif reserva.estado.nombre == ESTADO_RETENIDA:
+                db.session.commit()
+                return jsonify({
+                    'success': False,
+                    'error': f'El horario está retenido por un cliente hasta las {reserva.expira.strftime("%H:%M")}'
+                }), 400
             else:
                 return jsonify({'success': False, 'error': 'El horario ya está ocupado por una reserva real'}), 400
+        elif motivo_cierre(int(cancha_id), fecha_obj, hora_str) is not None:
+            return jsonify({'success': False, 'error': 'El horario está dentro de un cierre; quitalo desde /api/cierres'}), 400
+        elif buscar_ocurrencia(cancha_id, fecha_obj, hora_str):
+            return jsonify({'success': False, 'error': 'El horario está ocupado por un turno fijo'}), 400
         else:
             # Crear bloqueo
             # Necesitamos un cliente dummy o null?
@@ -134,6 +139,9 @@ def toggle_bloqueo():
         db.session.commit()
         return jsonify({'success': True, 'accion': accion}), 200
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'El horario ya está ocupado por una reserva real'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
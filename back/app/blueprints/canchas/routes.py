@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from app.models import db, Cancha, Horario, CanchaHorario, Reserva
+from app.services.catalogo import marcar_catalogo_modificado
 from datetime import datetime, timedelta
 
 canchas_bp = Blueprint('canchas', __name__, url_prefix='/canchas')
@@ -82,6 +83,7 @@ def crear_cancha():
                 )
                 db.session.add(cancha_horario)
         
+        marcar_catalogo_modificado()
         db.session.commit()
         
         return jsonify({
@@ -131,6 +133,7 @@ def modificar_cancha(id):
                 )
                 db.session.add(cancha_horario)
         
+        marcar_catalogo_modificado()
         db.session.commit()
         
         return jsonify({
@@ -159,6 +162,7 @@ def eliminar_cancha(id):
         Reserva.query.filter_by(cancha_id=id).delete()
         
         db.session.delete(cancha)
+        marcar_catalogo_modificado()
         db.session.commit()
         
         return jsonify({'mensaje': 'Cancha eliminada exitosamente'}), 200
@@ -1,15 +1,31 @@
-from flask import Blueprint, request, jsonify
-from app.services.ai import chat_with_assistant
-from app.models import db, Cancha, CanchaHorario, Horario
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import json
+from app.services.ai import chat_with_assistant, chat_with_assistant_stream
+from app.models import db
 from datetime import datetime, timedelta
-from app.blueprints.reservas.routes import verificar_disponibilidad, crear_reserva, listar_reservas_usuario, cancelar_reserva_usuario
-from app.services.historial_utils import guardar_mensaje, obtener_historial, limpiar_historial_antiguo
+from app.blueprints.reservas.routes import verificar_disponibilidad, crear_reserva, listar_reservas_usuario, cancelar_reserva_usuario, consultar_disponibilidad_rango, buscar_alternativas, crear_reservas_multiples
+from app.services.historial_utils import guardar_mensaje, guardar_mensajes_herramientas, obtener_historial_resumido, limpiar_historial_antiguo, programar_resumen
+from app.services.intenciones import ESTADISTICAS
+from app.services.orden import BloqueoUsuario, BloqueoOcupadoError, bloqueo_usuario
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/chat')
 
 # Usuario local por defecto
 USUARIO_LOCAL = '99999999'
 
+MENSAJE_OCUPADO = 'Todavía estoy respondiendo tu mensaje anterior, esperá un momento.'
+
+# Herramientas del asistente para el chat web
+HERRAMIENTAS = {
+    'verificar_disponibilidad_func': verificar_disponibilidad,
+    'crear_reserva_func': crear_reserva,
+    'listar_reservas_func': listar_reservas_usuario,
+    'cancelar_reserva_func': cancelar_reserva_usuario,
+    'disponibilidad_rango_func': consultar_disponibilidad_rango,
+    'alternativas_func': buscar_alternativas,
+    'reservas_multiples_func': crear_reservas_multiples
+}
+
 @chat_bp.route('/message', methods=['POST'])
 def send_message():
     try:
@@ -22,61 +38,120 @@ def send_message():
         # El usuario puede ser especificado o usar el local por defecto
         usuario = data.get('usuario', USUARIO_LOCAL)
         
-        # Guardar el mensaje del usuario en la BD
-        guardar_mensaje(usuario, 'user', user_message)
+        # Un turno a la vez por usuario (compartido con el worker de WhatsApp)
+        with bloqueo_usuario(usuario):
+            # Guardar el mensaje del usuario en la BD
+            guardar_mensaje(usuario, 'user', user_message)
         
-        # Obtener el historial de conversación desde la BD (últimos 10 mensajes)
-        conversation_history = obtener_historial(usuario, limite=10)
+            # Historial: resumen de lo anterior + últimos mensajes (hasta 10) dentro del presupuesto de tokens
+            conversation_history = obtener_historial_resumido(usuario, limite=10)
         
-        # Obtener información de las canchas desde la BD
-        canchas = Cancha.query.all()
-        canchas_info = []
+            # Obtener respuesta del asistente
+            # El catálogo de canchas y el prompt estático salen del cache versionado
+            intermedios = []
+            response = chat_with_assistant(
+                user_message,
+                conversation_history=conversation_history,
+                usuario=usuario,
+                mensajes_herramientas=intermedios,
+                **HERRAMIENTAS
+            )
         
-        for cancha in canchas:
-            # Obtener los horarios de esta cancha
-            horarios_cancha = []
-            for ch in CanchaHorario.query.filter_by(cancha_id=cancha.id).all():
-                horario = Horario.query.get(ch.horario_id)
-                if horario:
-                    horarios_cancha.append({
-                        'dia': horario.dia,
-                        'hora': horario.hora
-                    })
-            
-            canchas_info.append({
-                'nombre': cancha.nombre,
-                'descripcion': cancha.descripcion or '',
-                'cantidad': cancha.cantidad,
-                'precio': cancha.precio,
-                'horarios': horarios_cancha
-            })
+            # Guardar las herramientas usadas y la respuesta del asistente en la BD
+            guardar_mensajes_herramientas(usuario, intermedios)
+            guardar_mensaje(usuario, 'assistant', response)
         
-        # Obtener respuesta del asistente
-        response = chat_with_assistant(
-            user_message,
-            canchas_info,
-            conversation_history,
-            verificar_disponibilidad_func=verificar_disponibilidad,
-            crear_reserva_func=crear_reserva,
-            listar_reservas_func=listar_reservas_usuario,
-            cancelar_reserva_func=cancelar_reserva_usuario,
-            usuario=usuario
-        )
+            # Limpiar historial antiguo (mantener solo últimos 50 mensajes)
+            limpiar_historial_antiguo(usuario, mantener_ultimos=50)
         
-        # Guardar la respuesta del asistente en la BD
-        guardar_mensaje(usuario, 'assistant', response)
-        
-        # Limpiar historial antiguo (mantener solo últimos 50 mensajes)
-        limpiar_historial_antiguo(usuario, mantener_ultimos=50)
+            # Compactar los mensajes viejos en el resumen, en segundo plano
+            programar_resumen(usuario)
         
         return jsonify({
             'response': response,
             'success': True
         }), 200
         
+    except BloqueoOcupadoError:
+        return jsonify({'error': MENSAJE_OCUPADO, 'success': False}), 409
     except Exception as e:
         print(f"Error en chat: {e}")
         return jsonify({
             'error': str(e),
             'success': False
         }), 500
+
+
+def _evento_sse(evento: dict) -> str:
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+
+@chat_bp.route('/message/stream', methods=['POST'])
+def send_message_stream():
+    """
+    Igual que /message pero devuelve la respuesta como Server-Sent Events:
+    'token' por cada fragmento, 'herramienta' al ejecutar funciones y 'fin' con el texto final.
+    """
+    data = request.get_json()
+    if not data or not data.get('message'):
+        return jsonify({'error': 'El mensaje es requerido'}), 400
+
+    user_message = data['message']
+    usuario = data.get('usuario', USUARIO_LOCAL)
+
+    # El bloqueo del usuario se mantiene hasta que termina el stream
+    bloqueo = BloqueoUsuario(usuario)
+    try:
+        bloqueo.adquirir()
+    except BloqueoOcupadoError:
+        return jsonify({'error': MENSAJE_OCUPADO, 'success': False}), 409
+    try:
+        guardar_mensaje(usuario, 'user', user_message)
+        conversation_history = obtener_historial_resumido(usuario, limite=10)
+    except Exception:
+        bloqueo.liberar()
+        raise
+
+    def generar():
+        respuesta = None
+        intermedios = []
+        try:
+            for evento in chat_with_assistant_stream(
+                user_message,
+                conversation_history=conversation_history,
+                usuario=usuario,
+                mensajes_herramientas=intermedios,
+                **HERRAMIENTAS
+            ):
+                if evento['tipo'] == 'fin':
+                    respuesta = evento['respuesta']
+                yield _evento_sse(evento)
+        except Exception as e:
+            print(f"Error en chat stream: {e}")
+            respuesta = "Lo siento, hubo un error al procesar tu solicitud."
+            yield _evento_sse({'tipo': 'fin', 'respuesta': respuesta})
+        finally:
+            # Persistir la respuesta final cuando termina el stream
+            try:
+                if respuesta:
+                    guardar_mensajes_herramientas(usuario, intermedios)
+                    guardar_mensaje(usuario, 'assistant', respuesta)
+                    limpiar_historial_antiguo(usuario, mantener_ultimos=50)
+                    programar_resumen(usuario)
+            finally:
+                bloqueo.liberar()
+
+    respuesta_sse = Response(
+        stream_with_context(generar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Si el cliente corta antes de empezar el stream, el finally de generar() no corre
+    respuesta_sse.call_on_close(bloqueo.liberar)
+    return respuesta_sse
+
+
+@chat_bp.route('/fast-path/stats', methods=['GET'])
+def fast_path_stats():
+    """Tasa de aciertos y latencia ahorrada del camino rápido sin LLM (de este proceso)"""
+    return jsonify({'estadisticas': ESTADISTICAS.resumen(), 'success': True}), 200
@@ -0,0 +1 @@
+from .routes import cierres_bp
@@ -0,0 +1,91 @@
+"""
+Blueprint para gestionar cierres y feriados (tabla fecha_horario_no)
+"""
+from flask import Blueprint, request, jsonify
+from datetime import date
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app.models import db, FechaHorarioNo
+from app.services.disponibilidad import _parse_fecha
+from app.services.cierres import crear_cierres, eliminar_cierres, serializar_cierre
+
+cierres_bp = Blueprint('cierres', __name__, url_prefix='/api/cierres')
+
+
+def _leer_cierre(data):
+    """Convierte el JSON de un cierre en los argumentos de crear_cierres"""
+    if not data.get('fecha_desde'):
+        raise ValueError('Falta fecha_desde')
+    cancha_ids = data.get('canchas') or ([data['cancha_id']] if data.get('cancha_id') else None)
+    return {
+        'fecha_desde': _parse_fecha(data['fecha_desde']),
+        'fecha_hasta': _parse_fecha(data['fecha_hasta']) if data.get('fecha_hasta') else None,
+        'hora_desde': data.get('hora_desde') or None,
+        'hora_hasta': data.get('hora_hasta') or None,
+        'cancha_ids': [int(c) for c in cancha_ids] if cancha_ids else None,
+        'motivo': data.get('motivo')
+    }
+
+
+@cierres_bp.route('/', methods=['GET'])
+def listar_cierres():
+    """Lista los cierres que se superponen con [desde, hasta] (por defecto, de hoy en adelante)"""
+    try:
+        desde = _parse_fecha(request.args['desde']) if request.args.get('desde') else date.today()
+        query = FechaHorarioNo.query.options(
+            joinedload(FechaHorarioNo.cancha), joinedload(FechaHorarioNo.horario)
+        ).filter(func.coalesce(FechaHorarioNo.fecha_hasta, FechaHorarioNo.fecha) >= desde)
+        if request.args.get('hasta'):
+            query = query.filter(FechaHorarioNo.fecha <= _parse_fecha(request.args['hasta']))
+        cierres = query.order_by(FechaHorarioNo.fecha).all()
+        return jsonify({'success': True, 'cierres': [serializar_cierre(c) for c in cierres]}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@cierres_bp.route('/', methods=['POST'])
+def crear_cierres_endpoint():
+    """
+    Crea uno o varios cierres. Body: un cierre, o {'cierres': [...]}.
+    Cada cierre: fecha_desde, fecha_hasta, hora_desde, hora_hasta (HH:MM),
+    canchas (lista de ids, vacío = todas) y motivo.
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get('cierres') if isinstance(data.get('cierres'), list) else [data]
+        resultado = crear_cierres([_leer_cierre(item) for item in items])
+        if not resultado.get('exito'):
+            return jsonify({'success': False, **resultado}), 400
+        return jsonify({'success': True, **resultado}), 201
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@cierres_bp.route('/<int:cierre_id>', methods=['DELETE'])
+def eliminar_cierre(cierre_id: int):
+    try:
+        resultado = eliminar_cierres([cierre_id])
+        if not resultado['eliminados']:
+            return jsonify({'success': False, 'error': 'Cierre no encontrado'}), 404
+        return jsonify({'success': True, **resultado}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@cierres_bp.route('/', methods=['DELETE'])
+def eliminar_cierres_endpoint():
+    """Elimina varios cierres. Body: {'ids': [...]}"""
+    try:
+        ids = (request.get_json() or {}).get('ids')
+        if not isinstance(ids, list) or not ids:
+            return jsonify({'success': False, 'error': 'Faltan datos: ids'}), 400
+        return jsonify({'success': True, **eliminar_cierres([int(i) for i in ids])}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1,39 @@
+"""
+Blueprint de la cola de trabajos: profundidad, demora y dead-letter
+"""
+from flask import Blueprint, request, jsonify
+from app.services.cola import estadisticas_cola, listar_muertos, reintentar_muerto
+
+cola_bp = Blueprint('cola', __name__, url_prefix='/api/cola')
+
+
+@cola_bp.route('/stats', methods=['GET'])
+def stats():
+    """Trabajos por estado, demora del más viejo y espera/duración p50/p95/p99 (?minutos=, default 60)"""
+    try:
+        minutos = min(request.args.get('minutos', 60, type=int), 24 * 60)
+        return jsonify({'success': True, **estadisticas_cola(minutos)}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@cola_bp.route('/muertos', methods=['GET'])
+def muertos():
+    """Trabajos en dead-letter, del más nuevo al más viejo (?limite=, default 50)"""
+    try:
+        limite = min(request.args.get('limite', 50, type=int), 500)
+        return jsonify({'success': True, 'trabajos': listar_muertos(limite)}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@cola_bp.route('/muertos/<int:trabajo_id>/reintentar', methods=['POST'])
+def reintentar(trabajo_id):
+    """Vuelve a encolar un trabajo en dead-letter"""
+    try:
+        resultado = reintentar_muerto(trabajo_id)
+        if resultado['exito']:
+            return jsonify({'success': True, 'message': resultado['mensaje']}), 200
+        return jsonify({'success': False, 'error': resultado['error']}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -2,8 +2,8 @@
 Blueprint para gestionar el historial de conversaciones
 """
 from flask import Blueprint, request, jsonify
-from app.models import db, Conversacion
-from app.services.historial_utils import obtener_estadisticas_usuario, obtener_historial
+from app.models import db, Conversacion, ResumenConversacion
+from app.services.historial_utils import obtener_estadisticas_usuario, obtener_historial, ROLES_TEXTO
 from sqlalchemy import func
 
 historial_bp = Blueprint('historial', __name__, url_prefix='/api/historial')
@@ -21,7 +21,8 @@ def listar_usuarios():
             Conversacion.usuario,
             func.count(Conversacion.id).label('total_mensajes'),
             func.max(Conversacion.fecha).label('ultimo_mensaje')
-        ).group_by(Conversacion.usuario)\
+        ).filter(Conversacion.rol.in_(ROLES_TEXTO))\
+         .group_by(Conversacion.usuario)\
          .order_by(func.max(Conversacion.fecha).desc())
         
         # Paginar
@@ -83,6 +84,7 @@ def eliminar_conversacion_usuario(usuario):
     """Elimina todo el historial de un usuario"""
     try:
         Conversacion.query.filter_by(usuario=usuario).delete()
+        ResumenConversacion.query.filter_by(usuario=usuario).delete()
         db.session.commit()
         
         return jsonify({
@@ -100,7 +102,7 @@ def eliminar_conversacion_usuario(usuario):
 def estadisticas_generales():
     """Obtiene estadísticas generales del sistema"""
     try:
-        total_mensajes = Conversacion.query.count()
+        total_mensajes = Conversacion.query.filter(Conversacion.rol.in_(ROLES_TEXTO)).count()
         total_usuarios = db.session.query(func.count(func.distinct(Conversacion.usuario))).scalar()
         
         mensajes_por_rol = db.session.query(
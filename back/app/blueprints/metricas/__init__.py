@@ -0,0 +1 @@
+from .routes import metricas_bp
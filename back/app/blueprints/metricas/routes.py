@@ -0,0 +1,58 @@
+"""
+Blueprint de métricas del asistente: tokens, latencia y herramientas por día, usuario y herramienta
+"""
+from flask import Blueprint, request, jsonify
+from datetime import date, timedelta
+from app.services.disponibilidad import _parse_fecha
+from app.services.metricas import metricas_por_dia, metricas_por_usuario, metricas_por_herramienta
+
+metricas_bp = Blueprint('metricas', __name__, url_prefix='/api/metricas')
+
+
+def _rango():
+    """Rango [desde, hasta] de los parámetros; por defecto los últimos 7 días"""
+    hasta = _parse_fecha(request.args['hasta']) if request.args.get('hasta') else date.today()
+    desde = _parse_fecha(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=6)
+    if hasta < desde:
+        raise ValueError('hasta no puede ser anterior a desde')
+    return desde, hasta
+
+
+@metricas_bp.route('/diarias', methods=['GET'])
+def metricas_diarias():
+    """Mensajes, llamadas al LLM, tokens y duración p50/p95/p99 por día (opcional ?usuario=)"""
+    try:
+        desde, hasta = _rango()
+        dias = metricas_por_dia(desde, hasta, usuario=request.args.get('usuario'))
+        return jsonify({'success': True, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'dias': dias}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@metricas_bp.route('/usuarios', methods=['GET'])
+def metricas_usuarios():
+    """Usuarios que más tokens consumen en el rango (?limite=, default 50)"""
+    try:
+        desde, hasta = _rango()
+        limite = min(request.args.get('limite', 50, type=int), 500)
+        usuarios = metricas_por_usuario(desde, hasta, limite=limite)
+        return jsonify({'success': True, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'usuarios': usuarios}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@metricas_bp.route('/herramientas', methods=['GET'])
+def metricas_herramientas():
+    """Cantidad de llamadas y duración p50/p95/p99 de cada herramienta"""
+    try:
+        desde, hasta = _rango()
+        herramientas = metricas_por_herramienta(desde, hasta)
+        return jsonify({'success': True, 'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'herramientas': herramientas}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
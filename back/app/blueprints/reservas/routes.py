@@ -1,7 +1,25 @@
 from flask import Blueprint, request, jsonify
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import json
 import logging
-from app.models import db, Cancha, Reserva, Cliente, Estado
+from sqlalchemy import and_, or_, func, text, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, contains_eager
+from app.models import db, Cancha, Reserva, Cliente, Estado, TurnoFijo
+from app.services.slots import HORARIOS_VALIDOS, _normalizar_hora, es_horario_valido
+from app.services.disponibilidad import (
+	ESTADO_DISPONIBLE, ESTADO_FUERA_DE_HORARIO, _parse_fecha, obtener_matriz_disponibilidad,
+	buscar_alternativas
+)
+from app.services.cierres import ESTADO_CERRADA, motivo_cierre
+from app.services.turnos_fijos import (
+	SEMANAS_LISTADO, expandir_turnos_fijos, serializar_ocurrencia, omitir_ocurrencia
+)
+from app.services.retenciones import (
+	ESTADO_RETENIDA, id_estado, barrer_retenciones, liberar_retenciones_vencidas,
+	buscar_retencion, retener_turno, confirmar_retencion
+)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -10,68 +28,141 @@ logger = logging.getLogger(__name__)
 reservas_bp = Blueprint('reservas', __name__, url_prefix='/api/reservas')
 
 
-def _parse_fecha(fecha: str):
-	return datetime.strptime(fecha, '%Y-%m-%d').date()
-
-# Horarios válidos del sistema (rangos)
-HORARIOS_VALIDOS = ['08:00-09:00', '10:00-11:00', '12:00-13:00', '14:00-15:00', 
-                    '16:00-17:00', '18:00-19:00', '20:00-21:00', '22:00-23:00']
-
-def _normalizar_hora(hora: str):
-    # Si es exactamente un rango válido, retornarlo
-    if hora in HORARIOS_VALIDOS:
-        return hora
-    
-    # Si es una hora simple "08:00", buscar si coincide con el inicio de algún rango
-    for rango in HORARIOS_VALIDOS:
-        start = rango.split('-')[0] # "08:00"
-        if hora == start:
-            return rango
-            
-    # Si no se encuentra, retornar tal cual para que falle o intentar manejarlo
-    return hora
-
-def verificar_disponibilidad(cancha_nombre: str, fecha: str, hora: str):
+def _obtener_o_crear_cliente(telefono: str = None, cliente_nombre: str = None):
+	"""Busca el cliente por teléfono (o el genérico si no hay teléfono) y lo crea si no existe"""
+	cliente = None
+	if telefono:
+	    logger.info(f"DEBUG crear_reserva: Buscando cliente con telefono={telefono}")
+	    cliente = Cliente.query.filter_by(telefono=str(telefono)).first()
+	    if cliente:
+	        logger.info(f"DEBUG crear_reserva: Cliente encontrado: ID={cliente.id}, nombre={cliente.nombre}, telefono={cliente.telefono}")
+	        # FIX: Si el cliente ya existe y tiene el nombre "Cliente WhatsApp" (de pruebas anteriores),
+	        # lo actualizamos a la nueva preferencia (solo número).
+	        if cliente.nombre == "Cliente WhatsApp":
+	            cliente.nombre = str(telefono)
+	            cliente.apellido = ""
+	            db.session.add(cliente) # Asegurar que se guarde
+	            
+	    if not cliente:
+	        # Crear cliente nuevo con el teléfono
+	        # Si no hay nombre, usar el teléfono como nombre para que aparezca "solo el numero"
+	        nombre_cliente = cliente_nombre if cliente_nombre else str(telefono)
+	        apellido_cliente = "WSP" if cliente_nombre else ""
+	        logger.info(f"DEBUG crear_reserva: Creando nuevo cliente con telefono={telefono}, nombre={nombre_cliente}")
+	        cliente = Cliente(nombre=nombre_cliente, apellido=apellido_cliente, telefono=str(telefono), categoria=0)
+	        db.session.add(cliente)
+	        db.session.flush()
+	        logger.info(f"DEBUG crear_reserva: Cliente creado con ID={cliente.id}")
+	else:
+	    # Buscar o crear cliente genérico
+	    cliente = Cliente.query.filter_by(nombre='Cliente', apellido='Generico').first()
+	    if not cliente:
+	        cliente = Cliente(nombre='Cliente', apellido='Generico', telefono="0", categoria=0)
+	        db.session.add(cliente)
+	        db.session.flush()
+	return cliente
+
+
+def verificar_disponibilidad(cancha_nombre: str, fecha: str, hora: str, telefono: str = None):
+	"""
+	Verifica un turno puntual. Si se indica el teléfono del cliente y el turno está libre,
+	queda retenido a su nombre durante RETENCION_MINUTOS para que la confirmación no falle.
+	"""
 	try:
-		cancha = Cancha.query.filter_by(nombre=cancha_nombre).first()
-		if not cancha:
-			return {'disponible': False, 'error': f'No se encontró la cancha "{cancha_nombre}"'}
+		barrer_retenciones()
 
-		fecha_obj = _parse_fecha(fecha)
-		
 		# Normalizar hora (si viene 08:00 -> 08:00-09:00)
 		hora_norm = _normalizar_hora(hora)
 		
-		if hora_norm not in HORARIOS_VALIDOS:
+		if not es_horario_valido(hora_norm):
 		    return {'disponible': False, 'error': f'Horario "{hora}" no válido. Horarios permitidos: {", ".join(HORARIOS_VALIDOS)}'}
 
-		# Existe reserva activa para esa cancha-fecha-hora (no cancelada)
-		reserva_existente = (
-			Reserva.query
-			.filter_by(cancha_id=cancha.id, fecha=fecha_obj, hora=hora_norm)
-			.join(Estado, Reserva.estado_id == Estado.id)
-			.filter(Estado.nombre != 'cancelada')
-			.first()
-		)
+		# Consulta de una sola celda sobre la matriz de disponibilidad
+		matriz = obtener_matriz_disponibilidad(fecha, fecha, canchas=[cancha_nombre], horas=[hora_norm])
+		if not matriz.get('exito'):
+			return {'disponible': False, 'error': matriz.get('error')}
+
+		cancha = matriz['canchas'][0]
+		estado = matriz['matriz'][cancha['nombre']][matriz['fecha_desde']][hora_norm]
+		fecha_obj = _parse_fecha(fecha)
 
-		if reserva_existente:
+		if estado == ESTADO_FUERA_DE_HORARIO:
 			return {
 				'disponible': False,
-				'mensaje': f'La cancha {cancha_nombre} no está disponible el {fecha} a las {hora_norm}'
+				'mensaje': f'La cancha {cancha_nombre} no atiende el {fecha} en el horario {hora_norm}'
 			}
 
-		return {
+		if estado == ESTADO_CERRADA:
+			motivo = motivo_cierre(cancha['id'], fecha_obj, hora_norm)
+			return {
+				'disponible': False,
+				'mensaje': f'El complejo está cerrado para la cancha {cancha_nombre} el {fecha} a las {hora_norm}' + (f' ({motivo})' if motivo else '')
+			}
+
+		# Si el turno está retenido por el mismo cliente, sigue disponible para él
+		if estado == ESTADO_RETENIDA and telefono:
+			cliente = Cliente.query.filter_by(telefono=str(telefono)).first()
+			if cliente and buscar_retencion(cancha['id'], fecha_obj, hora_norm, cliente.id):
+				estado = ESTADO_DISPONIBLE
+
+		no_disponible = {
+			'disponible': False,
+			'mensaje': f'La cancha {cancha_nombre} no está disponible el {fecha} a las {hora_norm}'
+		}
+		if estado != ESTADO_DISPONIBLE:
+			return no_disponible
+
+		resultado = {
 			'disponible': True,
-			'cancha_id': cancha.id,
+			'cancha_id': cancha['id'],
 			'mensaje': f'La cancha {cancha_nombre} está disponible el {fecha} a las {hora_norm}',
 			'hora_normalizada': hora_norm
 		}
+
+		if telefono:
+			cliente = _obtener_o_crear_cliente(telefono)
+			expira = retener_turno(cancha['id'], fecha_obj, hora_norm, cliente, cancha['precio'])
+			if not expira:
+				return no_disponible
+			resultado['retenida_hasta'] = expira.strftime('%H:%M')
+			resultado['mensaje'] += f'. Queda retenida a nombre del cliente hasta las {resultado["retenida_hasta"]} mientras confirma'
+
+		return resultado
 	except Exception as e:
+		db.session.rollback()
 		return {'disponible': False, 'error': str(e)}
 
 
+def consultar_disponibilidad_rango(fecha_desde: str, fecha_hasta: str = None, canchas: list = None, horas: list = None):
+	"""Devuelve los horarios libres de un rango de fechas en una sola consulta (herramienta del asistente)"""
+	return obtener_matriz_disponibilidad(fecha_desde, fecha_hasta, canchas=canchas, horas=horas, solo_libres=True)
+
+
+def _confirmar_turno_retenido(cancha_nombre: str, fecha: str, hora: str, telefono: str):
+	"""Camino rápido de crear_reserva: promueve la retención vigente del cliente, si existe"""
+	cliente = Cliente.query.filter_by(telefono=str(telefono)).first()
+	cancha = Cancha.query.filter_by(nombre=cancha_nombre).first()
+	if not cliente or not cancha:
+		return None
+	hora_final = _normalizar_hora(hora)
+	reserva = confirmar_retencion(cancha.id, _parse_fecha(fecha), hora_final, cliente.id)
+	if not reserva:
+		return None
+	return {
+		'exito': True,
+		'reserva_id': reserva.id,
+		'mensaje': f'¡Reserva confirmada! Cancha {cancha_nombre} el {fecha} a las {hora_final}. Monto: ${reserva.monto}'
+	}
+
+
 def crear_reserva(cancha_nombre: str, fecha: str, hora: str, cliente_nombre: str = None, telefono: str = None):
 	try:
+		# Si el cliente retuvo el turno al verificarlo, alcanza con confirmar la retención
+		if telefono:
+			confirmada = _confirmar_turno_retenido(cancha_nombre, fecha, hora, telefono)
+			if confirmada:
+				return confirmada
+
 		disponibilidad = verificar_disponibilidad(cancha_nombre, fecha, hora)
 		if not disponibilidad.get('disponible'):
 			return disponibilidad
@@ -87,51 +178,35 @@ def crear_reserva(cancha_nombre: str, fecha: str, hora: str, cliente_nombre: str
 			return {'exito': False, 'error': 'Cancha no encontrada'}
 		
 		# Buscar o crear cliente
-		cliente = None
-		if telefono:
-		    logger.info(f"DEBUG crear_reserva: Buscando cliente con telefono={telefono}")
-		    cliente = Cliente.query.filter_by(telefono=str(telefono)).first()
-		    if cliente:
-		        logger.info(f"DEBUG crear_reserva: Cliente encontrado: ID={cliente.id}, nombre={cliente.nombre}, telefono={cliente.telefono}")
-		        # FIX: Si el cliente ya existe y tiene el nombre "Cliente WhatsApp" (de pruebas anteriores),
-		        # lo actualizamos a la nueva preferencia (solo número).
-		        if cliente.nombre == "Cliente WhatsApp":
-		            cliente.nombre = str(telefono)
-		            cliente.apellido = ""
-		            db.session.add(cliente) # Asegurar que se guarde
-		            
-		    if not cliente:
-		        # Crear cliente nuevo con el teléfono
-		        # Si no hay nombre, usar el teléfono como nombre para que aparezca "solo el numero"
-		        nombre_cliente = cliente_nombre if cliente_nombre else str(telefono)
-		        apellido_cliente = "WSP" if cliente_nombre else ""
-		        logger.info(f"DEBUG crear_reserva: Creando nuevo cliente con telefono={telefono}, nombre={nombre_cliente}")
-		        cliente = Cliente(nombre=nombre_cliente, apellido=apellido_cliente, telefono=str(telefono), categoria=0)
-		        db.session.add(cliente)
-		        db.session.flush()
-		        logger.info(f"DEBUG crear_reserva: Cliente creado con ID={cliente.id}")
-		else:
-		    # Buscar o crear cliente genérico
-		    cliente = Cliente.query.filter_by(nombre='Cliente', apellido='Generico').first()
-		    if not cliente:
-		        cliente = Cliente(nombre='Cliente', apellido='Generico', telefono="0", categoria=0)
-		        db.session.add(cliente)
-		        db.session.flush()
-
-		estado = Estado.query.filter_by(nombre='iniciada').first()
-		if not estado:
+		cliente = _obtener_o_crear_cliente(telefono, cliente_nombre)
+
+		estado_id = id_estado('iniciada')
+		if not estado_id:
 			return {'exito': False, 'error': 'No se encontró el estado "iniciada"'}
 
+		# Una retención vencida de otro cliente no debe bloquear el insert
+		liberar_retenciones_vencidas(cancha_id, fecha_obj, hora_final)
+
 		nueva_reserva = Reserva(
 			fecha=fecha_obj,
 			hora=hora_final, # Guardamos el rango normalizado
 			cancha_id=cancha_id,
 			cliente_id=cliente.id,
-			estado_id=estado.id,
+			estado_id=estado_id,
 			monto=cancha.precio  # Guardamos el precio actual de la cancha
 		)
 		db.session.add(nueva_reserva)
-		db.session.commit()
+		try:
+			db.session.commit()
+		except IntegrityError:
+			# Otra solicitud tomó el turno entre la verificación y el insert:
+			# el índice único uq_reserva_turno_activo rechaza el duplicado
+			db.session.rollback()
+			logger.info(f"Turno ya reservado por otra solicitud: {cancha_nombre} {fecha} {hora_final}")
+			return {
+				'disponible': False,
+				'mensaje': f'La cancha {cancha_nombre} no está disponible el {fecha} a las {hora_final}'
+			}
 
 		return {
 			'exito': True,
@@ -143,6 +218,166 @@ def crear_reserva(cancha_nombre: str, fecha: str, hora: str, cliente_nombre: str
 		return {'exito': False, 'error': str(e)}
 
 
+# Máximo de turnos por pedido múltiple
+MAX_RESERVAS_MULTIPLES = 10
+
+
+def crear_reservas_multiples(reservas: list, cliente_nombre: str = None, telefono: str = None):
+	"""
+	Reserva varios turnos (ej: dos horas seguidas o dos canchas) en una sola transacción.
+	Valida todos los turnos con una consulta a la matriz de disponibilidad e inserta
+	con un único INSERT masivo: se reservan todos o ninguno.
+
+	Args:
+		reservas: Lista de dicts con cancha_nombre, fecha y hora
+	"""
+	try:
+		if not reservas:
+			return {'exito': False, 'error': 'No se indicaron turnos a reservar'}
+		if len(reservas) > MAX_RESERVAS_MULTIPLES:
+			return {'exito': False, 'error': f'Se pueden reservar hasta {MAX_RESERVAS_MULTIPLES} turnos por pedido'}
+
+		# Normalizar y validar los turnos pedidos
+		pedidos = []
+		vistos = set()
+		for item in reservas:
+			cancha_nombre = (item or {}).get('cancha_nombre')
+			fecha = (item or {}).get('fecha')
+			hora = (item or {}).get('hora')
+			if not cancha_nombre or not fecha or not hora:
+				return {'exito': False, 'error': 'Cada turno necesita cancha_nombre, fecha y hora'}
+			hora_norm = _normalizar_hora(hora)
+			if not es_horario_valido(hora_norm):
+				return {'exito': False, 'error': f'Horario "{hora}" no válido. Horarios permitidos: {", ".join(HORARIOS_VALIDOS)}'}
+			pedido = (cancha_nombre.lower(), _parse_fecha(fecha), hora_norm)
+			if pedido in vistos:
+				return {'exito': False, 'error': f'El turno {cancha_nombre} {fecha} {hora_norm} está repetido'}
+			vistos.add(pedido)
+			pedidos.append(pedido + (cancha_nombre,))
+
+		# Una sola consulta de disponibilidad para todos los turnos
+		barrer_retenciones()
+		matriz = obtener_matriz_disponibilidad(
+			min(p[1] for p in pedidos),
+			max(p[1] for p in pedidos),
+			canchas=list({p[3] for p in pedidos}),
+			horas=list({p[2] for p in pedidos})
+		)
+		if not matriz.get('exito'):
+			return {'exito': False, 'error': matriz.get('error')}
+		canchas = {c['nombre'].lower(): c for c in matriz['canchas']}
+
+		cliente = _obtener_o_crear_cliente(telefono, cliente_nombre)
+
+		# Retenciones vigentes del cliente sobre los turnos pedidos: se promueven en lugar de insertar
+		retenciones = {}
+		if telefono:
+			retenida_id = id_estado(ESTADO_RETENIDA)
+			for r in Reserva.query.filter(
+				Reserva.cliente_id == cliente.id,
+				Reserva.estado_id == retenida_id,
+				Reserva.expira >= datetime.now(),
+				Reserva.fecha >= min(p[1] for p in pedidos),
+				Reserva.fecha <= max(p[1] for p in pedidos)
+			).all():
+				retenciones[(r.cancha_id, r.fecha, r.hora)] = r.id
+
+		no_disponibles = []
+		filas = []
+		ids_a_promover = []
+		for clave, fecha_obj, hora_norm, nombre_original in pedidos:
+			cancha = canchas[clave]
+			estado = matriz['matriz'][cancha['nombre']][fecha_obj.strftime('%Y-%m-%d')][hora_norm]
+			retencion_id = retenciones.get((cancha['id'], fecha_obj, hora_norm))
+			if retencion_id:
+				ids_a_promover.append(retencion_id)
+			elif estado == ESTADO_DISPONIBLE:
+				filas.append({
+					'fecha': fecha_obj,
+					'hora': hora_norm,
+					'cancha_id': cancha['id'],
+					'cliente_id': cliente.id,
+					'monto': cancha['precio'],
+					'activa': True
+				})
+			else:
+				no_disponibles.append(f"{cancha['nombre']} el {fecha_obj.strftime('%Y-%m-%d')} a las {hora_norm}")
+
+		if no_disponibles:
+			db.session.rollback()
+			return {
+				'exito': False,
+				'disponible': False,
+				'no_disponibles': no_disponibles,
+				'mensaje': f'No se reservó ningún turno porque no están disponibles: {"; ".join(no_disponibles)}'
+			}
+
+		estado_id = id_estado('iniciada')
+		if not estado_id:
+			return {'exito': False, 'error': 'No se encontró el estado "iniciada"'}
+
+		try:
+			if ids_a_promover:
+				# Solo las retenciones que siguen vigentes: pudieron vencer y liberarse desde la lectura
+				promovidas = Reserva.query.filter(
+					Reserva.id.in_(ids_a_promover),
+					Reserva.estado_id == id_estado(ESTADO_RETENIDA),
+					Reserva.expira >= datetime.now()
+				).update(
+					{Reserva.estado_id: estado_id, Reserva.expira: None, Reserva.activa: True}, synchronize_session=False
+				)
+				if promovidas != len(ids_a_promover):
+					db.session.rollback()
+					return {
+						'exito': False,
+						'disponible': False,
+						'mensaje': 'Alguno de los turnos retenidos ya no está disponible. No se reservó ninguno.'
+					}
+			if filas:
+				# Una retención vencida de otro cliente no debe bloquear el insert
+				liberar_retenciones_vencidas()
+				for fila in filas:
+					fila['estado_id'] = estado_id
+				db.session.execute(insert(Reserva), filas)
+			db.session.commit()
+		except IntegrityError:
+			# Otra solicitud tomó alguno de los turnos: no queda ninguna reserva parcial
+			db.session.rollback()
+			return {
+				'exito': False,
+				'disponible': False,
+				'mensaje': 'Alguno de los turnos acaba de ser reservado por otra persona. No se reservó ninguno.'
+			}
+
+		# Recuperar las reservas creadas para informar ids y montos
+		creadas = (
+			_query_reservas()
+			.filter(
+				Reserva.cliente_id == cliente.id,
+				Reserva.estado_id == estado_id,
+				or_(*[
+					and_(Reserva.cancha_id == canchas[clave]['id'], Reserva.fecha == fecha_obj, Reserva.hora == hora_norm)
+					for clave, fecha_obj, hora_norm, _ in pedidos
+				])
+			)
+			.order_by(Reserva.fecha, Reserva.hora)
+			.all()
+		)
+		monto_total = sum(r.monto or 0 for r in creadas)
+		detalle = '; '.join(f'Cancha {r.cancha.nombre} el {r.fecha.strftime("%Y-%m-%d")} a las {r.hora}' for r in creadas)
+
+		return {
+			'exito': True,
+			'reserva_ids': [r.id for r in creadas],
+			'reservas': [_serializar_reserva(r) for r in creadas],
+			'monto_total': monto_total,
+			'mensaje': f'¡Reservas confirmadas! {detalle}. Monto total: ${monto_total}'
+		}
+	except Exception as e:
+		db.session.rollback()
+		return {'exito': False, 'error': str(e)}
+
+
 def listar_reservas_usuario(telefono: str = None):
 	"""Lista las reservas activas (no canceladas) de un usuario"""
 	try:
@@ -167,8 +402,8 @@ def listar_reservas_usuario(telefono: str = None):
 		
 		# Obtener reservas en estado 'iniciada' del cliente
 		reservas = (
-			Reserva.query
-			.filter_by(cliente_id=cliente.id)
+			_query_reservas()
+			.filter(Reserva.cliente_id == cliente.id)
 			.join(Estado, Reserva.estado_id == Estado.id)
 			.filter(Estado.nombre == 'iniciada')
 			.order_by(Reserva.fecha, Reserva.hora)
@@ -177,7 +412,11 @@ def listar_reservas_usuario(telefono: str = None):
 		
 		logger.info(f"DEBUG: Reservas encontradas: {len(reservas)}")
 		
-		if not reservas:
+		# Próximas semanas de sus turnos fijos (no tienen fila en reserva, se expanden acá)
+		hoy = datetime.now().date()
+		ocurrencias = expandir_turnos_fijos(hoy, hoy + timedelta(weeks=SEMANAS_LISTADO), cliente_id=cliente.id)
+		
+		if not reservas and not ocurrencias:
 			return {
 				'exito': True,
 				'reservas': [],
@@ -185,18 +424,8 @@ def listar_reservas_usuario(telefono: str = None):
 			}
 		
 		# Formatear las reservas
-		reservas_info = []
-		for r in reservas:
-			cancha = Cancha.query.get(r.cancha_id)
-			estado = Estado.query.get(r.estado_id)
-			reservas_info.append({
-				'id': r.id,
-				'cancha': cancha.nombre if cancha else 'Desconocida',
-				'fecha': r.fecha.strftime('%d/%m/%Y'),
-				'hora': r.hora,
-				'monto': r.monto,
-				'estado': estado.nombre if estado else 'Desconocido'
-			})
+		reservas_info = [_serializar_reserva(r, formato_fecha='%d/%m/%Y') for r in reservas]
+		reservas_info += [serializar_ocurrencia(t, f, formato_fecha='%d/%m/%Y') for t, f in ocurrencias]
 		
 		logger.info(f"DEBUG: Reservas formateadas: {reservas_info}")
 		
@@ -210,9 +439,21 @@ def listar_reservas_usuario(telefono: str = None):
 		return {'exito': False, 'error': str(e)}
 
 
-def cancelar_reserva_usuario(reserva_id: int, telefono: str = None):
-	"""Cancela una reserva cambiando su estado de 'iniciada' a 'cancelada'"""
+def cancelar_reserva_usuario(reserva_id: int = None, telefono: str = None, turno_fijo_id: int = None, fecha: str = None):
+	"""
+	Cancela una reserva cambiando su estado de 'iniciada' a 'cancelada'.
+	Para una semana de un turno fijo (turno_fijo_id + fecha) se registra una excepción.
+	"""
 	try:
+		if turno_fijo_id:
+			turno = TurnoFijo.query.get(turno_fijo_id)
+			if not turno or not fecha:
+				return {'exito': False, 'error': f'No se encontró el turno fijo con ID {turno_fijo_id}'}
+			if telefono and (not turno.cliente or turno.cliente.telefono != str(telefono)):
+				return {'exito': False, 'error': 'Este turno fijo no te pertenece'}
+			return omitir_ocurrencia(turno, _parse_fecha(fecha))
+		if not reserva_id:
+			return {'exito': False, 'error': 'Se requiere reserva_id, o turno_fijo_id y fecha'}
 		logger.info(f"DEBUG: cancelar_reserva_usuario llamado con reserva_id={reserva_id}, telefono={telefono}")
 		# Buscar la reserva
 		reserva = Reserva.query.get(reserva_id)
@@ -239,7 +480,7 @@ def cancelar_reserva_usuario(reserva_id: int, telefono: str = None):
 		if not estado_cancelada:
 			return {'exito': False, 'error': 'No se encontró el estado "cancelada" en el sistema'}
 		
-		reserva.estado_id = estado_cancelada.id
+		reserva.cambiar_estado(estado_cancelada)
 		db.session.commit()
 		logger.info(f"DEBUG: Reserva {reserva_id} cancelada exitosamente")
 		
@@ -257,45 +498,220 @@ def cancelar_reserva_usuario(reserva_id: int, telefono: str = None):
 
 
 
+def _serializar_reserva(r, formato_fecha: str = '%Y-%m-%d'):
+	"""Serializa una reserva con sus relaciones ya cargadas (ver _query_reservas)"""
+	return {
+		'id': r.id,
+		'fecha': r.fecha.strftime(formato_fecha),
+		'hora': r.hora, # Es string
+		'cancha': r.cancha.nombre if r.cancha else None,
+		'cliente': f"{r.cliente.nombre} {r.cliente.apellido}".strip() if r.cliente else None,
+		'estado': r.estado.nombre if r.estado else None,
+		'monto': r.monto
+	}
+
+
+def _query_reservas():
+	"""Query de reservas que resuelve Cancha, Cliente y Estado en la misma consulta"""
+	return Reserva.query.options(
+		joinedload(Reserva.cancha),
+		joinedload(Reserva.cliente),
+		joinedload(Reserva.estado)
+	)
+
+
+def _codificar_cursor(r):
+	crudo = json.dumps([r.fecha.strftime('%Y-%m-%d'), r.hora, r.id])
+	return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor: str):
+	relleno = '=' * (-len(cursor) % 4)
+	fecha, hora, reserva_id = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode())
+	return _parse_fecha(fecha), str(hora), int(reserva_id)
+
+
+def _filtro_despues_de(cursor: str):
+	"""Condición de keyset para el orden (fecha, hora, id) descendente"""
+	fecha, hora, reserva_id = _decodificar_cursor(cursor)
+	return or_(
+		Reserva.fecha < fecha,
+		and_(Reserva.fecha == fecha, or_(
+			Reserva.hora < hora,
+			and_(Reserva.hora == hora, Reserva.id < reserva_id)
+		))
+	)
+
+
 @reservas_bp.route('/', methods=['GET'])
 def listar_reservas():
+	"""
+	Lista reservas de más nuevas a más antiguas.
+
+	Con ?page=N usa paginación por offset (incluye total y cantidad de páginas).
+	Sin page usa paginación por cursor: ?cursor=<siguiente_cursor>&per_page=20,
+	y solo calcula el total si se pide con ?total=1.
+	"""
 	try:
-		# Obtener parámetros de paginación
-		page = request.args.get('page', 1, type=int)
-		per_page = 20  # 20 reservas por página
-		
 		# Ordenar de más nuevas a más antiguas (descendente)
-		query = Reserva.query.order_by(Reserva.fecha.desc(), Reserva.hora.desc())
-		
-		# Aplicar paginación
-		pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-		reservas = pagination.items
-		
-		data = []
-		for r in reservas:
-			estado = Estado.query.get(r.estado_id)
-			cancha = Cancha.query.get(r.cancha_id)
-			cliente = Cliente.query.get(r.cliente_id)
-			data.append({
-				'id': r.id,
-				'fecha': r.fecha.strftime('%Y-%m-%d'),
-				'hora': r.hora, # Es string
-				'cancha': cancha.nombre if cancha else None,
-				'cliente': f"{cliente.nombre} {cliente.apellido}".strip() if cliente else None,
-				'estado': estado.nombre if estado else None,
-				'monto': r.monto
-			})
-		
-		return jsonify({
-			'success': True, 
-			'reservas': data,
-			'page': page,
+		orden = (Reserva.fecha.desc(), Reserva.hora.desc(), Reserva.id.desc())
+
+		if 'page' in request.args:
+			# Obtener parámetros de paginación
+			page = request.args.get('page', 1, type=int)
+			per_page = 20  # 20 reservas por página
+			
+			# Aplicar paginación
+			pagination = _query_reservas().order_by(*orden).paginate(page=page, per_page=per_page, error_out=False)
+			
+			return jsonify({
+				'success': True, 
+				'reservas': [_serializar_reserva(r) for r in pagination.items],
+				'page': page,
+				'per_page': per_page,
+				'total': pagination.total,
+				'pages': pagination.pages,
+				'has_next': pagination.has_next,
+				'has_prev': pagination.has_prev
+			}), 200
+
+		per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+		cursor = request.args.get('cursor')
+
+		query = _query_reservas()
+		if cursor:
+			try:
+				query = query.filter(_filtro_despues_de(cursor))
+			except Exception:
+				return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
+
+		# Se pide una fila de más para saber si hay siguiente página sin contar
+		reservas = query.order_by(*orden).limit(per_page + 1).all()
+		has_next = len(reservas) > per_page
+		reservas = reservas[:per_page]
+
+		respuesta = {
+			'success': True,
+			'reservas': [_serializar_reserva(r) for r in reservas],
 			'per_page': per_page,
-			'total': pagination.total,
-			'pages': pagination.pages,
-			'has_next': pagination.has_next,
-			'has_prev': pagination.has_prev
-		}), 200
+			'has_next': has_next,
+			'siguiente_cursor': _codificar_cursor(reservas[-1]) if has_next else None
+		}
+		if request.args.get('total', type=int):
+			respuesta['total'] = db.session.query(func.count(Reserva.id)).scalar()
+		return jsonify(respuesta), 200
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Límite del conteo aproximado: por encima se estima con EXPLAIN (MySQL)
+MAX_CONTEO_EXACTO = 10000
+
+
+def _query_busqueda(args):
+	"""
+	Query de búsqueda de reservas filtrada según los parámetros recibidos.
+	Los filtros por teléfono, cancha y estado se resuelven con índices
+	(cliente_id|cancha_id|estado_id, fecha, hora); el orden por fecha usa ix_reserva_fecha_hora.
+	"""
+	query = (
+		Reserva.query
+		.join(Cancha, Reserva.cancha_id == Cancha.id)
+		.join(Cliente, Reserva.cliente_id == Cliente.id)
+		.join(Estado, Reserva.estado_id == Estado.id)
+	)
+	if args.get('telefono'):
+		query = query.filter(Cliente.telefono == args['telefono'].strip())
+	if args.get('cliente'):
+		# Búsqueda por prefijo para poder usar los índices de nombre y apellido
+		prefijo = args['cliente'].strip().replace('%', '').replace('_', '') + '%'
+		query = query.filter(or_(Cliente.nombre.like(prefijo), Cliente.apellido.like(prefijo)))
+	if args.get('cancha'):
+		query = query.filter(Cancha.nombre == args['cancha'])
+	if args.get('cancha_id'):
+		query = query.filter(Reserva.cancha_id == int(args['cancha_id']))
+	if args.get('estado'):
+		query = query.filter(Estado.nombre == args['estado'])
+	if args.get('fecha_desde'):
+		query = query.filter(Reserva.fecha >= _parse_fecha(args['fecha_desde']))
+	if args.get('fecha_hasta'):
+		query = query.filter(Reserva.fecha <= _parse_fecha(args['fecha_hasta']))
+	if args.get('monto_min'):
+		query = query.filter(Reserva.monto >= float(args['monto_min']))
+	if args.get('monto_max'):
+		query = query.filter(Reserva.monto <= float(args['monto_max']))
+	return query
+
+
+def _estimar_filas(query):
+	"""Estimación del optimizador de MySQL (EXPLAIN) para la query; None en otros motores"""
+	if db.engine.dialect.name != 'mysql':
+		return None
+	sql = query.with_entities(Reserva.id).statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+	filas = db.session.execute(text(f'EXPLAIN {sql}')).mappings().all()
+	# La primera tabla del plan es la que maneja el recorrido
+	estimacion = 1
+	for fila in filas[:1]:
+		estimacion = int((fila.get('rows') or 0) * float(fila.get('filtered') or 100) / 100)
+	return estimacion
+
+
+@reservas_bp.route('/buscar', methods=['GET'])
+def buscar_reservas():
+	"""
+	Busca reservas por teléfono, nombre del cliente (prefijo), cancha, rango de fechas,
+	estado y monto. Pagina por cursor igual que el listado.
+
+	?conteo=exacto cuenta todos los resultados; ?conteo=aproximado cuenta hasta
+	MAX_CONTEO_EXACTO y por encima devuelve la estimación del optimizador.
+	"""
+	try:
+		try:
+			query = _query_busqueda(request.args)
+			cursor = request.args.get('cursor')
+			if cursor:
+				query_pagina = query.filter(_filtro_despues_de(cursor))
+			else:
+				query_pagina = query
+		except (ValueError, TypeError) as e:
+			return jsonify({'success': False, 'error': f'Parámetro inválido: {e}'}), 400
+
+		per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+		reservas = (
+			query_pagina
+			.options(contains_eager(Reserva.cancha), contains_eager(Reserva.cliente), contains_eager(Reserva.estado))
+			.order_by(Reserva.fecha.desc(), Reserva.hora.desc(), Reserva.id.desc())
+			.limit(per_page + 1)
+			.all()
+		)
+		has_next = len(reservas) > per_page
+		reservas = reservas[:per_page]
+
+		respuesta = {
+			'success': True,
+			'reservas': [dict(_serializar_reserva(r), telefono=r.cliente.telefono if r.cliente else None) for r in reservas],
+			'per_page': per_page,
+			'has_next': has_next,
+			'siguiente_cursor': _codificar_cursor(reservas[-1]) if has_next else None
+		}
+
+		conteo = request.args.get('conteo')
+		if conteo == 'exacto':
+			respuesta['total'] = query.with_entities(func.count(Reserva.id)).scalar()
+			respuesta['total_aproximado'] = False
+		elif conteo == 'aproximado':
+			# Contar como máximo MAX_CONTEO_EXACTO + 1 filas; si se llega al tope, estimar
+			acotada = query.with_entities(Reserva.id).limit(MAX_CONTEO_EXACTO + 1).subquery()
+			total = db.session.query(func.count()).select_from(acotada).scalar()
+			if total > MAX_CONTEO_EXACTO:
+				estimacion = _estimar_filas(query)
+				total = max(estimacion or 0, total)
+				respuesta['total_aproximado'] = True
+			else:
+				respuesta['total_aproximado'] = False
+			respuesta['total'] = total
+
+		return jsonify(respuesta), 200
 	except Exception as e:
 		return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -303,22 +719,10 @@ def listar_reservas():
 @reservas_bp.route('/<int:reserva_id>', methods=['GET'])
 def obtener_reserva(reserva_id: int):
 	try:
-		r = Reserva.query.get(reserva_id)
+		r = _query_reservas().filter(Reserva.id == reserva_id).first()
 		if not r:
 			return jsonify({'success': False, 'error': 'Reserva no encontrada'}), 404
-		estado = Estado.query.get(r.estado_id)
-		cancha = Cancha.query.get(r.cancha_id)
-		cliente = Cliente.query.get(r.cliente_id)
-		data = {
-			'id': r.id,
-			'fecha': r.fecha.strftime('%Y-%m-%d'),
-			'hora': r.hora, # Es string
-			'cancha': cancha.nombre if cancha else None,
-			'cliente': f"{cliente.nombre} {cliente.apellido}".strip() if cliente else None,
-			'estado': estado.nombre if estado else None,
-			'monto': r.monto
-		}
-		return jsonify({'success': True, 'reserva': data}), 200
+		return jsonify({'success': True, 'reserva': _serializar_reserva(r)}), 200
 	except Exception as e:
 		return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -377,6 +781,9 @@ def actualizar_reserva(reserva_id: int):
 
 		db.session.commit()
 		return jsonify({'success': True, 'mensaje': 'Reserva actualizada'}), 200
+	except IntegrityError:
+		db.session.rollback()
+		return jsonify({'success': False, 'disponible': False, 'error': 'El turno ya está ocupado por otra reserva'}), 400
 	except Exception as e:
 		db.session.rollback()
 		return jsonify({'success': False, 'error': str(e)}), 500
@@ -405,7 +812,7 @@ def cancelar_reserva(reserva_id: int):
 		estado_cancelada = Estado.query.filter_by(nombre='cancelada').first()
 		if not estado_cancelada:
 			return jsonify({'success': False, 'error': 'Estado "cancelada" no encontrado'}), 400
-		r.estado_id = estado_cancelada.id
+		r.cambiar_estado(estado_cancelada)
 		db.session.commit()
 		return jsonify({'success': True, 'mensaje': 'Reserva cancelada'}), 200
 	except Exception as e:
@@ -429,3 +836,62 @@ def disponibilidad_endpoint():
 	except Exception as e:
 		return jsonify({'success': False, 'error': str(e)}), 500
 
+
+@reservas_bp.route('/disponibilidad/matriz', methods=['POST'])
+def matriz_disponibilidad_endpoint():
+	try:
+		data = request.get_json() or {}
+		fecha_desde = data.get('fecha_desde')
+		if not fecha_desde:
+			return jsonify({'success': False, 'error': 'Faltan datos: fecha_desde'}), 400
+		resultado = obtener_matriz_disponibilidad(
+			fecha_desde,
+			data.get('fecha_hasta'),
+			canchas=data.get('canchas'),
+			horas=data.get('horas'),
+			solo_libres=bool(data.get('solo_libres', False))
+		)
+		if not resultado.get('exito'):
+			return jsonify({'success': False, 'error': resultado.get('error')}), 400
+		resultado['success'] = True
+		return jsonify(resultado), 200
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@reservas_bp.route('/alternativas', methods=['POST'])
+def alternativas_endpoint():
+	try:
+		data = request.get_json() or {}
+		fecha = data.get('fecha')
+		hora = data.get('hora')
+		if not fecha or not hora:
+			return jsonify({'success': False, 'error': 'Faltan datos: fecha, hora'}), 400
+		resultado = buscar_alternativas(
+			fecha,
+			hora,
+			cancha_nombre=data.get('cancha_nombre'),
+			cantidad=data.get('cantidad', 5),
+			dias=data.get('dias', 3)
+		)
+		if not resultado.get('exito'):
+			return jsonify({'success': False, 'error': resultado.get('error')}), 400
+		resultado['success'] = True
+		return jsonify(resultado), 200
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@reservas_bp.route('/multiples', methods=['POST'])
+def crear_reservas_multiples_endpoint():
+	try:
+		data = request.get_json() or {}
+		reservas = data.get('reservas')
+		if not isinstance(reservas, list) or not reservas:
+			return jsonify({'success': False, 'error': 'Faltan datos: reservas (lista de cancha_nombre, fecha, hora)'}), 400
+
+		resultado = crear_reservas_multiples(reservas, data.get('cliente_nombre'))
+		status = 200 if resultado.get('exito') else 400
+		return jsonify(resultado), status
+	except Exception as e:
+		return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1 @@
+from .routes import salud_bp
@@ -0,0 +1,38 @@
+"""
+Blueprint de salud: estado de la base de datos y del circuit breaker del LLM
+"""
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+from app.models import db
+from app.services.resiliencia import CIRCUITO_LLM
+
+salud_bp = Blueprint('salud', __name__, url_prefix='/api/health')
+
+
+@salud_bp.route('', methods=['GET'])
+def salud():
+    """
+    'ok' si todo responde; 'degradado' si el circuito del LLM no está cerrado
+    (el asistente contesta un mensaje fijo); 503 si la base no responde.
+    """
+    try:
+        db.session.execute(text('SELECT 1'))
+        base = {'estado': 'ok'}
+    except Exception as e:
+        db.session.rollback()
+        base = {'estado': 'error', 'error': str(e)}
+
+    llm = CIRCUITO_LLM.estado()
+    if base['estado'] != 'ok':
+        status = 'error'
+    elif llm['estado'] != 'cerrado':
+        status = 'degradado'
+    else:
+        status = 'ok'
+
+    return jsonify({
+        'success': status != 'error',
+        'status': status,
+        'base_datos': base,
+        'llm': llm
+    }), 503 if status == 'error' else 200
@@ -0,0 +1 @@
+from .routes import turnos_fijos_bp
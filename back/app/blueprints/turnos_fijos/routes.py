@@ -0,0 +1,168 @@
+"""
+Blueprint para gestionar turnos fijos (reservas semanales recurrentes)
+"""
+from flask import Blueprint, request, jsonify
+from datetime import date, timedelta
+from sqlalchemy.orm import joinedload
+from app.models import db, Cancha, Cliente, TurnoFijo
+from app.blueprints.reservas.routes import _obtener_o_crear_cliente
+from app.services.disponibilidad import MAX_DIAS_MATRIZ, _parse_fecha
+from app.services.turnos_fijos import (
+    crear_turno_fijo, finalizar_turno_fijo, omitir_ocurrencia, restaurar_ocurrencia,
+    materializar_ocurrencia, expandir_turnos_fijos, serializar_turno_fijo, serializar_ocurrencia
+)
+
+turnos_fijos_bp = Blueprint('turnos_fijos', __name__, url_prefix='/api/turnos-fijos')
+
+
+def _query_turnos():
+    return TurnoFijo.query.options(joinedload(TurnoFijo.cancha), joinedload(TurnoFijo.cliente))
+
+
+@turnos_fijos_bp.route('/', methods=['GET'])
+def listar_turnos_fijos():
+    """Lista los turnos fijos, opcionalmente filtrados por cancha, teléfono o vigencia"""
+    try:
+        query = _query_turnos()
+        if request.args.get('cancha_id', type=int):
+            query = query.filter(TurnoFijo.cancha_id == request.args.get('cancha_id', type=int))
+        if request.args.get('telefono'):
+            query = query.join(Cliente, TurnoFijo.cliente_id == Cliente.id).filter(Cliente.telefono == request.args['telefono'])
+        if request.args.get('activos', '1') == '1':
+            query = query.filter(TurnoFijo.activo.is_(True))
+        turnos = query.order_by(TurnoFijo.cancha_id, TurnoFijo.dia, TurnoFijo.hora).all()
+        return jsonify({'success': True, 'turnos_fijos': [serializar_turno_fijo(t) for t in turnos]}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/', methods=['POST'])
+def crear_turno_fijo_endpoint():
+    try:
+        data = request.get_json() or {}
+        if not data.get('dia') or not data.get('hora') or not (data.get('cancha_id') or data.get('cancha_nombre')):
+            return jsonify({'success': False, 'error': 'Faltan datos: cancha_id o cancha_nombre, dia, hora'}), 400
+
+        if data.get('cancha_id'):
+            cancha = Cancha.query.get(data['cancha_id'])
+        else:
+            cancha = Cancha.query.filter_by(nombre=data['cancha_nombre']).first()
+        if not cancha:
+            return jsonify({'success': False, 'error': 'Cancha no encontrada'}), 404
+
+        if data.get('cliente_id'):
+            cliente = Cliente.query.get(data['cliente_id'])
+            if not cliente:
+                return jsonify({'success': False, 'error': 'Cliente no encontrado'}), 404
+        else:
+            cliente = _obtener_o_crear_cliente(data.get('telefono'), data.get('cliente_nombre'))
+
+        fecha_desde = _parse_fecha(data['fecha_desde']) if data.get('fecha_desde') else date.today()
+        fecha_hasta = _parse_fecha(data['fecha_hasta']) if data.get('fecha_hasta') else None
+        resultado = crear_turno_fijo(
+            cancha.id, cliente.id, data['dia'], data['hora'], fecha_desde, fecha_hasta,
+            monto=data.get('monto', cancha.precio)
+        )
+        if not resultado.get('exito'):
+            db.session.rollback()
+            return jsonify({'success': False, **resultado}), 409 if resultado.get('conflictos') else 400
+        return jsonify({'success': True, **resultado}), 201
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/<int:turno_id>', methods=['DELETE'])
+def finalizar_turno_fijo_endpoint(turno_id: int):
+    """Finaliza el turno fijo: deja de ocupar los turnos posteriores a fecha_hasta (default: ayer)"""
+    try:
+        turno = _query_turnos().get(turno_id)
+        if not turno:
+            return jsonify({'success': False, 'error': 'Turno fijo no encontrado'}), 404
+        fecha_hasta = request.args.get('fecha_hasta')
+        resultado = finalizar_turno_fijo(turno, _parse_fecha(fecha_hasta) if fecha_hasta else None)
+        return jsonify({'success': True, **resultado}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/<int:turno_id>/excepciones', methods=['POST'])
+def omitir_ocurrencia_endpoint(turno_id: int):
+    """Saltea una semana del turno fijo"""
+    try:
+        turno = _query_turnos().get(turno_id)
+        if not turno:
+            return jsonify({'success': False, 'error': 'Turno fijo no encontrado'}), 404
+        data = request.get_json() or {}
+        if not data.get('fecha'):
+            return jsonify({'success': False, 'error': 'Falta la fecha'}), 400
+        resultado = omitir_ocurrencia(turno, _parse_fecha(data['fecha']))
+        return jsonify({'success': resultado['exito'], **resultado}), 200 if resultado['exito'] else 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/<int:turno_id>/excepciones/<fecha>', methods=['DELETE'])
+def restaurar_ocurrencia_endpoint(turno_id: int, fecha: str):
+    """Vuelve a habilitar una semana omitida"""
+    try:
+        turno = TurnoFijo.query.get(turno_id)
+        if not turno:
+            return jsonify({'success': False, 'error': 'Turno fijo no encontrado'}), 404
+        resultado = restaurar_ocurrencia(turno, _parse_fecha(fecha))
+        return jsonify({'success': resultado['exito'], **resultado}), 200 if resultado['exito'] else 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/<int:turno_id>/materializar', methods=['POST'])
+def materializar_ocurrencia_endpoint(turno_id: int):
+    """Convierte una ocurrencia en reserva, por ejemplo al cobrarla (estado 'ejecutada')"""
+    try:
+        turno = TurnoFijo.query.get(turno_id)
+        if not turno:
+            return jsonify({'success': False, 'error': 'Turno fijo no encontrado'}), 404
+        data = request.get_json() or {}
+        if not data.get('fecha'):
+            return jsonify({'success': False, 'error': 'Falta la fecha'}), 400
+        resultado = materializar_ocurrencia(
+            turno, _parse_fecha(data['fecha']), data.get('estado', 'iniciada'), data.get('monto')
+        )
+        return jsonify({'success': resultado['exito'], **resultado}), 201 if resultado['exito'] else 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@turnos_fijos_bp.route('/ocurrencias', methods=['GET'])
+def listar_ocurrencias():
+    """Ocurrencias expandidas de los turnos fijos en un rango de fechas"""
+    try:
+        desde = _parse_fecha(request.args['desde']) if request.args.get('desde') else date.today()
+        hasta = _parse_fecha(request.args['hasta']) if request.args.get('hasta') else desde + timedelta(days=27)
+        if hasta < desde or (hasta - desde).days + 1 > MAX_DIAS_MATRIZ:
+            return jsonify({'success': False, 'error': f'Rango inválido (máximo {MAX_DIAS_MATRIZ} días)'}), 400
+        cancha_id = request.args.get('cancha_id', type=int)
+        ocurrencias = expandir_turnos_fijos(desde, hasta, cancha_ids=[cancha_id] if cancha_id else None)
+        return jsonify({
+            'success': True,
+            'ocurrencias': [serializar_ocurrencia(turno, fecha) for turno, fecha in ocurrencias]
+        }), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,12 +1,21 @@
 from flask import Blueprint, request, jsonify
 import os
-import requests
 import json
 import logging
+from concurrent.futures import TimeoutError as FuturoTimeoutError
+from datetime import datetime, timedelta
 from app.services.ai import chat_with_assistant
-from app.models import db, Cancha, CanchaHorario, Horario
-from app.blueprints.reservas.routes import verificar_disponibilidad, crear_reserva, listar_reservas_usuario, cancelar_reserva_usuario
-from app.services.historial_utils import guardar_mensaje, obtener_historial, limpiar_historial_antiguo
+from app.models import db
+from app.services.catalogo import obtener_catalogo
+from app.blueprints.reservas.routes import verificar_disponibilidad, crear_reserva, listar_reservas_usuario, cancelar_reserva_usuario, consultar_disponibilidad_rango, buscar_alternativas, crear_reservas_multiples
+from app.services.historial_utils import guardar_mensaje, guardar_mensajes_herramientas, obtener_historial_resumido, limpiar_historial_antiguo, programar_resumen
+from app.services.cola import encolar, manejador, ultimo_sin_tomar, reprogramar
+from app.services.idempotencia import (
+    ya_recibido, registrar_recibido, ya_respondido, respuesta_pendiente, guardar_respuesta, marcar_respondido
+)
+from app.services.orden import bloqueo_usuario
+from app.services.envios_whatsapp import obtener_enviador, WHATSAPP_ENVIO_MAX_SEGUNDOS
+from sqlalchemy.exc import IntegrityError
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -14,84 +23,90 @@ logger = logging.getLogger(__name__)
 
 wsp_bp = Blueprint('whatsapp', __name__, url_prefix='/api/whatsapp')
 
-# Configuración de WhatsApp Business API
-WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
-WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
+# Configuración de WhatsApp Business API (token y número: ver app.services.envios_whatsapp)
 VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN', 'padelpro_verify_token_2024')
 
+# Tipo de trabajo de la cola para cada mensaje entrante
+TRABAJO_MENSAJE = 'whatsapp_mensaje'
+
+# Ventana para agrupar mensajes seguidos de un usuario en un solo turno del
+# asistente (0 = desactivado): cada mensaje nuevo dentro de la ventana se suma
+# al turno pendiente y la reinicia, hasta WHATSAPP_DEBOUNCE_MAX_SEGUNDOS desde el primero
+WHATSAPP_DEBOUNCE_SEGUNDOS = float(os.getenv('WHATSAPP_DEBOUNCE_SEGUNDOS', 0))
+WHATSAPP_DEBOUNCE_MAX_SEGUNDOS = float(os.getenv('WHATSAPP_DEBOUNCE_MAX_SEGUNDOS', 15))
+
+# Espera máxima del worker por el envío de la respuesta: lo que puede tardar un
+# envío con todos sus reintentos (ver app.services.envios_whatsapp)
+WHATSAPP_ESPERA_ENVIO_SEGUNDOS = WHATSAPP_ENVIO_MAX_SEGUNDOS
+
 def get_canchas_info():
-    """Obtener información de las canchas desde la BD"""
-    canchas = Cancha.query.all()
-    canchas_info = []
-    
-    for cancha in canchas:
-        horarios_cancha = []
-        for ch in CanchaHorario.query.filter_by(cancha_id=cancha.id).all():
-            horario = Horario.query.get(ch.horario_id)
-            if horario:
-                horarios_cancha.append({
-                    'dia': horario.dia,
-                    'hora': horario.hora
-                })
-        
-        canchas_info.append({
-            'nombre': cancha.nombre,
-            'descripcion': cancha.descripcion or '',
-            'cantidad': cancha.cantidad,
-            'precio': cancha.precio,
-            'horarios': horarios_cancha
-        })
-    
-    return canchas_info
+    """Obtener información de las canchas (catálogo cacheado, ver app.services.catalogo)"""
+    return obtener_catalogo()['canchas']
 
-def send_whatsapp_message(phone_number, message):
-    """Enviar mensaje de WhatsApp usando la API de Meta"""
-    if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-        print("Error: WhatsApp credentials not configured")
+def _partes(payload):
+    """Mensajes de texto de un trabajo: uno, o varios si se agruparon por debounce"""
+    return payload.get('mensajes') or [{'id': payload['id'], 'texto': payload['texto']}]
+
+def _encolar_mensaje(payload):
+    """
+    Encola el mensaje (sin commit). Con debounce, si el usuario tiene un turno
+    pendiente que todavía no se tomó, lo suma a ese turno.
+    
+    Returns:
+        bool: True si se agrupó con un turno pendiente
+    """
+    usuario = payload['from']
+    if WHATSAPP_DEBOUNCE_SEGUNDOS <= 0 or payload['type'] != 'text':
+        encolar(TRABAJO_MENSAJE, payload, usuario=usuario, commit=False)
         return False
     
-    url = f"https://graph.facebook.com/v22.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "messaging_product": "whatsapp",
-        "to": phone_number,
-        "type": "text",
-        "text": {
-            "body": message
-        }
-    }
+    pendiente = ultimo_sin_tomar(TRABAJO_MENSAJE, usuario)
+    if pendiente:
+        anterior = json.loads(pendiente.payload)
+        if anterior['type'] == 'text':
+            anterior['mensajes'] = _partes(anterior) + [{'id': payload['id'], 'texto': payload['texto']}]
+            disponible = min(
+                datetime.now() + timedelta(seconds=WHATSAPP_DEBOUNCE_SEGUNDOS),
+                pendiente.creado + timedelta(seconds=WHATSAPP_DEBOUNCE_MAX_SEGUNDOS)
+            )
+            if reprogramar(pendiente, anterior, disponible):
+                return True
     
+    encolar(TRABAJO_MENSAJE, payload, usuario=usuario, commit=False, demora=WHATSAPP_DEBOUNCE_SEGUNDOS)
+    return False
+
+def send_whatsapp_message(phone_number, message):
+    """Enviar mensaje de WhatsApp usando la API de Meta (espera el resultado)"""
+    print(f"DEBUG: Sending WhatsApp message to {phone_number} with content: {message}")
+    return obtener_enviador().enviar(phone_number, message)
+
+def encolar_whatsapp_message(phone_number, message):
+    """Encola el envío sin esperar (ver app.services.envios_whatsapp); devuelve un Future"""
+    return obtener_enviador().encolar(phone_number, message)
+
+def _enviar_respuesta(phone_number, message, message_ids=()):
+    """
+    Envía por la cola de envíos y espera el resultado. Los mensajes quedan como
+    respondidos cuando la respuesta salió; si falló sin salir, falla el trabajo
+    y la cola lo reintenta. Si el resultado es incierto (timeout de lectura, o
+    el envío sigue en curso al vencer la espera) también quedan como
+    respondidos: reenviar podría mandar la respuesta dos veces.
+    """
+    futuro = encolar_whatsapp_message(phone_number, message)
     try:
-        print(f"DEBUG: Sending WhatsApp message to {phone_number} with content: {message}")
-        response = requests.post(url, headers=headers, json=data)
-        
-        if not response.ok:
-            error_data = response.json()
-            error_code = error_data.get('error', {}).get('code')
-            print(f"Error sending WhatsApp message: {response.status_code} - {response.text}")
-            
-            # Reintento automático para números de Argentina (problema común del prefijo 9)
-            # Código 131030 es "Recipient phone number not in allowed list"
-            # A veces la lista de permitidos no tiene el 9, pero el webhook sí lo trae.
-            if error_code == 131030 and phone_number.startswith('549'):
-                alternate_phone = '54' + phone_number[3:]
-                print(f"DEBUG: Reintentando con número alternativo: {alternate_phone}")
-                data['to'] = alternate_phone
-                response = requests.post(url, headers=headers, json=data)
-                if not response.ok:
-                    print(f"Error en reintento: {response.status_code} - {response.text}")
-                else:
-                    return True
-
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        print(f"Exception sending WhatsApp message: {e}")
-        return False
+        enviado = futuro.result(timeout=WHATSAPP_ESPERA_ENVIO_SEGUNDOS)
+    except FuturoTimeoutError:
+        # Si todavía estaba en la cola de envíos se cancela y el reintento lo manda una sola vez
+        if futuro.cancel():
+            raise RuntimeError(f'La respuesta a {phone_number} no llegó a enviarse a tiempo')
+        enviado = None
+    if enviado is False:
+        raise RuntimeError(f'No se pudo enviar la respuesta a {phone_number}')
+    if enviado is None:
+        logger.warning(f"DEBUG WSP: Resultado incierto del envío a {phone_number}, no se reenvía")
+    for message_id in message_ids:
+        marcar_respondido(message_id)
+    db.session.commit()
 
 @wsp_bp.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -109,83 +124,153 @@ def verify_webhook():
 
 @wsp_bp.route('/webhook', methods=['POST'])
 def webhook():
-    """Recibir mensajes de WhatsApp"""
+    """
+    Recibir mensajes de WhatsApp: solo valida y encola, los procesa scripts/worker_cola.py.
+    Responder rápido evita que Meta reintente la entrega mientras corre el asistente.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         # Verificar que sea un mensaje válido
-        if not data.get('entry'):
+        if not isinstance(data, dict) or not data.get('entry'):
             return jsonify({'status': 'ok'}), 200
         
+        encolados = 0
+        agrupados = 0
+        duplicados = 0
         for entry in data['entry']:
             for change in entry.get('changes', []):
                 value = change.get('value', {})
                 
-                # Verificar que haya mensajes
+                # Verificar que haya mensajes (los cambios de estado de envío no traen)
                 if not value.get('messages'):
                     continue
                 
                 for message in value['messages']:
-                    # Obtener datos del mensaje
-                    from_number = message['from']
-                    message_type = message['type']
-                    
-                    logger.info(f"DEBUG WSP: Mensaje recibido de número: {from_number}")
-                    
-                    # Solo procesar mensajes de texto
-                    if message_type != 'text':
-                        send_whatsapp_message(
-                            from_number, 
-                            "Lo siento, solo puedo procesar mensajes de texto por ahora."
-                        )
+                    if not message.get('from'):
                         continue
+                    message_id = message.get('id')
                     
-                    user_message = message['text']['body']
-                    message_id = message['id']
-                    
-                    # Guardar el mensaje del usuario en la BD
-                    guardar_mensaje(from_number, 'user', user_message)
-                    
-                    # Obtener historial de conversación desde la BD (últimos 10 mensajes)
-                    conversation_history = obtener_historial(from_number, limite=10)
-                    
-                    # Obtener información de canchas
-                    canchas_info = get_canchas_info()
-                    
-                    # Wrapper para inyectar el teléfono en crear_reserva
-                    def crear_reserva_wrapper(**kwargs):
-                         logger.info(f"DEBUG WSP: crear_reserva_wrapper llamado con telefono={from_number}")
-                         kwargs['telefono'] = from_number
-                         return crear_reserva(**kwargs)
-
-                    # Obtener respuesta del asistente
-                    logger.info(f"DEBUG WSP: Llamando chat_with_assistant con usuario={from_number}")
-                    response = chat_with_assistant(
-                        user_message,
-                        canchas_info,
-                        conversation_history,
-                        verificar_disponibilidad_func=verificar_disponibilidad,
-                        crear_reserva_func=crear_reserva_wrapper,
-                        listar_reservas_func=listar_reservas_usuario,
-                        cancelar_reserva_func=cancelar_reserva_usuario,
-                        usuario=from_number
-                    )
-                    
-                    # Guardar la respuesta del asistente en la BD
-                    guardar_mensaje(from_number, 'assistant', response)
-                    
-                    # Limpiar historial antiguo (mantener solo últimos 50 mensajes)
-                    limpiar_historial_antiguo(from_number, mantener_ultimos=50)
+                    # Reentrega de Meta de un mensaje ya recibido: no se hace nada
+                    if message_id and ya_recibido(message_id):
+                        duplicados += 1
+                        continue
                     
-                    # Enviar respuesta
-                    send_whatsapp_message(from_number, response)
+                    payload = {
+                        'from': message['from'],
+                        'id': message_id,
+                        'type': message.get('type'),
+                        'texto': message.get('text', {}).get('body') if message.get('type') == 'text' else None
+                    }
+                    # El ID y el trabajo se guardan juntos: una reentrega concurrente
+                    # choca con el UNIQUE de message_id y no encola nada
+                    try:
+                        if message_id:
+                            registrar_recibido(message_id, message['from'])
+                        agrupados += _encolar_mensaje(payload)
+                        db.session.commit()
+                        encolados += 1
+                    except IntegrityError:
+                        db.session.rollback()
+                        duplicados += 1
         
+        if encolados or duplicados:
+            logger.info(f"DEBUG WSP: {encolados} mensaje(s) encolado(s) ({agrupados} agrupado(s)), {duplicados} duplicado(s)")
         return jsonify({'status': 'ok'}), 200
         
     except Exception as e:
+        db.session.rollback()
         print(f"Error processing webhook: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@manejador(TRABAJO_MENSAJE)
+def procesar_mensaje(payload):
+    """Procesa un mensaje encolado por el webhook: asistente, historial y respuesta"""
+    from_number = payload['from']
+    
+    logger.info(f"DEBUG WSP: Mensaje recibido de número: {from_number}")
+    
+    # Solo procesar mensajes de texto
+    if payload['type'] != 'text':
+        _enviar_respuesta(
+            from_number, 
+            "Lo siento, solo puedo procesar mensajes de texto por ahora."
+        )
+        return
+    
+    # Los mensajes agrupados por debounce se guardan por separado y se responden juntos
+    partes = _partes(payload)
+    user_message = '\n'.join(parte['texto'] for parte in partes)
+    message_ids = [parte['id'] for parte in partes if parte['id']]
+    if len(partes) > 1:
+        logger.info(f"DEBUG WSP: {len(partes)} mensajes agrupados en un turno")
+    
+    # Un turno a la vez por usuario: el mensaje siguiente ve el historial con esta respuesta
+    with bloqueo_usuario(from_number):
+        # Reintento de un trabajo que ya respondió (ej: el worker se cortó antes de completarlo)
+        if message_ids and ya_respondido(message_ids[0]):
+            logger.info(f"DEBUG WSP: Mensaje {message_ids[0]} ya respondido, se omite")
+            return
+    
+        # Reintento de un trabajo cuyo envío falló: se reenvía la respuesta ya generada
+        # sin volver a correr el asistente (que pudo haber reservado)
+        pendiente = respuesta_pendiente(message_ids[0]) if message_ids else None
+        if pendiente is not None:
+            logger.info(f"DEBUG WSP: Mensaje {message_ids[0]} con respuesta sin enviar, se reenvía")
+            _enviar_respuesta(from_number, pendiente, message_ids)
+            return
+    
+        # Guardar los mensajes del usuario en la BD
+        for parte in partes:
+            guardar_mensaje(from_number, 'user', parte['texto'])
+    
+        # Historial: resumen de lo anterior + últimos mensajes (hasta 10) dentro del presupuesto de tokens
+        conversation_history = obtener_historial_resumido(from_number, limite=10)
+    
+        # Wrapper para inyectar el teléfono en crear_reserva
+        def crear_reserva_wrapper(**kwargs):
+             logger.info(f"DEBUG WSP: crear_reserva_wrapper llamado con telefono={from_number}")
+             kwargs['telefono'] = from_number
+             return crear_reserva(**kwargs)
+
+        def crear_reservas_multiples_wrapper(**kwargs):
+             kwargs['telefono'] = from_number
+             return crear_reservas_multiples(**kwargs)
+
+        # Obtener respuesta del asistente
+        logger.info(f"DEBUG WSP: Llamando chat_with_assistant con usuario={from_number}")
+        intermedios = []
+        response = chat_with_assistant(
+            user_message,
+            conversation_history=conversation_history,
+            verificar_disponibilidad_func=verificar_disponibilidad,
+            crear_reserva_func=crear_reserva_wrapper,
+            listar_reservas_func=listar_reservas_usuario,
+            cancelar_reserva_func=cancelar_reserva_usuario,
+            usuario=from_number,
+            disponibilidad_rango_func=consultar_disponibilidad_rango,
+            alternativas_func=buscar_alternativas,
+            reservas_multiples_func=crear_reservas_multiples_wrapper,
+            mensajes_herramientas=intermedios
+        )
+    
+        # Guardar las herramientas usadas y la respuesta del asistente en la BD,
+        # junto con la respuesta pendiente de envío, en una sola transacción
+        guardar_mensajes_herramientas(from_number, intermedios, commit=False)
+        guardar_mensaje(from_number, 'assistant', response, commit=False)
+        for message_id in message_ids:
+            guardar_respuesta(message_id, response)
+        db.session.commit()
+    
+        # Limpiar historial antiguo (mantener solo últimos 50 mensajes)
+        limpiar_historial_antiguo(from_number, mantener_ultimos=50)
+    
+        # Compactar los mensajes viejos en el resumen, en segundo plano
+        programar_resumen(from_number)
+    
+    # Enviar respuesta (en orden por destinatario) y marcar los mensajes como respondidos
+    _enviar_respuesta(from_number, response, message_ids)
+
 @wsp_bp.route('/send', methods=['POST'])
 def send_message():
     """Endpoint manual para enviar mensajes (útil para testing)"""
@@ -197,8 +282,12 @@ def send_message():
         if not phone_number or not message:
             return jsonify({'error': 'phone_number and message are required'}), 400
         
-        success = send_whatsapp_message(phone_number, message)
+        # Pasa por la cola de envíos como el resto (límite de tasa, reintentos, variante del número)
+        success = encolar_whatsapp_message(phone_number, message).result(timeout=60)
         
+        if success is None:
+            # Timeout de lectura de la API: el mensaje pudo haber salido
+            return jsonify({'status': 'unknown', 'success': False}), 504
         if success:
             return jsonify({'status': 'sent', 'success': True}), 200
         else:
@@ -207,13 +296,19 @@ def send_message():
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
+@wsp_bp.route('/envios/stats', methods=['GET'])
+def envios_stats():
+    """Enviados, fallidos, reintentos, pendientes y variantes de número aprendidas (de este proceso)"""
+    return jsonify({'estadisticas': obtener_enviador().estadisticas(), 'success': True}), 200
+
 @wsp_bp.route('/clear-history/<phone_number>', methods=['DELETE'])
 def clear_history(phone_number):
     """Limpiar historial de conversación de un número"""
     try:
-        from app.models import Conversacion
+        from app.models import Conversacion, ResumenConversacion
         # Eliminar todos los mensajes de este usuario
         Conversacion.query.filter_by(usuario=phone_number).delete()
+        ResumenConversacion.query.filter_by(usuario=phone_number).delete()
         db.session.commit()
         return jsonify({'status': 'cleared', 'success': True}), 200
     except Exception as e:
@@ -1,4 +1,4 @@
-from .bd import db, Horario, Cancha, CanchaHorario, Cliente, Estado, Reserva, FechaHorarioNo, Configuracion, Conversacion, crear_tablas
+from .bd import db, Horario, Cancha, CanchaHorario, Cliente, Estado, Reserva, TurnoFijo, TurnoFijoExcepcion, FechaHorarioNo, Configuracion, Conversacion, ResumenConversacion, MetricaTurno, TrabajoCola, MensajeProcesado, crear_tablas
 
 __all__ = [
     'db',
@@ -8,8 +8,14 @@ __all__ = [
     'Cliente',
     'Estado',
     'Reserva',
+    'TurnoFijo',
+    'TurnoFijoExcepcion',
     'FechaHorarioNo',
     'Configuracion',
     'Conversacion',
+    'ResumenConversacion',
+    'MetricaTurno',
+    'TrabajoCola',
+    'MensajeProcesado',
     'crear_tablas'
 ]
@@ -1,3 +1,5 @@
+import json
+
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, time
 
@@ -44,9 +46,15 @@ class Cliente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(45), nullable=False)
     apellido = db.Column(db.String(45), nullable=False)
-    telefono = db.Column(db.String(50))
+    telefono = db.Column(db.String(50), index=True)
     categoria = db.Column(db.Integer)
 
+    __table_args__ = (
+        # Búsqueda de reservas por prefijo de nombre o apellido
+        db.Index('ix_cliente_nombre', 'nombre'),
+        db.Index('ix_cliente_apellido', 'apellido'),
+    )
+
     def __repr__(self):
         return f'<Cliente {self.nombre} {self.apellido}>'
 
@@ -70,22 +78,106 @@ class Reserva(db.Model):
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     estado_id = db.Column(db.Integer, db.ForeignKey('estado.id'), nullable=False)
     monto = db.Column(db.Float, default=0.0)
+    # 1 mientras la reserva ocupa el turno, NULL cuando está cancelada.
+    # MySQL admite varios NULL en un índice único, así que el índice
+    # uq_reserva_turno_activo garantiza una sola reserva activa por turno.
+    activa = db.Column(db.Boolean, nullable=True, default=True)
+    # Vencimiento de las retenciones temporales (estado 'retenida'); NULL en el resto
+    expira = db.Column(db.DateTime, nullable=True)
     
     cancha = db.relationship('Cancha', backref='reservas')
     cliente = db.relationship('Cliente', backref='reservas')
     estado = db.relationship('Estado', backref='reservas')
 
+    __table_args__ = (
+        db.UniqueConstraint('cancha_id', 'fecha', 'hora', 'activa', name='uq_reserva_turno_activo'),
+        # Orden del listado paginado por cursor: (fecha, hora, id); InnoDB agrega el id al índice
+        db.Index('ix_reserva_fecha_hora', 'fecha', 'hora'),
+        # Búsqueda por cliente o estado, ordenada por fecha (el de cancha es uq_reserva_turno_activo)
+        db.Index('ix_reserva_cliente_fecha', 'cliente_id', 'fecha', 'hora'),
+        db.Index('ix_reserva_estado_fecha', 'estado_id', 'fecha', 'hora'),
+    )
+
+    def cambiar_estado(self, estado):
+        """Cambia el estado de la reserva, liberando el turno si queda cancelada"""
+        self.estado_id = estado.id
+        self.activa = None if estado.nombre == 'cancelada' else True
+
     def __repr__(self):
         return f'<Reserva {self.id} - {self.fecha} {self.hora}>'
 
-# Tabla: FechaHorarioNo (Fechas y horarios no disponibles)
+# Tabla: TurnoFijo (reserva semanal recurrente)
+# Es una regla: no genera filas en reserva. Las ocurrencias se expanden al consultar
+# una ventana de fechas (ver app.services.turnos_fijos).
+class TurnoFijo(db.Model):
+    __tablename__ = 'turno_fijo'
+    id = db.Column(db.Integer, primary_key=True)
+    cancha_id = db.Column(db.Integer, db.ForeignKey('cancha.id'), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
+    # Mismo formato que Horario.dia ('Lunes' ... 'Domingo')
+    dia = db.Column(db.String(45), nullable=False)
+    hora = db.Column(db.String(20), nullable=False)
+    fecha_desde = db.Column(db.Date, nullable=False)
+    # NULL = sin fecha de fin
+    fecha_hasta = db.Column(db.Date, nullable=True)
+    monto = db.Column(db.Float, default=0.0)
+    activo = db.Column(db.Boolean, nullable=False, default=True)
+
+    cancha = db.relationship('Cancha', backref='turnos_fijos')
+    cliente = db.relationship('Cliente', backref='turnos_fijos')
+
+    __table_args__ = (
+        db.Index('ix_turno_fijo_cancha_dia', 'cancha_id', 'dia', 'hora'),
+        db.Index('ix_turno_fijo_cliente', 'cliente_id'),
+    )
+
+    def __repr__(self):
+        return f'<TurnoFijo {self.id} - {self.dia} {self.hora}>'
+
+# Tabla: TurnoFijoExcepcion (fechas en que un turno fijo no se expande)
+class TurnoFijoExcepcion(db.Model):
+    __tablename__ = 'turno_fijo_excepcion'
+    id = db.Column(db.Integer, primary_key=True)
+    turno_fijo_id = db.Column(db.Integer, db.ForeignKey('turno_fijo.id'), nullable=False)
+    fecha = db.Column(db.Date, nullable=False)
+    # 'omitida' (semana salteada) o 'materializada' (pasó a ser una Reserva)
+    motivo = db.Column(db.String(20), nullable=False, default='omitida')
+    reserva_id = db.Column(db.Integer, db.ForeignKey('reserva.id'), nullable=True)
+
+    turno_fijo = db.relationship('TurnoFijo', backref='excepciones')
+    reserva = db.relationship('Reserva')
+
+    __table_args__ = (
+        db.UniqueConstraint('turno_fijo_id', 'fecha', name='uq_turno_fijo_excepcion'),
+    )
+
+    def __repr__(self):
+        return f'<TurnoFijoExcepcion {self.turno_fijo_id} {self.fecha}>'
+
+# Tabla: FechaHorarioNo (Fechas y horarios no disponibles: cierres y feriados)
+# Un registro cierra un rango de fechas, opcionalmente solo una franja horaria
+# y/o una cancha. Lo aplica app.services.cierres.
 class FechaHorarioNo(db.Model):
     __tablename__ = 'fecha_horario_no'
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.Date, nullable=False)
-    horario_id = db.Column(db.Integer, db.ForeignKey('horario.id'), nullable=False)
+    # Último día cerrado (inclusive); NULL = solo 'fecha'
+    fecha_hasta = db.Column(db.Date, nullable=True)
+    # Formato original: un Horario puntual. Los cierres nuevos usan hora_desde/hora_hasta
+    horario_id = db.Column(db.Integer, db.ForeignKey('horario.id'), nullable=True)
+    # Franja "HH:MM" [hora_desde, hora_hasta); NULL en ambas = todo el día
+    hora_desde = db.Column(db.String(5), nullable=True)
+    hora_hasta = db.Column(db.String(5), nullable=True)
+    # NULL = todas las canchas
+    cancha_id = db.Column(db.Integer, db.ForeignKey('cancha.id'), nullable=True)
+    motivo = db.Column(db.String(100))
     
     horario = db.relationship('Horario', backref='fechas_no_disponibles')
+    cancha = db.relationship('Cancha', backref='cierres')
+
+    __table_args__ = (
+        db.Index('ix_fecha_horario_no_fecha', 'fecha'),
+    )
 
     def __repr__(self):
         return f'<FechaHorarioNo {self.fecha}>'
@@ -106,7 +198,7 @@ class Conversacion(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     fecha = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
     usuario = db.Column(db.String(50), nullable=False)  # Número de teléfono o '99999999' para local
-    rol = db.Column(db.String(20), nullable=False)  # 'user' o 'assistant'
+    rol = db.Column(db.String(20), nullable=False)  # 'user', 'assistant', 'llamada_herramienta' o 'herramienta'
     mensaje = db.Column(db.Text, nullable=False)
     
     def __repr__(self):
@@ -114,11 +206,112 @@ class Conversacion(db.Model):
     
     def to_dict(self):
         """Convierte el mensaje al formato de OpenAI"""
+        # Llamadas a herramientas y sus resultados se guardan como JSON compacto
+        if self.rol == 'llamada_herramienta':
+            return {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [
+                    {'id': l['id'], 'type': 'function', 'function': {'name': l['name'], 'arguments': l['arguments']}}
+                    for l in json.loads(self.mensaje)
+                ]
+            }
+        if self.rol == 'herramienta':
+            resultado = json.loads(self.mensaje)
+            return {
+                'role': 'tool',
+                'tool_call_id': resultado['id'],
+                'name': resultado['name'],
+                'content': resultado['content']
+            }
         return {
             'role': self.rol,
             'content': self.mensaje
         }
 
+# Tabla: ResumenConversacion (Resumen acumulado de los mensajes viejos de cada usuario)
+class ResumenConversacion(db.Model):
+    __tablename__ = 'resumen_conversacion'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    usuario = db.Column(db.String(50), nullable=False, unique=True)
+    resumen = db.Column(db.Text, nullable=False, default='')
+    # Último Conversacion.id incluido en el resumen
+    ultimo_mensaje_id = db.Column(db.Integer, nullable=False, default=0)
+    actualizado = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return f'<ResumenConversacion {self.usuario} hasta {self.ultimo_mensaje_id}>'
+
+# Tabla: MetricaTurno (Uso del LLM, latencia y herramientas por mensaje del usuario)
+class MetricaTurno(db.Model):
+    __tablename__ = 'metrica_turno'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    fecha = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    usuario = db.Column(db.String(50), nullable=False)
+    origen = db.Column(db.String(20), nullable=False)  # 'llm', 'stream' o 'rapido' (sin LLM)
+    modelo = db.Column(db.String(50))
+    resultado = db.Column(db.String(20), nullable=False, default='ok')  # 'ok', 'error', 'timeout', 'max_pasos'
+    vueltas = db.Column(db.SmallInteger, nullable=False, default=0)  # Llamadas al LLM del loop
+    tokens_prompt = db.Column(db.Integer, nullable=False, default=0)
+    tokens_completion = db.Column(db.Integer, nullable=False, default=0)
+    # Tokens por llamada y herramientas como JSON compacto: [[prompt, completion], ...] y [[nombre, ms], ...]
+    llamadas = db.Column(db.Text)
+    herramientas = db.Column(db.Text)
+    duracion_ms = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_metrica_turno_fecha', 'fecha'),
+        db.Index('ix_metrica_turno_usuario_fecha', 'usuario', 'fecha'),
+    )
+
+    def __repr__(self):
+        return f'<MetricaTurno {self.usuario} {self.duracion_ms}ms>'
+
+# Tabla: TrabajoCola (Cola durable de trabajos en segundo plano, ej: mensajes de WhatsApp)
+class TrabajoCola(db.Model):
+    __tablename__ = 'trabajo_cola'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    tipo = db.Column(db.String(30), nullable=False)  # Ej: 'whatsapp_mensaje'
+    usuario = db.Column(db.String(50))
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # 'pendiente', 'en_proceso', 'hecho', 'muerto'
+    intentos = db.Column(db.SmallInteger, nullable=False, default=0)
+    # Pendiente: desde cuándo se puede tomar. En proceso: vencimiento de la visibilidad
+    disponible_desde = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    creado = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    iniciado = db.Column(db.DateTime)
+    terminado = db.Column(db.DateTime)
+    worker = db.Column(db.String(64))
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_trabajo_cola_estado_disponible', 'estado', 'disponible_desde'),
+        db.Index('ix_trabajo_cola_usuario_estado', 'usuario', 'estado'),
+    )
+
+    def __repr__(self):
+        return f'<TrabajoCola {self.id} {self.tipo} {self.estado}>'
+
+# Tabla: MensajeProcesado (IDs de mensajes entrantes de WhatsApp ya recibidos, para ignorar reentregas)
+class MensajeProcesado(db.Model):
+    __tablename__ = 'mensaje_procesado'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    message_id = db.Column(db.String(128), nullable=False, unique=True)  # wamid de Meta
+    usuario = db.Column(db.String(50), nullable=False)
+    recibido = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    # Respuesta del asistente, guardada en la misma transacción que el historial
+    respuesta = db.Column(db.Text)
+    # Se completa cuando la respuesta se envió
+    respondido = db.Column(db.DateTime)
+    expira = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_mensaje_procesado_expira', 'expira'),
+    )
+
+    def __repr__(self):
+        return f'<MensajeProcesado {self.message_id}>'
+
 # Función para crear todas las tablas
 def crear_tablas(app):
     with app.app_context():
@@ -126,14 +319,14 @@ def crear_tablas(app):
         print("Tablas creadas exitosamente en la base de datos 'padelpro'")
         
         # Insertar estados si no existen
-        estados_predeterminados = ['iniciada', 'ejecutada', 'cancelada', 'bloqueada']
+        estados_predeterminados = ['iniciada', 'ejecutada', 'cancelada', 'bloqueada', 'retenida']
         for nombre_estado in estados_predeterminados:
             if not Estado.query.filter_by(nombre=nombre_estado).first():
                 nuevo_estado = Estado(nombre=nombre_estado)
                 db.session.add(nuevo_estado)
         
         db.session.commit()
-        print("Estados insertados: iniciada, ejecutada, cancelada, bloqueada")
+        print("Estados insertados: iniciada, ejecutada, cancelada, bloqueada, retenida")
         
         # Insertar horarios predeterminados si no existen
         dias = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
@@ -1,5 +1,7 @@
 from .ai import *
 from .factura import *
 from .historial_utils import *
+from .slots import *
+from .disponibilidad import *
 
 __all__ = []
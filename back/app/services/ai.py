@@ -1,39 +1,64 @@
 import os
 import json
 import re
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from dotenv import load_dotenv
 import dateparser
-from openai import OpenAI
+import openai
+from flask import current_app, has_app_context
+from app.services.catalogo import obtener_catalogo, obtener_horarios_cancha, resumir_horarios
+from app.services.llm import obtener_cliente, obtener_cliente_async
+from app.services.metricas import MedicionTurno, guardar_medicion
+from app.services.resiliencia import (
+    LLM_MAX_VUELTAS, CircuitoAbiertoError, llamar_con_reintentos, llamar_con_reintentos_async
+)
 
 
 load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
 model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
-def obtener_horarios_validos():
-    """Obtiene los horarios válidos únicos desde la base de datos"""
-    from app.models import Horario
-    try:
-        # Obtener todos los horarios únicos de la tabla Horario
-        horarios = Horario.query.with_entities(Horario.hora).distinct().all()
-        # Extraer solo el valor de hora y ordenar
-        horarios_list = sorted([h.hora for h in horarios])
-        return horarios_list if horarios_list else []
-    except Exception as e:
-        print(f"Error al obtener horarios de la BD: {e}")
-        # Fallback a horarios por defecto si hay error
-        return ['08:00-09:00', '09:00-10:00', '10:00-11:00', '11:00-12:00', 
-                '12:00-13:00', '13:00-14:00', '14:00-15:00', '15:00-16:00',
-                '16:00-17:00', '17:00-18:00', '18:00-19:00', '19:00-20:00',
-                '20:00-21:00', '21:00-22:00', '22:00-23:00']
+# Timeout de cada intento de llamada al modelo (los reintentos y el plazo total
+# se configuran en app.services.resiliencia)
+OPENAI_TIMEOUT_SEGUNDOS = float(os.getenv("OPENAI_TIMEOUT_SEGUNDOS", 30))
+
+# Hilos para ejecutar herramientas (acceden a la BD) fuera del event loop
+HERRAMIENTAS_WORKERS = int(os.getenv("HERRAMIENTAS_WORKERS", 8))
+
+# Respuesta cuando el circuito del LLM está abierto (el proveedor viene fallando)
+RESPUESTA_NO_DISPONIBLE = (
+    "El asistente no está disponible en este momento. Probá de nuevo en unos minutos "
+    "o escribinos más tarde para gestionar tu reserva."
+)
+
+# Herramientas independientes entre sí: si el modelo pide varias en un mismo turno
+# se ejecutan en paralelo. Las que reservan o cancelan se ejecutan de a una y en orden.
+HERRAMIENTAS_PARALELAS = {
+    "verificar_disponibilidad",
+    "consultar_disponibilidad_rango",
+    "buscar_alternativas",
+    "obtener_horarios_cancha",
+    "listar_reservas_usuario",
+}
+
+# Con el teléfono del usuario retienen el turno (y pueden crear el cliente):
+# en ese caso escriben en la BD y se ejecutan de a una
+HERRAMIENTAS_CON_RETENCION = {"verificar_disponibilidad"}
 
-if not api_key:
-    raise RuntimeError("Missing required environment variable: OPENAI_API_KEY")
+# Horarios de las canchas en el prompt: 'compacto' (ej: "Lun–Vie 08–23", el detalle
+# se pide con la herramienta obtener_horarios_cancha) o 'detallado' (un rango por línea)
+PROMPT_HORARIOS = os.getenv("PROMPT_HORARIOS", "compacto")
+
+def obtener_horarios_validos():
+    """Obtiene los horarios válidos únicos desde el catálogo cacheado"""
+    return obtener_catalogo()['horarios_validos']
 
-client = OpenAI(api_key=api_key)
 
 
 def send_prompt(prompt: str, system_message: str) -> str:
@@ -45,10 +70,14 @@ def send_prompt(prompt: str, system_message: str) -> str:
     messages.append({"role": "user", "content": prompt})
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.8,
+        response = llamar_con_reintentos(
+            lambda timeout: obtener_cliente().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.8,
+                timeout=timeout,
+            ),
+            OPENAI_TIMEOUT_SEGUNDOS
         )
         
         return response.choices[0].message.content.strip()
@@ -60,10 +89,14 @@ def send_prompt_with_history(
     messages: list[dict[str, str]], temperature: float = 0.7
 ) -> str:
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
+        response = llamar_con_reintentos(
+            lambda timeout: obtener_cliente().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout,
+            ),
+            OPENAI_TIMEOUT_SEGUNDOS
         )
         
         return response.choices[0].message.content.strip()
@@ -71,46 +104,25 @@ def send_prompt_with_history(
         raise Exception(f"OpenAI API call failed: {exc}") from exc
 
 
-def build_system_prompt(canchas: list[dict]) -> str:
-    fecha_actual = datetime.now().strftime('%Y-%m-%d')
-    dia_actual = datetime.now().strftime('%A %d de %B de %Y')
-    
-    # Obtener horarios válidos desde la BD
-    horarios_validos = obtener_horarios_validos()
-    
-    # Obtener toda la configuración desde la base de datos
-    from app.models import Configuracion
-    try:
-        cbu_config = Configuracion.query.filter_by(clave='cbu').first()
-        alias_config = Configuracion.query.filter_by(clave='alias').first()
-        business_name_config = Configuracion.query.filter_by(clave='business_name').first()
-        business_kind_config = Configuracion.query.filter_by(clave='business_kind').first()
-        business_address_config = Configuracion.query.filter_by(clave='business_address').first()
-        
-        cbu_actual = cbu_config.valor if cbu_config and cbu_config.valor else ''
-        alias_actual = alias_config.valor if alias_config and alias_config.valor else ''
-        business_name_actual = business_name_config.valor if business_name_config and business_name_config.valor else 'Complejo de Padel'
-        business_kind_actual = business_kind_config.valor if business_kind_config and business_kind_config.valor else 'PadelPro'
-        business_address_actual = business_address_config.valor if business_address_config and business_address_config.valor else '69 entre 119 y 120'
-    except:
-        # Si hay error al consultar la BD, usar valores por defecto
-        cbu_actual = ''
-        alias_actual = ''
-        business_name_actual = 'Complejo de Padel'
-        business_kind_actual = 'PadelPro'
-        business_address_actual = '69 entre 119 y 120'
-    
-    system_prompt = f"""Eres un agente de atención al cliente para {business_name_actual}, un {business_kind_actual} ubicado en {business_address_actual}.
+# Parte estática del prompt ya renderizada: (clave del catálogo, (antes, después) de la línea de fecha)
+_prompt_cache = {'clave': None, 'partes': None}
+
+
+def _render_prompt_estatico(canchas: list[dict], horarios_validos: list[str], config: dict):
+    """Renderiza todo el prompt salvo la línea de la fecha actual"""
+    antes = f"""Eres un agente de atención al cliente para {config['business_name']}, un {config['business_kind']} ubicado en {config['business_address']}.
 
-FECHA ACTUAL: {dia_actual} ({fecha_actual})
+"""
 
-INSTRUCCIONES IMPORTANTES:
+    system_prompt = f"""INSTRUCCIONES IMPORTANTES:
 - Siempre responde en español argentino.
 - Utiliza un tono amigable y profesional.
 - Ayuda a los clientes con información sobre canchas, horarios y reservas.
 - FORMATO DE FECHAS: Cuando hables con los usuarios sobre fechas, SIEMPRE usa el formato día/mes/año (ej: 25/12/2025). Está bien que el usuario hable en lenguaje natural, pero tus respuestas deben mostrar las fechas en formato dd/mm/yyyy.
 - Si el cliente expresa fecha y hora en lenguaje natural (ej: "martes de la semana que viene a las 13"), inferí y convertí automáticamente a formato YYYY-MM-DD y HH:MM usando la fecha actual como referencia. Evitá pedirle el formato si la información ya está presente.
 - Si te piden reservar, PRIMERO verifica la disponibilidad usando la función verificar_disponibilidad.
+- Si el cliente pregunta qué horarios hay libres en varios días o canchas, usá UNA sola llamada a consultar_disponibilidad_rango en lugar de llamar varias veces a verificar_disponibilidad.
+- Cuando verificar_disponibilidad devuelve 'retenida_hasta', el turno queda guardado a nombre del cliente hasta esa hora. Avisale que lo tiene reservado temporalmente y que confirme antes de ese horario.
 - Si la cancha está disponible, NO reserves automáticamente. En su lugar, PRESENTA un resumen claro de los datos de la reserva (Cancha, Fecha, Hora, Precio) y PREGUNTA al usuario si desea confirmar la reserva.
 - Cuando hables de una cancha, menciona su precio también.
 - SOLO cuando el usuario confirme explícitamente (diga "sí", "confirmar", "dale", etc.), llama a la función crear_reserva.
@@ -118,20 +130,22 @@ INSTRUCCIONES IMPORTANTES:
 
 Podés hacer la transferencia de $[MONTO] al CBU:
 
-{cbu_actual}
+{config['cbu']}
 
 o usando el Alias:
 
-{alias_actual}
+{config['alias']}
 - CANCELACIÓN DE RESERVAS: Si el usuario quiere cancelar una reserva, seguí estos pasos:
   1. Usa AUTOMÁTICAMENTE la función listar_reservas_usuario (el sistema ya tiene su número de teléfono, NO se lo pidas)
   2. Si tiene reservas, presentalas de forma clara y numerada (ej: "1. Cancha A - 25/12/2025 a las 18:00-19:00")
   3. Si NO tiene reservas, informale amablemente que no tiene reservas pendientes
   4. Si tiene reservas, preguntá cuál quiere cancelar (puede decir el número, la cancha, o la fecha)
-  5. Una vez que identifiques qué reserva quiere cancelar, usa la función cancelar_reserva_usuario con el ID correcto
+  5. Una vez que identifiques qué reserva quiere cancelar, usa la función cancelar_reserva_usuario con el ID correcto. Si es una semana de un turno fijo (tiene 'turno_fijo_id'), pasá turno_fijo_id y la fecha en formato YYYY-MM-DD: solo se cancela esa semana
   6. Confirmá que la cancelación fue exitosa y recordale que el horario ahora está disponible para otros
   IMPORTANTE: NUNCA le pidas al usuario su número de teléfono, el sistema ya lo tiene automáticamente.
-- Sé proactivo en ayudar a encontrar alternativas si no hay disponibilidad.
+- El historial incluye los resultados de las herramientas que ya usaste en esta conversación. Si ya tenés la lista de reservas del cliente con sus IDs, usala en lugar de volver a llamar a listar_reservas_usuario. La disponibilidad SÍ volvé a verificarla antes de reservar.
+- Si el cliente pide más de un turno (horas seguidas o varias canchas), usá UNA llamada a crear_reservas_multiples con todos los turnos: se reservan todos o ninguno. Informá el monto total.
+- Sé proactivo en ayudar a encontrar alternativas si no hay disponibilidad: usá UNA llamada a buscar_alternativas, que ya devuelve los turnos libres más cercanos en todas las canchas, en lugar de probar cancha por cancha.
 - Los horarios de reserva son ESTRICTOS y ÚNICOS. Debes usar EXACTAMENTE uno de los siguientes rangos para el parámetro 'hora' en las funciones:
   {chr(10).join(['  • ' + h for h in horarios_validos])}
   No inventes otros horarios ni uses formato HH:MM simple si puedes evitarlo.
@@ -141,6 +155,8 @@ o usando el Alias:
     # Agregar información de las canchas
     if canchas:
         system_prompt += "CANCHAS DISPONIBLES:\n\n"
+        if PROMPT_HORARIOS == 'compacto':
+            system_prompt += "(Horarios resumidos por días y franjas. Si necesitás el detalle de una cancha en un día, usá obtener_horarios_cancha)\n\n"
         for cancha in canchas:
             system_prompt += f"📍 {cancha['nombre']}\n"
             if cancha.get('descripcion'):
@@ -149,7 +165,9 @@ o usando el Alias:
             if cancha.get('precio'):
                 system_prompt += f"   Precio: ${cancha['precio']}\n"
             
-            if cancha.get('horarios'):
+            if cancha.get('horarios') and PROMPT_HORARIOS == 'compacto':
+                system_prompt += f"   Horarios: {resumir_horarios(cancha['horarios'])}\n"
+            elif cancha.get('horarios'):
                 system_prompt += "   Horarios disponibles:\n"
                 # Agrupar horarios por día
                 horarios_por_dia = {}
@@ -170,7 +188,29 @@ o usando el Alias:
     else:
         system_prompt += "NOTA: Actualmente no hay canchas registradas en el sistema.\n"
     
-    return system_prompt
+    return antes, system_prompt
+
+
+def build_system_prompt(canchas: list[dict] = None) -> str:
+    """
+    Prompt de sistema del asistente. Sin canchas explícitas usa el catálogo cacheado
+    y solo recalcula la línea de la fecha en cada mensaje.
+    """
+    catalogo = obtener_catalogo()
+    if canchas is None:
+        clave = (catalogo['version'], catalogo['cargado'])
+        if _prompt_cache['clave'] != clave:
+            _prompt_cache['partes'] = _render_prompt_estatico(
+                catalogo['canchas'], catalogo['horarios_validos'], catalogo['config']
+            )
+            _prompt_cache['clave'] = clave
+        antes, despues = _prompt_cache['partes']
+    else:
+        antes, despues = _render_prompt_estatico(canchas, catalogo['horarios_validos'], catalogo['config'])
+
+    fecha_actual = datetime.now().strftime('%Y-%m-%d')
+    dia_actual = datetime.now().strftime('%A %d de %B de %Y')
+    return f"{antes}FECHA ACTUAL: {dia_actual} ({fecha_actual})\n\n{despues}"
 
 
 def get_function_definitions():
@@ -198,6 +238,78 @@ def get_function_definitions():
                 "required": ["cancha_nombre", "fecha", "hora"]
             }
         },
+        {
+            "name": "consultar_disponibilidad_rango",
+            "description": "Devuelve en una sola consulta los horarios libres de todas las canchas (o de las indicadas) para un rango de fechas. Usar cuando el cliente busca opciones en varios días, canchas u horarios.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "fecha_desde": {
+                        "type": "string",
+                        "description": "Fecha inicial en formato YYYY-MM-DD"
+                    },
+                    "fecha_hasta": {
+                        "type": "string",
+                        "description": "Fecha final (inclusive) en formato YYYY-MM-DD. Si se omite, se consulta solo fecha_desde"
+                    },
+                    "canchas": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Nombres exactos de las canchas a consultar (opcional, por defecto todas)"
+                    },
+                    "horas": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Horarios a consultar en formato HH:MM o rango HH:MM-HH:MM (opcional, por defecto todos)"
+                    }
+                },
+                "required": ["fecha_desde"]
+            }
+        },
+        {
+            "name": "buscar_alternativas",
+            "description": "Busca los turnos libres más cercanos a una fecha y hora pedidas, en todas las canchas, ordenados por cercanía (misma cancha primero y luego menor precio). Usar cuando el turno pedido no está disponible.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "fecha": {
+                        "type": "string",
+                        "description": "La fecha pedida en formato YYYY-MM-DD"
+                    },
+                    "hora": {
+                        "type": "string",
+                        "description": "La hora pedida en formato HH:MM"
+                    },
+                    "cancha_nombre": {
+                        "type": "string",
+                        "description": "La cancha pedida (opcional)"
+                    },
+                    "cantidad": {
+                        "type": "integer",
+                        "description": "Cantidad de alternativas a devolver (opcional, por defecto 5)"
+                    }
+                },
+                "required": ["fecha", "hora"]
+            }
+        },
+        {
+            "name": "obtener_horarios_cancha",
+            "description": "Devuelve los horarios de atención de una cancha día por día. Usar solo cuando el resumen de horarios del prompt no alcanza (ej: el cliente pregunta por un día puntual).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "cancha_nombre": {
+                        "type": "string",
+                        "description": "El nombre exacto de la cancha"
+                    },
+                    "dia": {
+                        "type": "string",
+                        "description": "Día de la semana (ej: 'Martes'). Opcional: sin día devuelve toda la semana"
+                    }
+                },
+                "required": ["cancha_nombre"]
+            }
+        },
         {
             "name": "crear_reserva",
             "description": "Crea una reserva para una cancha en una fecha y hora específica. Solo llamar después de verificar disponibilidad y confirmar con el cliente.",
@@ -224,6 +336,42 @@ def get_function_definitions():
                 "required": ["cancha_nombre", "fecha", "hora"]
             }
         },
+        {
+            "name": "crear_reservas_multiples",
+            "description": "Reserva varios turnos en un solo pedido (ej: dos horas seguidas o dos canchas el mismo día). Se reservan todos o ninguno. Usar en lugar de varias llamadas a crear_reserva cuando el cliente pide más de un turno.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "reservas": {
+                        "type": "array",
+                        "description": "Turnos a reservar",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "cancha_nombre": {
+                                    "type": "string",
+                                    "description": "El nombre exacto de la cancha"
+                                },
+                                "fecha": {
+                                    "type": "string",
+                                    "description": "La fecha en formato YYYY-MM-DD"
+                                },
+                                "hora": {
+                                    "type": "string",
+                                    "description": "El rango horario, por ejemplo 08:00-09:00"
+                                }
+                            },
+                            "required": ["cancha_nombre", "fecha", "hora"]
+                        }
+                    },
+                    "cliente_nombre": {
+                        "type": "string",
+                        "description": "Nombre del cliente (opcional)"
+                    }
+                },
+                "required": ["reservas"]
+            }
+        },
         {
             "name": "listar_reservas_usuario",
             "description": "Lista todas las reservas pendientes (en estado 'iniciada') del usuario actual. El sistema automáticamente identifica al usuario. Usar cuando el usuario quiera ver sus reservas o antes de cancelar una.",
@@ -242,48 +390,281 @@ def get_function_definitions():
                     "reserva_id": {
                         "type": "integer",
                         "description": "ID de la reserva a cancelar"
+                    },
+                    "turno_fijo_id": {
+                        "type": "integer",
+                        "description": "ID del turno fijo, solo para cancelar una semana de un turno fijo (en lugar de reserva_id)"
+                    },
+                    "fecha": {
+                        "type": "string",
+                        "description": "Fecha de la semana del turno fijo a cancelar, en formato YYYY-MM-DD"
                     }
                 },
-                "required": ["reserva_id"]
+                "required": []
             }
         }
     ]
 
 
-def chat_with_assistant(
-    user_message: str, 
-    canchas: list[dict], 
-    conversation_history: list[dict] = None,
-    verificar_disponibilidad_func = None,
-    crear_reserva_func = None,
-    listar_reservas_func = None,
-    cancelar_reserva_func = None,
-    usuario: str = None
-) -> str:
-    system_prompt = build_system_prompt(canchas)
-    messages = [{"role": "system", "content": system_prompt}]
+# Normalizar fecha/hora si están en lenguaje natural
+def _normalize_args(args: dict):
+    out = dict(args)
+    # Normalizar fechas
+    for clave_fecha in ("fecha", "fecha_desde", "fecha_hasta"):
+        fecha = out.get(clave_fecha)
+        if fecha and not re.match(r"^\d{4}-\d{2}-\d{2}$", str(fecha)):
+            print(f"DEBUG: Normalizando fecha '{fecha}'")
+            dt = dateparser.parse(str(fecha), languages=["es"], settings={
+                "RELATIVE_BASE": datetime.now(),
+                "PREFER_DATES_FROM": "future",
+            })
+            if dt:
+                out[clave_fecha] = dt.strftime("%Y-%m-%d")
+                print(f"DEBUG: Fecha normalizada a '{out[clave_fecha]}'")
+    
+    # Normalizar hora (ahora soportamos rangos en strings, intentamos conservarlos)
+    # Si viene algo como "8" o "8pm", dateparser ayuda, pero si ya es rango "08:00-09:00" lo dejamos
+    hora = out.get("hora")
+    if hora:
+        # Si parece un rango 'HH:MM-HH:MM', lo dejamos pasar
+        if re.match(r"^\d{2}:\d{2}-\d{2}:\d{2}$", str(hora)):
+            pass
+        elif not re.match(r"^\d{2}:\d{2}$", str(hora)):
+            print(f"DEBUG: Normalizando hora '{hora}'")
+            dt_h = dateparser.parse(str(hora), languages=["es"], settings={
+                "RELATIVE_BASE": datetime.now(),
+            })
+            if dt_h:
+                # OJO: Aquí simplificamos a HH:MM si el LLM mandó "8 pm".
+                # Pero nuestro backend espera rangos "HH:MM-HH:MM".
+                # Si el LLM no mandó rango, el backend fallará o necesitará adaptación.
+                # Por ahora asumimos que el prompt instruye al LLM a usar los rangos disponibles.
+                out["hora"] = dt_h.strftime("%H:%M")
+                print(f"DEBUG: Hora normalizada a '{out['hora']}'")
+                
+    return out
+
+
+def _ejecutar_herramienta(function_name: str, function_args: dict, usuario: str = None, funcs: dict = None):
+    """
+    Ejecuta una herramienta pedida por el modelo.
+
+    Args:
+        funcs: Funciones recibidas por chat_with_assistant (verificar_disponibilidad_func, ...)
+    """
+    funcs = funcs or {}
+    function_args = _normalize_args(function_args)
+    print(f"DEBUG: Ejecutando herramienta {function_name} con args: {function_args}")
+    
+    # Llamar a la función correspondiente
+    if function_name == "verificar_disponibilidad" and funcs.get('verificar_disponibilidad_func'):
+        # Con el teléfono del usuario el turno libre queda retenido hasta que confirme
+        if _telefono_inyectable(usuario):
+            function_args['telefono'] = usuario
+        return funcs['verificar_disponibilidad_func'](**function_args)
+    elif function_name == "consultar_disponibilidad_rango" and funcs.get('disponibilidad_rango_func'):
+        return funcs['disponibilidad_rango_func'](**function_args)
+    elif function_name == "buscar_alternativas" and funcs.get('alternativas_func'):
+        return funcs['alternativas_func'](**function_args)
+    elif function_name == "obtener_horarios_cancha":
+        return obtener_horarios_cancha(**function_args)
+    elif function_name == "crear_reserva" and funcs.get('crear_reserva_func'):
+        # Agregar el teléfono del usuario si está disponible
+        if _telefono_inyectable(usuario):
+            function_args['telefono'] = usuario
+        return funcs['crear_reserva_func'](**function_args)
+    elif function_name == "crear_reservas_multiples" and funcs.get('reservas_multiples_func'):
+        # Normalizar fecha/hora de cada turno del pedido
+        function_args['reservas'] = [_normalize_args(item) for item in function_args.get('reservas') or []]
+        if _telefono_inyectable(usuario):
+            function_args['telefono'] = usuario
+        return funcs['reservas_multiples_func'](**function_args)
+    elif function_name == "listar_reservas_usuario" and funcs.get('listar_reservas_func'):
+        # SIEMPRE usar el teléfono del usuario actual, ignorar lo que el LLM envíe
+        if usuario:
+            function_args['telefono'] = usuario
+        return funcs['listar_reservas_func'](**function_args)
+    elif function_name == "cancelar_reserva_usuario" and funcs.get('cancelar_reserva_func'):
+        # SIEMPRE usar el teléfono del usuario actual, ignorar lo que el LLM envíe
+        if usuario:
+            function_args['telefono'] = usuario
+        return funcs['cancelar_reserva_func'](**function_args)
+    return {"error": "Función no disponible"}
+
+
+def _mensajes_iniciales(user_message: str, canchas: list[dict] = None, conversation_history: list[dict] = None):
+    messages = [{"role": "system", "content": build_system_prompt(canchas)}]
     if conversation_history:
         messages.extend(conversation_history)
-
     messages.append({"role": "user", "content": user_message})
-    
+    return messages
+
+
+def _mensaje_herramienta(tool_call_id: str, function_name: str, function_response) -> dict:
+    return {
+        "role": "tool",
+        "tool_call_id": tool_call_id,
+        "name": function_name,
+        "content": json.dumps(function_response, ensure_ascii=False)
+    }
+
+
+class _MotorAsistente:
+    """
+    Event loop propio en un hilo de fondo, compartido por todos los requests.
+    El cliente async del LLM y su pool de conexiones viven en ese loop; las
+    herramientas corren en un pool de hilos con el contexto de la app Flask.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._cliente = None
+        self.pool = ThreadPoolExecutor(max_workers=HERRAMIENTAS_WORKERS, thread_name_prefix="herramientas")
+
+    def _iniciar(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="motor-asistente", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def cliente(self):
+        # Solo se usa dentro del loop del motor
+        if self._cliente is None:
+            self._cliente = obtener_cliente_async(timeout=OPENAI_TIMEOUT_SEGUNDOS)
+        return self._cliente
+
+    def ejecutar(self, corrutina):
+        """Ejecuta una corrutina en el loop del motor y espera el resultado"""
+        return asyncio.run_coroutine_threadsafe(corrutina, self._iniciar()).result()
+
+
+_MOTOR = _MotorAsistente()
+
+
+def _con_contexto(app, funcion, *args):
+    if app is None:
+        return funcion(*args)
+    with app.app_context():
+        return funcion(*args)
+
+
+async def _en_pool(app, funcion, *args):
+    """Ejecuta una función bloqueante (BD) en el pool de herramientas"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_MOTOR.pool, functools.partial(_con_contexto, app, funcion, *args))
+
+
+def _ejecutar_herramienta_medida(medicion, function_name: str, function_args: dict, usuario: str = None, funcs: dict = None):
+    inicio = time.perf_counter()
+    try:
+        return _ejecutar_herramienta(function_name, function_args, usuario, funcs)
+    finally:
+        if medicion is not None:
+            medicion.registrar_herramienta(function_name, time.perf_counter() - inicio)
+
+
+def _telefono_inyectable(usuario: str) -> bool:
+    """Indica si el teléfono del usuario se pasa a las herramientas que reservan o retienen"""
+    return bool(usuario and usuario != '99999999')
+
+
+async def _ejecutar_herramientas(tool_calls, usuario: str, funcs: dict, app, medicion=None) -> list[dict]:
+    """
+    Ejecuta las herramientas de un turno respetando el orden pedido por el modelo:
+    las consecutivas de HERRAMIENTAS_PARALELAS corren en paralelo, el resto de a una.
+    """
+    mensajes = []
+    lote = []
+
+    async def vaciar_lote():
+        if not lote:
+            return
+        respuestas = await asyncio.gather(*(
+            _en_pool(app, _ejecutar_herramienta_medida, medicion, tc.function.name, json.loads(tc.function.arguments or '{}'), usuario, funcs)
+            for tc in lote
+        ))
+        mensajes.extend(_mensaje_herramienta(tc.id, tc.function.name, r) for tc, r in zip(lote, respuestas))
+        lote.clear()
+
+    retiene = _telefono_inyectable(usuario)
+    for tool_call in tool_calls:
+        nombre = tool_call.function.name
+        if nombre in HERRAMIENTAS_PARALELAS and not (retiene and nombre in HERRAMIENTAS_CON_RETENCION):
+            lote.append(tool_call)
+            continue
+        await vaciar_lote()
+        respuesta = await _en_pool(
+            app, _ejecutar_herramienta_medida, medicion, tool_call.function.name,
+            json.loads(tool_call.function.arguments or '{}'), usuario, funcs
+        )
+        mensajes.append(_mensaje_herramienta(tool_call.id, tool_call.function.name, respuesta))
+    await vaciar_lote()
+    return mensajes
+
+
+async def chat_with_assistant_async(
+    user_message: str,
+    canchas: list[dict] = None,
+    conversation_history: list[dict] = None,
+    usuario: str = None,
+    app = None,
+    mensajes_herramientas: list = None,
+    **funcs
+) -> str:
+    """
+    Motor async del asistente: cliente async del LLM con timeout por llamada y
+    herramientas independientes ejecutadas en paralelo.
+
+    Args:
+        app: App Flask para el contexto de las herramientas (acceden a la BD)
+        mensajes_herramientas: Lista opcional donde se agregan, en orden, las
+            llamadas a herramientas y sus resultados (formato OpenAI) para guardarlos
+        funcs: Las mismas funciones *_func que recibe chat_with_assistant
+    """
+    from app.services.intenciones import responder_sin_llm, ESTADISTICAS
+
+    # Tokens, vueltas, herramientas y duración del mensaje (tabla metrica_turno)
+    medicion = MedicionTurno(model)
+
+    # Consultas frecuentes con intención clara: se responden sin llamar al modelo
+    respuesta = await _en_pool(app, responder_sin_llm, user_message, usuario, funcs)
+    if respuesta:
+        await _en_pool(app, guardar_medicion, medicion, usuario, 'rapido')
+        return respuesta
+
+    inicio = time.perf_counter()
+    try:
+        return await _loop_asistente_async(
+            user_message, canchas, conversation_history, usuario, app, funcs, medicion,
+            mensajes_herramientas if mensajes_herramientas is not None else []
+        )
+    finally:
+        ESTADISTICAS.registrar_llm(time.perf_counter() - inicio)
+        await _en_pool(app, guardar_medicion, medicion, usuario, 'llm')
+
+
+async def _loop_asistente_async(user_message, canchas, conversation_history, usuario, app, funcs, medicion, intermedios) -> str:
+    messages = await _en_pool(app, _mensajes_iniciales, user_message, canchas, conversation_history)
     tools = [{"type": "function", "function": func} for func in get_function_definitions()]
     
     # Loop para manejar múltiples llamadas a herramientas consecutivas (ej: verificar -> reservar)
-    max_turns = 5
-    turn_count = 0
-    
-    while turn_count < max_turns:
-        turn_count += 1
-        
+    for _ in range(LLM_MAX_VUELTAS):
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.7,
-                tools=tools,
-                tool_choice="auto"
+            response = await llamar_con_reintentos_async(
+                lambda timeout: _MOTOR.cliente().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    tools=tools,
+                    tool_choice="auto",
+                    timeout=timeout
+                ),
+                OPENAI_TIMEOUT_SEGUNDOS
             )
+            medicion.registrar_llamada(response.usage)
             
             response_message = response.choices[0].message
             
@@ -291,85 +672,182 @@ def chat_with_assistant(
             if not response_message.tool_calls:
                 return response_message.content.strip()
             
-            # Agregar la respuesta del asistente (con tool_calls) al historial
+            # Agregar la respuesta del asistente (con tool_calls) y los resultados al historial
+            resultados = await _ejecutar_herramientas(response_message.tool_calls, usuario, funcs, app, medicion)
             messages.append(response_message)
-            
-            # Ejecutar cada función llamada
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                
-                # Normalizar fecha/hora si están en lenguaje natural
-                def _normalize_args(args: dict):
-                    out = dict(args)
-                    # Normalizar fecha
-                    fecha = out.get("fecha")
-                    if fecha and not re.match(r"^\d{4}-\d{2}-\d{2}$", str(fecha)):
-                        print(f"DEBUG: Normalizando fecha '{fecha}'")
-                        dt = dateparser.parse(str(fecha), languages=["es"], settings={
-                            "RELATIVE_BASE": datetime.now(),
-                            "PREFER_DATES_FROM": "future",
-                        })
-                        if dt:
-                            out["fecha"] = dt.strftime("%Y-%m-%d")
-                            print(f"DEBUG: Fecha normalizada a '{out['fecha']}'")
-                    
-                    # Normalizar hora (ahora soportamos rangos en strings, intentamos conservarlos)
-                    # Si viene algo como "8" o "8pm", dateparser ayuda, pero si ya es rango "08:00-09:00" lo dejamos
-                    hora = out.get("hora")
-                    if hora:
-                        # Si parece un rango 'HH:MM-HH:MM', lo dejamos pasar
-                        if re.match(r"^\d{2}:\d{2}-\d{2}:\d{2}$", str(hora)):
-                            pass
-                        elif not re.match(r"^\d{2}:\d{2}$", str(hora)):
-                            print(f"DEBUG: Normalizando hora '{hora}'")
-                            dt_h = dateparser.parse(str(hora), languages=["es"], settings={
-                                "RELATIVE_BASE": datetime.now(),
-                            })
-                            if dt_h:
-                                # OJO: Aquí simplificamos a HH:MM si el LLM mandó "8 pm".
-                                # Pero nuestro backend espera rangos "HH:MM-HH:MM".
-                                # Si el LLM no mandó rango, el backend fallará o necesitará adaptación.
-                                # Por ahora asumimos que el prompt instruye al LLM a usar los rangos disponibles.
-                                out["hora"] = dt_h.strftime("%H:%M")
-                                print(f"DEBUG: Hora normalizada a '{out['hora']}'")
-                                
-                    return out
-                
-                function_args = _normalize_args(function_args)
-                print(f"DEBUG: Ejecutando herramienta {function_name} con args: {function_args}")
-                
-                # Llamar a la función correspondiente
-                if function_name == "verificar_disponibilidad" and verificar_disponibilidad_func:
-                    function_response = verificar_disponibilidad_func(**function_args)
-                elif function_name == "crear_reserva" and crear_reserva_func:
-                    # Agregar el teléfono del usuario si está disponible
-                    if usuario and usuario != '99999999':
-                        function_args['telefono'] = usuario
-                    function_response = crear_reserva_func(**function_args)
-                elif function_name == "listar_reservas_usuario" and listar_reservas_func:
-                    # SIEMPRE usar el teléfono del usuario actual, ignorar lo que el LLM envíe
-                    if usuario:
-                        function_args['telefono'] = usuario
-                    function_response = listar_reservas_func(**function_args)
-                elif function_name == "cancelar_reserva_usuario" and cancelar_reserva_func:
-                    # SIEMPRE usar el teléfono del usuario actual, ignorar lo que el LLM envíe
-                    if usuario:
-                        function_args['telefono'] = usuario
-                    function_response = cancelar_reserva_func(**function_args)
-                else:
-                    function_response = {"error": "Función no disponible"}
-                
-                # Agregar la respuesta de la función a los mensajes
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": function_name,
-                    "content": json.dumps(function_response, ensure_ascii=False)
-                })
+            messages.extend(resultados)
+            intermedios.append(response_message.model_dump(exclude_none=True))
+            intermedios.extend(resultados)
                 
+        except CircuitoAbiertoError:
+            medicion.resultado = 'circuito_abierto'
+            return RESPUESTA_NO_DISPONIBLE
+        except (asyncio.TimeoutError, openai.APITimeoutError):
+            print(f"Timeout en chat loop ({OPENAI_TIMEOUT_SEGUNDOS}s por intento)")
+            medicion.resultado = 'timeout'
+            return "Lo siento, el asistente está tardando demasiado. Probá de nuevo en un momento."
         except Exception as e:
             print(f"Error en chat loop: {e}")
+            medicion.resultado = 'error'
             return "Lo siento, hubo un error al procesar tu solicitud."
 
-    return "Lo siento, la operación está tomando demasiados pasos."
\ No newline at end of file
+    medicion.resultado = 'max_pasos'
+    return "Lo siento, la operación está tomando demasiados pasos."
+
+
+def chat_with_assistant(
+    user_message: str, 
+    canchas: list[dict] = None, 
+    conversation_history: list[dict] = None,
+    verificar_disponibilidad_func = None,
+    crear_reserva_func = None,
+    listar_reservas_func = None,
+    cancelar_reserva_func = None,
+    usuario: str = None,
+    disponibilidad_rango_func = None,
+    alternativas_func = None,
+    reservas_multiples_func = None,
+    mensajes_herramientas: list = None
+) -> str:
+    """Interfaz sincrónica de chat_with_assistant_async para los blueprints"""
+    app = current_app._get_current_object() if has_app_context() else None
+    return _MOTOR.ejecutar(chat_with_assistant_async(
+        user_message,
+        canchas,
+        conversation_history,
+        usuario=usuario,
+        app=app,
+        mensajes_herramientas=mensajes_herramientas,
+        verificar_disponibilidad_func=verificar_disponibilidad_func,
+        crear_reserva_func=crear_reserva_func,
+        listar_reservas_func=listar_reservas_func,
+        cancelar_reserva_func=cancelar_reserva_func,
+        disponibilidad_rango_func=disponibilidad_rango_func,
+        alternativas_func=alternativas_func,
+        reservas_multiples_func=reservas_multiples_func
+    ))
+
+
+def chat_with_assistant_stream(
+    user_message: str,
+    canchas: list[dict] = None,
+    conversation_history: list[dict] = None,
+    usuario: str = None,
+    mensajes_herramientas: list = None,
+    **funcs
+):
+    """
+    Variante de chat_with_assistant con la API de streaming del LLM.
+
+    Genera eventos (dict con 'tipo'):
+        - 'token': {'texto'} fragmento de la respuesta a medida que llega
+        - 'herramienta': {'nombre', 'estado': 'inicio' | 'fin'} progreso de las herramientas
+        - 'fin': {'respuesta'} texto final completo (siempre es el último evento)
+
+    Args:
+        mensajes_herramientas: Igual que en chat_with_assistant_async
+        funcs: Las mismas funciones *_func que recibe chat_with_assistant
+    """
+    from app.services.intenciones import responder_sin_llm, ESTADISTICAS
+
+    medicion = MedicionTurno(model)
+
+    respuesta = responder_sin_llm(user_message, usuario, funcs)
+    if respuesta:
+        guardar_medicion(medicion, usuario, 'rapido')
+        yield {'tipo': 'fin', 'respuesta': respuesta}
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield from _loop_asistente_stream(
+            user_message, canchas, conversation_history, usuario, funcs, medicion,
+            mensajes_herramientas if mensajes_herramientas is not None else []
+        )
+    finally:
+        ESTADISTICAS.registrar_llm(time.perf_counter() - inicio)
+        guardar_medicion(medicion, usuario, 'stream')
+
+
+def _loop_asistente_stream(user_message, canchas, conversation_history, usuario, funcs, medicion, intermedios):
+    messages = _mensajes_iniciales(user_message, canchas, conversation_history)
+    tools = [{"type": "function", "function": func} for func in get_function_definitions()]
+
+    for _ in range(LLM_MAX_VUELTAS):
+        try:
+            # Se reintenta solo la apertura del stream: con tokens ya enviados no hay vuelta atrás
+            stream = llamar_con_reintentos(
+                lambda timeout: obtener_cliente().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    tools=tools,
+                    tool_choice="auto",
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ),
+                OPENAI_TIMEOUT_SEGUNDOS
+            )
+
+            contenido = []
+            tool_calls = {}  # índice -> {'id', 'name', 'arguments'}
+            usage = None
+            for chunk in stream:
+                # El último chunk trae el uso de tokens, sin choices
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    contenido.append(delta.content)
+                    yield {'tipo': 'token', 'texto': delta.content}
+                for parcial in delta.tool_calls or []:
+                    llamada = tool_calls.setdefault(parcial.index, {'id': None, 'name': '', 'arguments': ''})
+                    if parcial.id:
+                        llamada['id'] = parcial.id
+                    if parcial.function and parcial.function.name:
+                        llamada['name'] += parcial.function.name
+                    if parcial.function and parcial.function.arguments:
+                        llamada['arguments'] += parcial.function.arguments
+            medicion.registrar_llamada(usage)
+
+            # Sin herramientas: la respuesta ya se envió token a token
+            if not tool_calls:
+                yield {'tipo': 'fin', 'respuesta': ''.join(contenido).strip()}
+                return
+
+            llamadas = [tool_calls[i] for i in sorted(tool_calls)]
+            mensaje_llamadas = {
+                "role": "assistant",
+                "content": ''.join(contenido) or None,
+                "tool_calls": [
+                    {"id": c['id'], "type": "function", "function": {"name": c['name'], "arguments": c['arguments']}}
+                    for c in llamadas
+                ]
+            }
+            messages.append(mensaje_llamadas)
+            resultados = []
+            for llamada in llamadas:
+                yield {'tipo': 'herramienta', 'nombre': llamada['name'], 'estado': 'inicio'}
+                function_response = _ejecutar_herramienta_medida(
+                    medicion, llamada['name'], json.loads(llamada['arguments'] or '{}'), usuario, funcs
+                )
+                resultados.append(_mensaje_herramienta(llamada['id'], llamada['name'], function_response))
+                yield {'tipo': 'herramienta', 'nombre': llamada['name'], 'estado': 'fin'}
+            messages.extend(resultados)
+            intermedios.append(mensaje_llamadas)
+            intermedios.extend(resultados)
+
+        except CircuitoAbiertoError:
+            medicion.resultado = 'circuito_abierto'
+            yield {'tipo': 'fin', 'respuesta': RESPUESTA_NO_DISPONIBLE}
+            return
+        except Exception as e:
+            print(f"Error en chat stream: {e}")
+            medicion.resultado = 'error'
+            yield {'tipo': 'fin', 'respuesta': "Lo siento, hubo un error al procesar tu solicitud."}
+            return
+
+    medicion.resultado = 'max_pasos'
+    yield {'tipo': 'fin', 'respuesta': "Lo siento, la operación está tomando demasiados pasos."}
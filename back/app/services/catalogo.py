@@ -0,0 +1,199 @@
+"""
+Catálogo de canchas, horarios y configuración del negocio para el asistente.
+
+Se carga con una consulta para canchas y sus horarios, otra para los horarios
+válidos y otra para la configuración, y se cachea por proceso junto con la
+versión guardada en Configuracion ('catalogo_version'). Toda escritura sobre
+canchas, horarios o configuración cambia esa versión con
+marcar_catalogo_modificado(), así que cada mensaje solo consulta esa fila y
+los demás procesos ven el cambio en el mensaje siguiente.
+"""
+import os
+import threading
+import time
+import uuid
+
+from app.models import db, Cancha, CanchaHorario, Horario, Configuracion
+from app.services.slots import DIAS_SEMANA, _minutos
+
+
+CLAVE_VERSION = 'catalogo_version'
+
+# Recarga de seguridad para cambios hechos directo en la base (scripts, consola)
+CATALOGO_MAX_SEGUNDOS = int(os.getenv('CATALOGO_MAX_SEGUNDOS', 300))
+
+CONFIG_PREDETERMINADA = {
+    'cbu': '',
+    'alias': '',
+    'business_name': 'Complejo de Padel',
+    'business_kind': 'PadelPro',
+    'business_address': '69 entre 119 y 120'
+}
+
+HORARIOS_PREDETERMINADOS = ['08:00-09:00', '09:00-10:00', '10:00-11:00', '11:00-12:00',
+                            '12:00-13:00', '13:00-14:00', '14:00-15:00', '15:00-16:00',
+                            '16:00-17:00', '17:00-18:00', '18:00-19:00', '19:00-20:00',
+                            '20:00-21:00', '21:00-22:00', '22:00-23:00']
+
+# Abreviaturas para el resumen compacto de horarios
+DIAS_ABREVIADOS = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
+
+_cache = {'version': None, 'cargado': 0.0, 'catalogo': None}
+_lock = threading.Lock()
+
+
+def version_catalogo() -> str:
+    fila = db.session.query(Configuracion.valor).filter_by(clave=CLAVE_VERSION).first()
+    return fila[0] if fila and fila[0] else ''
+
+
+def marcar_catalogo_modificado():
+    """
+    Cambia la versión del catálogo. Se llama dentro de la transacción que modifica
+    canchas, horarios o configuración, antes del commit.
+    """
+    nueva = uuid.uuid4().hex[:16]
+    fila = Configuracion.query.filter_by(clave=CLAVE_VERSION).first()
+    if fila:
+        fila.valor = nueva
+    else:
+        db.session.add(Configuracion(clave=CLAVE_VERSION, valor=nueva))
+    return nueva
+
+
+def _cargar_canchas():
+    """Canchas con sus horarios en una sola consulta (sin N+1 sobre CanchaHorario/Horario)"""
+    filas = (
+        db.session.query(Cancha, Horario.dia, Horario.hora)
+        .outerjoin(CanchaHorario, CanchaHorario.cancha_id == Cancha.id)
+        .outerjoin(Horario, CanchaHorario.horario_id == Horario.id)
+        .order_by(Cancha.id, CanchaHorario.id)
+        .all()
+    )
+    canchas = {}
+    for cancha, dia, hora in filas:
+        info = canchas.get(cancha.id)
+        if info is None:
+            info = canchas[cancha.id] = {
+                'id': cancha.id,
+                'nombre': cancha.nombre,
+                'descripcion': cancha.descripcion or '',
+                'cantidad': cancha.cantidad,
+                'precio': cancha.precio,
+                'horarios': []
+            }
+        if hora is not None:
+            info['horarios'].append({'dia': dia, 'hora': hora})
+    return list(canchas.values())
+
+
+def _cargar_horarios_validos():
+    try:
+        horarios = db.session.query(Horario.hora).distinct().all()
+        return sorted(h.hora for h in horarios)
+    except Exception as e:
+        print(f"Error al obtener horarios de la BD: {e}")
+        return list(HORARIOS_PREDETERMINADOS)
+
+
+def _cargar_configuracion():
+    config = dict(CONFIG_PREDETERMINADA)
+    try:
+        filas = Configuracion.query.filter(Configuracion.clave.in_(list(CONFIG_PREDETERMINADA))).all()
+        for fila in filas:
+            # Los datos del negocio vacíos caen al valor por defecto, CBU y alias quedan vacíos
+            if fila.valor or not CONFIG_PREDETERMINADA[fila.clave]:
+                config[fila.clave] = fila.valor or ''
+    except Exception as e:
+        print(f"Error al obtener la configuración de la BD: {e}")
+    return config
+
+
+def obtener_catalogo():
+    """
+    Catálogo vigente: {'version', 'cargado', 'canchas', 'horarios_validos', 'config'}.
+    Es compartido entre requests: no modificarlo.
+    """
+    version = version_catalogo()
+    catalogo = _cache['catalogo']
+    if (
+        catalogo is not None
+        and _cache['version'] == version
+        and time.monotonic() - _cache['cargado'] < CATALOGO_MAX_SEGUNDOS
+    ):
+        return catalogo
+
+    cargado = time.monotonic()
+    catalogo = {
+        'version': version,
+        'cargado': cargado,
+        'canchas': _cargar_canchas(),
+        'horarios_validos': _cargar_horarios_validos(),
+        'config': _cargar_configuracion()
+    }
+    with _lock:
+        _cache.update(version=version, cargado=cargado, catalogo=catalogo)
+    return catalogo
+
+
+def _formatear_minutos(minutos: int) -> str:
+    horas, resto = divmod(minutos, 60)
+    return f'{horas:02d}' if not resto else f'{horas:02d}:{resto:02d}'
+
+
+def _bloques_del_dia(horas):
+    """Une rangos contiguos "08:00-09:00", "09:00-10:00" en bloques (inicio, fin) en minutos"""
+    rangos = sorted((_minutos(h.split('-')[0]), _minutos(h.split('-')[1])) for h in horas if '-' in h)
+    bloques = []
+    for inicio, fin in rangos:
+        if bloques and inicio <= bloques[-1][1]:
+            bloques[-1][1] = max(bloques[-1][1], fin)
+        else:
+            bloques.append([inicio, fin])
+    return tuple(f'{_formatear_minutos(i)}–{_formatear_minutos(f)}' for i, f in bloques)
+
+
+def resumir_horarios(horarios: list[dict]) -> str:
+    """
+    Resumen compacto de la grilla semanal de una cancha, ej: "Lun–Vie 08–23; Sáb–Dom 10–14".
+    Agrupa días consecutivos con la misma grilla y une rangos contiguos.
+    """
+    por_dia = {}
+    for h in horarios:
+        por_dia.setdefault(h['dia'], []).append(h['hora'])
+
+    grupos = []  # [dia_desde, dia_hasta, bloques]
+    for i, dia in enumerate(DIAS_SEMANA):
+        bloques = _bloques_del_dia(por_dia.get(dia, []))
+        if not bloques:
+            continue
+        if grupos and grupos[-1][1] == i - 1 and grupos[-1][2] == bloques:
+            grupos[-1][1] = i
+        else:
+            grupos.append([i, i, bloques])
+
+    partes = []
+    for desde, hasta, bloques in grupos:
+        dias = DIAS_ABREVIADOS[desde] if desde == hasta else f'{DIAS_ABREVIADOS[desde]}–{DIAS_ABREVIADOS[hasta]}'
+        partes.append(f"{dias} {', '.join(bloques)}")
+    return '; '.join(partes)
+
+
+def obtener_horarios_cancha(cancha_nombre: str, dia: str = None):
+    """Detalle de los horarios de una cancha por día (herramienta del asistente)"""
+    catalogo = obtener_catalogo()
+    cancha = next((c for c in catalogo['canchas'] if c['nombre'].lower() == (cancha_nombre or '').lower()), None)
+    if not cancha:
+        return {'exito': False, 'error': f'No se encontró la cancha "{cancha_nombre}"'}
+
+    por_dia = {}
+    for h in cancha['horarios']:
+        por_dia.setdefault(h['dia'], []).append(h['hora'])
+    if dia:
+        dia = dia.strip().capitalize()
+        por_dia = {dia: por_dia.get(dia, [])}
+    return {
+        'exito': True,
+        'cancha': cancha['nombre'],
+        'horarios': {d: sorted(horas) for d, horas in por_dia.items()}
+    }
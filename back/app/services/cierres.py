@@ -0,0 +1,232 @@
+"""
+Cierres y feriados.
+
+Los registros de FechaHorarioNo cierran un rango de fechas, opcionalmente solo
+una franja horaria y/o una cancha. Se cargan una vez en un índice en memoria
+ordenado por fecha de inicio y se recargan cuando este proceso escribe un
+cierre o, para los demás procesos, al vencer CIERRES_TTL_SEGUNDOS. Cerrar un
+feriado es un solo registro en lugar de un bloqueo por cancha y turno.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.models import db, Reserva, Estado, Horario, FechaHorarioNo
+from app.services.slots import SLOTS, _minutos
+
+
+ESTADO_CERRADA = 'cerrada'
+
+# Tiempo máximo que otro proceso puede tardar en ver un cierre nuevo
+CIERRES_TTL_SEGUNDOS = int(os.getenv('CIERRES_TTL_SEGUNDOS', 60))
+
+_DIA_COMPLETO = (0, 24 * 60)
+
+Cierre = namedtuple('Cierre', 'id desde hasta cancha_id inicio fin motivo')
+
+
+def _a_cierre(registro, hora_horario=None):
+    """Convierte un FechaHorarioNo en un Cierre con la franja en minutos [inicio, fin)"""
+    if registro.hora_desde or registro.hora_hasta:
+        inicio = _minutos(registro.hora_desde) if registro.hora_desde else 0
+        fin = _minutos(registro.hora_hasta) if registro.hora_hasta else _DIA_COMPLETO[1]
+    elif hora_horario:
+        # Formato original: el cierre es exactamente ese rango "HH:MM-HH:MM"
+        inicio, fin = (_minutos(h) for h in hora_horario.split('-'))
+    else:
+        inicio, fin = _DIA_COMPLETO
+    return Cierre(
+        registro.id, registro.fecha, registro.fecha_hasta or registro.fecha,
+        registro.cancha_id, inicio, fin, registro.motivo
+    )
+
+
+class IndiceCierres:
+    """Índice en memoria de cierres por fecha de inicio"""
+
+    def __init__(self, ttl=CIERRES_TTL_SEGUNDOS):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._cierres = []
+        self._inicios = []
+        self._cargado = None
+
+    def invalidar(self):
+        self._cargado = None
+
+    def _cargar(self):
+        filas = (
+            db.session.query(FechaHorarioNo, Horario.hora)
+            .outerjoin(Horario, FechaHorarioNo.horario_id == Horario.id)
+            .all()
+        )
+        cierres = sorted((_a_cierre(registro, hora) for registro, hora in filas), key=lambda c: c.desde)
+        with self._lock:
+            self._cierres = cierres
+            self._inicios = [c.desde for c in cierres]
+            self._cargado = time.monotonic()
+
+    def buscar(self, desde, hasta):
+        """Cierres que se superponen con [desde, hasta]"""
+        cargado = self._cargado
+        if cargado is None or time.monotonic() - cargado > self._ttl:
+            self._cargar()
+        with self._lock:
+            cierres, inicios = self._cierres, self._inicios
+        return [c for c in cierres[:bisect_right(inicios, hasta)] if c.hasta >= desde]
+
+
+CIERRES = IndiceCierres()
+
+
+def _mascara_franja(cierre, mascara_horas):
+    """Bits de mascara_horas cuyo turno empieza dentro de la franja del cierre"""
+    mascara = 0
+    for i in SLOTS.indices(mascara_horas):
+        if cierre.inicio <= SLOTS.inicio_minutos(i) < cierre.fin:
+            mascara |= 1 << i
+    return mascara
+
+
+def mascaras_cerradas(cancha_ids, desde, hasta, mascara_horas):
+    """
+    Turnos cerrados por cancha y día como máscaras de bits.
+
+    Returns:
+        {(cancha_id, fecha): mascara_cerrada} solo para los días con algún cierre
+    """
+    cerradas = {}
+    for cierre in CIERRES.buscar(desde, hasta):
+        mascara = _mascara_franja(cierre, mascara_horas)
+        if not mascara:
+            continue
+        canchas = cancha_ids if cierre.cancha_id is None else [c for c in cancha_ids if c == cierre.cancha_id]
+        fecha = max(desde, cierre.desde)
+        ultima = min(hasta, cierre.hasta)
+        while fecha <= ultima:
+            for cancha_id in canchas:
+                cerradas[(cancha_id, fecha)] = cerradas.get((cancha_id, fecha), 0) | mascara
+            fecha += timedelta(days=1)
+    return cerradas
+
+
+def motivo_cierre(cancha_id, fecha, hora):
+    """Motivo del cierre que afecta a un turno puntual ('' si no tiene motivo), o None"""
+    indice = SLOTS.indice(hora)
+    if indice is None:
+        return None
+    inicio = SLOTS.inicio_minutos(indice)
+    for cierre in CIERRES.buscar(fecha, fecha):
+        if cierre.cancha_id in (None, cancha_id) and cierre.inicio <= inicio < cierre.fin:
+            return cierre.motivo or ''
+    return None
+
+
+def serializar_cierre(registro):
+    return {
+        'id': registro.id,
+        'fecha_desde': registro.fecha.strftime('%Y-%m-%d'),
+        'fecha_hasta': (registro.fecha_hasta or registro.fecha).strftime('%Y-%m-%d'),
+        'hora_desde': registro.hora_desde or (registro.horario.hora.split('-')[0] if registro.horario else None),
+        'hora_hasta': registro.hora_hasta or (registro.horario.hora.split('-')[1] if registro.horario else None),
+        'cancha_id': registro.cancha_id,
+        'cancha': registro.cancha.nombre if registro.cancha else None,
+        'motivo': registro.motivo
+    }
+
+
+def _validar_hora(hora):
+    return hora is None or bool(re.match(r'^\d{2}:\d{2}$', hora))
+
+
+def _registros_cierre(fecha_desde, fecha_hasta=None, hora_desde=None, hora_hasta=None, cancha_ids=None, motivo=None):
+    """Valida un cierre y arma sus registros: uno por cancha indicada, o uno solo para todas"""
+    fecha_hasta = fecha_hasta or fecha_desde
+    if fecha_hasta < fecha_desde:
+        raise ValueError('fecha_hasta no puede ser anterior a fecha_desde')
+    if not _validar_hora(hora_desde) or not _validar_hora(hora_hasta):
+        raise ValueError('Las horas deben tener formato HH:MM')
+    if hora_desde and hora_hasta and _minutos(hora_hasta) <= _minutos(hora_desde):
+        raise ValueError('hora_hasta debe ser posterior a hora_desde')
+    return [
+        FechaHorarioNo(
+            fecha=fecha_desde,
+            fecha_hasta=fecha_hasta if fecha_hasta != fecha_desde else None,
+            hora_desde=hora_desde,
+            hora_hasta=hora_hasta,
+            cancha_id=cancha_id,
+            motivo=motivo
+        )
+        for cancha_id in (cancha_ids or [None])
+    ]
+
+
+def crear_cierres(cierres):
+    """
+    Crea varios cierres en una sola transacción
+
+    Args:
+        cierres: Lista de dicts con fecha_desde, y opcionalmente fecha_hasta,
+            hora_desde, hora_hasta, cancha_ids y motivo (fechas como date)
+
+    Returns:
+        Dict con 'cierres' creados y 'reservas_afectadas': reservas activas que
+        quedan dentro de algún cierre y hay que reprogramar o avisar
+    """
+    try:
+        registros = [registro for cierre in cierres for registro in _registros_cierre(**cierre)]
+    except ValueError as e:
+        return {'exito': False, 'error': str(e)}
+    if not registros:
+        return {'exito': False, 'error': 'No se indicaron cierres'}
+
+    db.session.add_all(registros)
+    db.session.commit()
+    CIERRES.invalidar()
+
+    return {
+        'exito': True,
+        'cierres': [serializar_cierre(r) for r in registros],
+        'reservas_afectadas': reservas_afectadas([_a_cierre(r) for r in registros])
+    }
+
+
+def eliminar_cierres(ids):
+    """Elimina varios cierres con un solo DELETE"""
+    eliminados = FechaHorarioNo.query.filter(FechaHorarioNo.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    CIERRES.invalidar()
+    return {'exito': True, 'eliminados': eliminados}
+
+
+def reservas_afectadas(cierres):
+    """Reservas no canceladas que caen dentro de alguno de los cierres (una sola consulta)"""
+    if not cierres:
+        return []
+    filas = (
+        db.session.query(Reserva.id, Reserva.cancha_id, Reserva.fecha, Reserva.hora)
+        .join(Estado, Reserva.estado_id == Estado.id)
+        .filter(
+            Reserva.fecha >= min(c.desde for c in cierres),
+            Reserva.fecha <= max(c.hasta for c in cierres),
+            Estado.nombre.notin_(['cancelada', 'bloqueada']),
+            or_(Reserva.expira.is_(None), Reserva.expira >= datetime.now())
+        )
+        .order_by(Reserva.fecha, Reserva.hora)
+        .all()
+    )
+    afectadas = []
+    for reserva_id, cancha_id, fecha, hora in filas:
+        inicio = _minutos(hora.split('-')[0])
+        if any(
+            c.desde <= fecha <= c.hasta and c.cancha_id in (None, cancha_id) and c.inicio <= inicio < c.fin
+            for c in cierres
+        ):
+            afectadas.append({'id': reserva_id, 'cancha_id': cancha_id, 'fecha': fecha.strftime('%Y-%m-%d'), 'hora': hora})
+    return afectadas
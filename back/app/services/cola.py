@@ -0,0 +1,358 @@
+"""
+Cola durable de trabajos sobre la tabla trabajo_cola.
+
+El webhook de WhatsApp solo encola y responde; los workers
+(scripts/worker_cola.py) toman los trabajos de a uno con
+SELECT ... FOR UPDATE SKIP LOCKED, así varios procesos drenan la cola sin
+pisarse. Un trabajo tomado queda invisible COLA_VISIBILIDAD_SEGUNDOS y,
+mientras el manejador corre, el worker renueva esa visibilidad cada
+COLA_LATIDO_SEGUNDOS: si el worker muere a mitad de camino, el trabajo vuelve
+a estar disponible al vencer. Los
+errores se reintentan con backoff hasta COLA_MAX_INTENTOS y después el
+trabajo pasa a 'muerto' (dead-letter) para revisarlo a mano.
+
+Los trabajos de un mismo usuario se toman en orden y de a uno (ver
+_disponibles); los de usuarios distintos se procesan en paralelo.
+"""
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import exists, func, or_
+from sqlalchemy.orm import aliased
+
+from app.models import db, TrabajoCola
+from app.services.envios_whatsapp import WHATSAPP_ENVIO_MAX_SEGUNDOS
+from app.services.metricas import percentiles
+from app.services.orden import BLOQUEO_USUARIO_SEGUNDOS
+from app.services.resiliencia import LLM_MAX_VUELTAS, LLM_PLAZO_SEGUNDOS
+
+
+# Tiempo que se reserva para las herramientas de cada vuelta del LLM
+COLA_HERRAMIENTAS_SEGUNDOS_POR_VUELTA = 10
+
+# Un mensaje lento puede esperar el bloqueo del usuario, agotar el plazo del LLM
+# (más sus herramientas) en cada vuelta y esperar el envío de la respuesta: la
+# visibilidad por defecto cubre ese peor caso con margen, así otro worker no
+# toma un trabajo que sigue en curso aunque el latido se atrase
+COLA_VISIBILIDAD_SEGUNDOS = int(os.getenv(
+    'COLA_VISIBILIDAD_SEGUNDOS',
+    BLOQUEO_USUARIO_SEGUNDOS
+    + LLM_MAX_VUELTAS * (LLM_PLAZO_SEGUNDOS + COLA_HERRAMIENTAS_SEGUNDOS_POR_VUELTA)
+    + WHATSAPP_ENVIO_MAX_SEGUNDOS
+    + 60
+))
+# Cada cuánto el worker renueva la visibilidad del trabajo que está procesando
+COLA_LATIDO_SEGUNDOS = max(1, COLA_VISIBILIDAD_SEGUNDOS // 4)
+COLA_MAX_INTENTOS = int(os.getenv('COLA_MAX_INTENTOS', 3))
+COLA_BACKOFF_SEGUNDOS = int(os.getenv('COLA_BACKOFF_SEGUNDOS', 10))
+
+# Días que se conservan los trabajos terminados
+COLA_RETENCION_DIAS = int(os.getenv('COLA_RETENCION_DIAS', 7))
+
+PENDIENTE = 'pendiente'
+EN_PROCESO = 'en_proceso'
+HECHO = 'hecho'
+MUERTO = 'muerto'
+
+# tipo -> función(payload) que procesa el trabajo
+MANEJADORES = {}
+
+
+def manejador(tipo):
+    """Registra la función que procesa los trabajos de un tipo"""
+    def registrar(funcion):
+        MANEJADORES[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def nombre_worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _json(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+def encolar(tipo, payload, usuario=None, commit=True, demora=0):
+    """
+    Agrega un trabajo pendiente; con commit=False queda en la transacción del llamador
+
+    Args:
+        demora: Segundos hasta que el trabajo se puede tomar
+    """
+    ahora = datetime.now()
+    trabajo = TrabajoCola(
+        tipo=tipo,
+        usuario=usuario,
+        payload=_json(payload),
+        estado=PENDIENTE,
+        disponible_desde=ahora + timedelta(seconds=demora),
+        creado=ahora
+    )
+    db.session.add(trabajo)
+    if commit:
+        db.session.commit()
+    return trabajo
+
+
+def ultimo_sin_tomar(tipo, usuario):
+    """
+    El último trabajo sin terminar del usuario, si es de `tipo` y ningún worker
+    lo tomó todavía (para agregarle datos antes de que se procese). None si no hay.
+    """
+    trabajo = TrabajoCola.query.filter(
+        TrabajoCola.usuario == usuario,
+        TrabajoCola.estado.in_((PENDIENTE, EN_PROCESO))
+    ).order_by(TrabajoCola.id.desc()).with_for_update().first()
+    if trabajo and trabajo.tipo == tipo and trabajo.estado == PENDIENTE and trabajo.intentos == 0:
+        return trabajo
+    return None
+
+
+def reprogramar(trabajo, payload, disponible_desde) -> bool:
+    """
+    Reemplaza el payload y el momento en que se puede tomar un trabajo que
+    sigue sin tomar (sin commit). False si un worker lo tomó en el medio.
+    """
+    return TrabajoCola.query.filter(
+        TrabajoCola.id == trabajo.id,
+        TrabajoCola.estado == PENDIENTE,
+        TrabajoCola.intentos == 0
+    ).update({
+        'payload': _json(payload),
+        'disponible_desde': disponible_desde
+    }, synchronize_session=False) == 1
+
+
+def _disponibles(ahora):
+    # Pendientes listos, o en proceso con la visibilidad vencida (worker caído).
+    # Orden por usuario: solo el trabajo más viejo sin terminar de cada usuario;
+    # el siguiente espera aunque el anterior esté en backoff. Usuarios distintos
+    # no se bloquean entre sí.
+    anterior = aliased(TrabajoCola)
+    return TrabajoCola.query.filter(
+        TrabajoCola.estado.in_((PENDIENTE, EN_PROCESO)),
+        TrabajoCola.disponible_desde <= ahora,
+        ~exists().where(
+            anterior.usuario == TrabajoCola.usuario,
+            anterior.id < TrabajoCola.id,
+            anterior.estado.in_((PENDIENTE, EN_PROCESO))
+        )
+    )
+
+
+def reclamar(worker=None, tipos=None):
+    """
+    Toma el próximo trabajo disponible y lo marca en proceso
+
+    Returns:
+        TrabajoCola o None si no hay trabajos disponibles
+    """
+    worker = worker or nombre_worker()
+    while True:
+        ahora = datetime.now()
+        try:
+            query = _disponibles(ahora)
+            if tipos:
+                query = query.filter(TrabajoCola.tipo.in_(tipos))
+            trabajo = query.order_by(TrabajoCola.id).with_for_update(skip_locked=True).first()
+            if trabajo is None:
+                db.session.rollback()
+                return None
+
+            # Se agotaron los intentos (ej: el worker murió en cada uno): dead-letter
+            if trabajo.intentos >= COLA_MAX_INTENTOS:
+                trabajo.estado = MUERTO
+                trabajo.terminado = ahora
+                trabajo.error = trabajo.error or 'Visibilidad vencida en todos los intentos'
+                db.session.commit()
+                continue
+
+            # Update condicionado: en bases sin SKIP LOCKED (SQLite) otro worker pudo ganarlo
+            tomado = TrabajoCola.query.filter(
+                TrabajoCola.id == trabajo.id,
+                TrabajoCola.intentos == trabajo.intentos,
+                TrabajoCola.disponible_desde == trabajo.disponible_desde
+            ).update({
+                'estado': EN_PROCESO,
+                'intentos': trabajo.intentos + 1,
+                'disponible_desde': ahora + timedelta(seconds=COLA_VISIBILIDAD_SEGUNDOS),
+                'iniciado': ahora,
+                'worker': worker
+            }, synchronize_session='fetch')
+            db.session.commit()
+            if tomado:
+                return trabajo
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+class _Latido:
+    """Renueva la visibilidad de un trabajo tomado mientras su manejador corre"""
+
+    def __init__(self, trabajo, worker):
+        self.app = current_app._get_current_object()
+        self.trabajo_id = trabajo.id
+        self.intentos = trabajo.intentos
+        self.worker = worker
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._latir, name=f'latido-cola-{trabajo.id}', daemon=True)
+
+    def _latir(self):
+        while not self._parar.wait(COLA_LATIDO_SEGUNDOS):
+            with self.app.app_context():
+                try:
+                    # Solo si sigue siendo nuestro: otro worker pudo tomarlo (intentos distinto)
+                    TrabajoCola.query.filter(
+                        TrabajoCola.id == self.trabajo_id,
+                        TrabajoCola.estado == EN_PROCESO,
+                        TrabajoCola.intentos == self.intentos,
+                        TrabajoCola.worker == self.worker
+                    ).update({
+                        'disponible_desde': datetime.now() + timedelta(seconds=COLA_VISIBILIDAD_SEGUNDOS)
+                    }, synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error renovando la visibilidad del trabajo {self.trabajo_id}: {e}")
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+
+
+def completar(trabajo):
+    trabajo.estado = HECHO
+    trabajo.terminado = datetime.now()
+    trabajo.error = None
+    db.session.commit()
+
+
+def fallar(trabajo, error):
+    """Reprograma el trabajo con backoff, o lo manda a dead-letter si agotó los intentos"""
+    db.session.rollback()
+    trabajo = db.session.get(TrabajoCola, trabajo.id)
+    trabajo.error = str(error)[:2000]
+    if trabajo.intentos >= COLA_MAX_INTENTOS:
+        trabajo.estado = MUERTO
+        trabajo.terminado = datetime.now()
+    else:
+        trabajo.estado = PENDIENTE
+        trabajo.disponible_desde = datetime.now() + timedelta(seconds=COLA_BACKOFF_SEGUNDOS * 2 ** (trabajo.intentos - 1))
+    db.session.commit()
+
+
+def procesar_siguiente(worker=None, tipos=None):
+    """
+    Toma y procesa un trabajo
+
+    Returns:
+        bool: True si había un trabajo (haya salido bien o no)
+    """
+    worker = worker or nombre_worker()
+    trabajo = reclamar(worker, tipos)
+    if trabajo is None:
+        return False
+    try:
+        funcion = MANEJADORES.get(trabajo.tipo)
+        if funcion is None:
+            raise ValueError(f'No hay manejador para el tipo {trabajo.tipo}')
+        with _Latido(trabajo, worker):
+            funcion(json.loads(trabajo.payload))
+        completar(trabajo)
+    except Exception as e:
+        print(f"Error procesando trabajo {trabajo.id} ({trabajo.tipo}): {e}")
+        traceback.print_exc()
+        fallar(trabajo, e)
+    return True
+
+
+def procesar_pendientes(limite=None, worker=None, tipos=None):
+    """Procesa trabajos hasta vaciar la cola (o hasta limite). Devuelve cuántos procesó"""
+    procesados = 0
+    while (limite is None or procesados < limite) and procesar_siguiente(worker, tipos):
+        procesados += 1
+    return procesados
+
+
+def reintentar_muerto(trabajo_id):
+    """Vuelve a encolar un trabajo en dead-letter con los intentos en cero"""
+    trabajo = TrabajoCola.query.filter_by(id=trabajo_id, estado=MUERTO).first()
+    if not trabajo:
+        return {'exito': False, 'error': f'No hay un trabajo muerto con ID {trabajo_id}'}
+    trabajo.estado = PENDIENTE
+    trabajo.intentos = 0
+    trabajo.disponible_desde = datetime.now()
+    trabajo.terminado = None
+    db.session.commit()
+    return {'exito': True, 'mensaje': f'Trabajo {trabajo_id} encolado nuevamente'}
+
+
+def purgar_terminados(dias=COLA_RETENCION_DIAS):
+    """Borra los trabajos hechos hace más de `dias` días"""
+    borrados = TrabajoCola.query.filter(
+        TrabajoCola.estado == HECHO,
+        TrabajoCola.terminado < datetime.now() - timedelta(days=dias)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borrados
+
+
+def estadisticas_cola(minutos=60):
+    """Profundidad por estado, demora del más viejo y espera/duración de los últimos trabajos"""
+    ahora = datetime.now()
+    por_estado = dict(
+        db.session.query(TrabajoCola.estado, func.count(TrabajoCola.id))
+        .filter(TrabajoCola.estado != HECHO)
+        .group_by(TrabajoCola.estado).all()
+    )
+    mas_viejo = db.session.query(func.min(TrabajoCola.creado)).filter(
+        or_(TrabajoCola.estado == PENDIENTE, TrabajoCola.estado == EN_PROCESO)
+    ).scalar()
+    vencidos = TrabajoCola.query.filter(
+        TrabajoCola.estado == EN_PROCESO, TrabajoCola.disponible_desde <= ahora
+    ).count()
+
+    recientes = db.session.query(TrabajoCola.creado, TrabajoCola.iniciado, TrabajoCola.terminado).filter(
+        TrabajoCola.estado == HECHO,
+        TrabajoCola.terminado >= ahora - timedelta(minutes=minutos)
+    ).all()
+    espera = [round((t.iniciado - t.creado).total_seconds() * 1000) for t in recientes if t.iniciado]
+    duracion = [round((t.terminado - t.iniciado).total_seconds() * 1000) for t in recientes if t.iniciado]
+
+    return {
+        'pendientes': por_estado.get(PENDIENTE, 0),
+        'en_proceso': por_estado.get(EN_PROCESO, 0),
+        'visibilidad_vencida': vencidos,
+        'muertos': por_estado.get(MUERTO, 0),
+        'demora_segundos': round((ahora - mas_viejo).total_seconds(), 1) if mas_viejo else 0,
+        'ventana_minutos': minutos,
+        'procesados': len(recientes),
+        'espera_ms': percentiles(espera),
+        'duracion_ms': percentiles(duracion)
+    }
+
+
+def listar_muertos(limite=50):
+    trabajos = TrabajoCola.query.filter_by(estado=MUERTO).order_by(TrabajoCola.id.desc()).limit(limite).all()
+    return [{
+        'id': t.id,
+        'tipo': t.tipo,
+        'usuario': t.usuario,
+        'intentos': t.intentos,
+        'creado': t.creado.isoformat(),
+        'terminado': t.terminado.isoformat() if t.terminado else None,
+        'error': t.error,
+        'payload': json.loads(t.payload)
+    } for t in trabajos]
@@ -0,0 +1,299 @@
+"""
+Motor de disponibilidad de canchas.
+
+Calcula la matriz de ocupación (cancha x fecha x horario) de un rango de fechas
+con una única consulta sobre la tabla reserva, aplicando la grilla semanal
+definida en Horario/CanchaHorario. Internamente cada cancha/día es una máscara
+de bits sobre el índice de turnos de app.services.slots.
+"""
+import heapq
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, or_
+from app.models import db, Cancha, CanchaHorario, Horario, Reserva, Estado
+from app.services.slots import (
+    SLOTS, HORARIOS_VALIDOS, MASCARA_VALIDOS, _DIA_A_WEEKDAY,
+    _normalizar_hora, es_horario_valido
+)
+from app.services.turnos_fijos import ESTADO_TURNO_FIJO, expandir_turnos_fijos
+from app.services.cierres import ESTADO_CERRADA, mascaras_cerradas
+
+# Máximo de días que se pueden consultar de una vez
+MAX_DIAS_MATRIZ = 62
+
+ESTADO_DISPONIBLE = 'disponible'
+ESTADO_FUERA_DE_HORARIO = 'fuera_de_horario'
+
+
+def _parse_fecha(fecha):
+    if isinstance(fecha, date):
+        return fecha
+    return datetime.strptime(fecha, '%Y-%m-%d').date()
+
+
+def cargar_grilla(cancha_ids):
+    """
+    Grilla semanal de cada cancha como máscaras por día de la semana.
+
+    Returns:
+        {cancha_id: [mascara_lunes, ..., mascara_domingo]}. Una cancha sin horarios
+        asignados no aparece y se interpreta como "sin restricción de grilla".
+    """
+    grilla = {}
+    filas = (
+        db.session.query(CanchaHorario.cancha_id, Horario.dia, Horario.hora)
+        .join(Horario, CanchaHorario.horario_id == Horario.id)
+        .filter(CanchaHorario.cancha_id.in_(cancha_ids))
+        .all()
+    )
+    for cancha_id, dia, hora in filas:
+        weekday = _DIA_A_WEEKDAY.get(dia)
+        if weekday is None:
+            continue
+        mascaras = grilla.setdefault(cancha_id, [0] * 7)
+        mascaras[weekday] |= 1 << SLOTS.registrar(hora)
+    return grilla
+
+
+def cargar_ocupacion(cancha_ids, desde, hasta, mascara_horas):
+    """
+    Ocupación de un rango de fechas con una sola consulta sobre reserva.
+
+    Returns:
+        (ocupado, estados): ocupado = {(cancha_id, fecha): mascara} y
+        estados = {(cancha_id, fecha, indice): nombre_estado} para los bits ocupados.
+    """
+    ocupado = {}
+    estados = {}
+    query = (
+        db.session.query(Reserva.cancha_id, Reserva.fecha, Reserva.hora, Estado.nombre)
+        .join(Estado, Reserva.estado_id == Estado.id)
+        .filter(
+            Reserva.cancha_id.in_(cancha_ids),
+            Reserva.fecha >= desde,
+            Reserva.fecha <= hasta,
+            Estado.nombre != 'cancelada',
+            # Las retenciones vencidas no ocupan el turno aunque todavía no se hayan barrido
+            or_(Reserva.expira.is_(None), Reserva.expira >= datetime.now())
+        )
+    )
+    query = query.filter(Reserva.hora.in_(SLOTS.rangos(mascara_horas)))
+    for cancha_id, fecha, hora, estado in query.all():
+        indice = SLOTS.registrar(hora)
+        ocupado[(cancha_id, fecha)] = ocupado.get((cancha_id, fecha), 0) | (1 << indice)
+        estados[(cancha_id, fecha, indice)] = estado
+
+    # Cierres y feriados desde el índice en memoria (una reserva ya tomada conserva su estado)
+    for clave, mascara in mascaras_cerradas(cancha_ids, desde, hasta, mascara_horas).items():
+        nuevos = mascara & ~ocupado.get(clave, 0)
+        if nuevos:
+            ocupado[clave] = ocupado.get(clave, 0) | nuevos
+            for indice in SLOTS.indices(nuevos):
+                estados[clave + (indice,)] = ESTADO_CERRADA
+
+    # Turnos fijos: se expanden para la ventana pedida, sin filas en reserva
+    for turno, fecha in expandir_turnos_fijos(desde, hasta, cancha_ids=cancha_ids, mascara_horas=mascara_horas):
+        indice = SLOTS.registrar(turno.hora)
+        mascara = ocupado.get((turno.cancha_id, fecha), 0)
+        if not mascara >> indice & 1:
+            ocupado[(turno.cancha_id, fecha)] = mascara | (1 << indice)
+            estados[(turno.cancha_id, fecha, indice)] = ESTADO_TURNO_FIJO
+    return ocupado, estados
+
+
+def mascaras_libres(cancha_ids, desde, hasta, mascara_horas=MASCARA_VALIDOS):
+    """
+    Turnos libres por cancha y día como máscaras de bits.
+
+    Returns:
+        {(cancha_id, fecha): mascara_libre} solo para los días con algún turno libre
+    """
+    grilla = cargar_grilla(cancha_ids)
+    ocupado, _ = cargar_ocupacion(cancha_ids, desde, hasta, mascara_horas)
+    libres = {}
+    fecha = desde
+    while fecha <= hasta:
+        weekday = fecha.weekday()
+        for cancha_id in cancha_ids:
+            grilla_cancha = grilla.get(cancha_id)
+            mascara = mascara_horas if grilla_cancha is None else mascara_horas & grilla_cancha[weekday]
+            mascara &= ~ocupado.get((cancha_id, fecha), 0)
+            if mascara:
+                libres[(cancha_id, fecha)] = mascara
+        fecha += timedelta(days=1)
+    return libres
+
+
+def obtener_matriz_disponibilidad(fecha_desde, fecha_hasta=None, canchas=None, horas=None, solo_libres=False):
+    """
+    Calcula la ocupación de las canchas para un rango de fechas
+
+    Args:
+        fecha_desde: Fecha inicial (YYYY-MM-DD)
+        fecha_hasta: Fecha final inclusive (YYYY-MM-DD). Por defecto igual a fecha_desde
+        canchas: Lista opcional de nombres de cancha (default: todas)
+        horas: Lista opcional de horarios, en rango o HH:MM (default: HORARIOS_VALIDOS)
+        solo_libres: Si es True, devuelve solo los horarios libres por cancha y fecha
+
+    Returns:
+        Dict con 'matriz' = {cancha: {fecha: {hora: estado}}}, donde estado es
+        'disponible', 'fuera_de_horario', 'cerrada', 'turno_fijo' o el estado de la reserva que ocupa el turno.
+        Con solo_libres=True devuelve 'libres' = {cancha: {fecha: [horas]}}.
+    """
+    try:
+        desde = _parse_fecha(fecha_desde)
+        hasta = _parse_fecha(fecha_hasta) if fecha_hasta else desde
+        if hasta < desde:
+            return {'exito': False, 'error': 'fecha_hasta no puede ser anterior a fecha_desde'}
+
+        cantidad_dias = (hasta - desde).days + 1
+        if cantidad_dias > MAX_DIAS_MATRIZ:
+            return {'exito': False, 'error': f'El rango no puede superar los {MAX_DIAS_MATRIZ} días'}
+
+        # Normalizar y validar horarios pedidos
+        if horas:
+            mascara_horas = 0
+            for hora in horas:
+                hora_norm = _normalizar_hora(hora)
+                if not es_horario_valido(hora_norm):
+                    return {'exito': False, 'error': f'Horario "{hora}" no válido. Horarios permitidos: {", ".join(HORARIOS_VALIDOS)}'}
+                mascara_horas |= 1 << SLOTS.indice(hora_norm)
+        else:
+            mascara_horas = MASCARA_VALIDOS
+        horas_norm = SLOTS.rangos(mascara_horas)
+
+        # Canchas
+        query_canchas = Cancha.query
+        if canchas:
+            query_canchas = query_canchas.filter(func.lower(Cancha.nombre).in_([nombre.lower() for nombre in canchas]))
+        canchas_db = query_canchas.order_by(Cancha.id).all()
+        if canchas:
+            # La comparación en MySQL no distingue mayúsculas, replicamos ese criterio
+            encontradas = {c.nombre.lower() for c in canchas_db}
+            faltantes = [nombre for nombre in canchas if nombre.lower() not in encontradas]
+            if faltantes:
+                return {'exito': False, 'error': f'No se encontró la cancha "{faltantes[0]}"'}
+
+        resultado = {}
+        cancha_ids = [c.id for c in canchas_db]
+        if cancha_ids:
+            grilla = cargar_grilla(cancha_ids)
+            ocupado, estados = cargar_ocupacion(cancha_ids, desde, hasta, mascara_horas)
+            indices = SLOTS.indices(mascara_horas)
+            fechas = [desde + timedelta(days=i) for i in range(cantidad_dias)]
+
+            for cancha in canchas_db:
+                grilla_cancha = grilla.get(cancha.id)
+                por_fecha = {}
+                for fecha in fechas:
+                    habilitado = mascara_horas if grilla_cancha is None else mascara_horas & grilla_cancha[fecha.weekday()]
+                    ocupado_dia = ocupado.get((cancha.id, fecha), 0)
+                    clave_fecha = fecha.strftime('%Y-%m-%d')
+                    if solo_libres:
+                        libre = habilitado & ~ocupado_dia
+                        if libre:
+                            por_fecha[clave_fecha] = SLOTS.rangos(libre)
+                        continue
+                    celdas = {}
+                    for i in indices:
+                        bit = 1 << i
+                        if not habilitado & bit:
+                            celdas[SLOTS.rango(i)] = ESTADO_FUERA_DE_HORARIO
+                        elif ocupado_dia & bit:
+                            celdas[SLOTS.rango(i)] = estados[(cancha.id, fecha, i)]
+                        else:
+                            celdas[SLOTS.rango(i)] = ESTADO_DISPONIBLE
+                    por_fecha[clave_fecha] = celdas
+                resultado[cancha.nombre] = por_fecha
+
+        return {
+            'exito': True,
+            'fecha_desde': desde.strftime('%Y-%m-%d'),
+            'fecha_hasta': hasta.strftime('%Y-%m-%d'),
+            'horas': horas_norm,
+            'canchas': [{'id': c.id, 'nombre': c.nombre, 'precio': c.precio} for c in canchas_db],
+            'libres' if solo_libres else 'matriz': resultado
+        }
+    except ValueError as e:
+        return {'exito': False, 'error': f'Fecha inválida: {e}'}
+    except Exception as e:
+        return {'exito': False, 'error': str(e)}
+
+
+def buscar_alternativas(fecha, hora, cancha_nombre=None, cantidad=5, dias=3):
+    """
+    Busca los turnos libres más cercanos a uno pedido, en todas las canchas
+
+    Args:
+        fecha: Fecha pedida (YYYY-MM-DD)
+        hora: Horario pedido, en rango o HH:MM
+        cancha_nombre: Cancha pedida (opcional). Sus turnos tienen prioridad ante igual cercanía
+        cantidad: Cantidad máxima de alternativas a devolver
+        dias: Cantidad de días antes y después de la fecha pedida a considerar
+
+    Returns:
+        Dict con 'alternativas' ordenadas por cercanía en el tiempo, luego misma
+        cancha primero y luego menor precio. Nunca incluye turnos ya pasados.
+    """
+    try:
+        fecha_obj = _parse_fecha(fecha)
+        hora_norm = _normalizar_hora(hora)
+        if not es_horario_valido(hora_norm):
+            return {'exito': False, 'error': f'Horario "{hora}" no válido. Horarios permitidos: {", ".join(HORARIOS_VALIDOS)}'}
+        cantidad = max(1, min(int(cantidad or 5), 20))
+        dias = max(0, min(int(dias if dias is not None else 3), MAX_DIAS_MATRIZ // 2))
+
+        canchas_db = Cancha.query.order_by(Cancha.id).all()
+        cancha_pedida = None
+        if cancha_nombre:
+            cancha_pedida = next((c for c in canchas_db if c.nombre.lower() == cancha_nombre.lower()), None)
+            if not cancha_pedida:
+                return {'exito': False, 'error': f'No se encontró la cancha "{cancha_nombre}"'}
+
+        ahora = datetime.now()
+        desde = max(fecha_obj - timedelta(days=dias), ahora.date())
+        hasta = fecha_obj + timedelta(days=dias)
+        if hasta < desde:
+            return {'exito': True, 'alternativas': [], 'mensaje': 'La fecha pedida ya pasó'}
+
+        pedido = datetime.combine(fecha_obj, datetime.min.time()) + timedelta(minutes=SLOTS.inicio_minutos(SLOTS.indice(hora_norm)))
+        minuto_actual = ahora.hour * 60 + ahora.minute
+        canchas_por_id = {c.id: c for c in canchas_db}
+
+        candidatos = []
+        libres = mascaras_libres(list(canchas_por_id), desde, hasta)
+        for (cancha_id, dia), mascara in libres.items():
+            cancha = canchas_por_id[cancha_id]
+            es_pedida = cancha_pedida is not None and cancha_id == cancha_pedida.id
+            # Sin cancha pedida todas empatan; con cancha pedida, la suya va primero
+            prioridad = 0 if cancha_pedida is None or es_pedida else 1
+            base = datetime.combine(dia, datetime.min.time())
+            for i in SLOTS.indices(mascara):
+                inicio = SLOTS.inicio_minutos(i)
+                if dia == ahora.date() and inicio <= minuto_actual:
+                    continue
+                # El turno pedido en la cancha pedida no es una alternativa
+                if dia == fecha_obj and i == SLOTS.indice(hora_norm) and es_pedida:
+                    continue
+                distancia = abs(int(((base + timedelta(minutes=inicio)) - pedido).total_seconds() // 60))
+                candidatos.append((distancia, prioridad, cancha.precio or 0, dia, inicio, cancha.nombre, i))
+
+        alternativas = []
+        for distancia, _, precio, dia, _, nombre, i in heapq.nsmallest(cantidad, candidatos):
+            alternativas.append({
+                'cancha': nombre,
+                'fecha': dia.strftime('%Y-%m-%d'),
+                'hora': SLOTS.rango(i),
+                'precio': precio,
+                'diferencia_minutos': distancia
+            })
+
+        return {
+            'exito': True,
+            'solicitado': {'cancha': cancha_pedida.nombre if cancha_pedida else None, 'fecha': fecha_obj.strftime('%Y-%m-%d'), 'hora': hora_norm},
+            'alternativas': alternativas,
+            'mensaje': f'Encontramos {len(alternativas)} alternativa(s)' if alternativas else 'No hay turnos libres cerca de la fecha pedida'
+        }
+    except ValueError as e:
+        return {'exito': False, 'error': f'Fecha inválida: {e}'}
+    except Exception as e:
+        return {'exito': False, 'error': str(e)}
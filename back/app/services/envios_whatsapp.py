@@ -0,0 +1,308 @@
+"""
+Envío de mensajes salientes de WhatsApp (Graph API de Meta).
+
+- Una sesión HTTP con pool de conexiones y timeouts explícitos.
+- Token bucket compartido con el límite de la API (WHATSAPP_ENVIOS_POR_SEGUNDO,
+  80 mensajes/s por número en la Cloud API).
+- Reintentos con backoff y jitter ante 429, 5xx, errores de conexión y los
+  códigos de throttling de Graph. Un timeout de lectura no se reintenta: el
+  mensaje pudo haber salido y se mandaría dos veces; el envío queda con
+  resultado incierto (None) y quien llama no debe reenviarlo.
+- Variante del número aprendida por destinatario: los números argentinos
+  llegan al webhook con el 9 (549...) pero a veces la lista de permitidos los
+  tiene sin él (54...). Ante el error 131030 se prueba la otra variante una
+  vez y, si funciona, se recuerda para los próximos envíos.
+- Cola en segundo plano: encolar() devuelve un Future y no bloquea. Los envíos
+  se reparten en hilos por destinatario, así los mensajes a un mismo número
+  salen en orden y los de números distintos en paralelo. Un Future cancelado
+  antes de que su envío empiece ya no sale.
+- WHATSAPP_SIMULADO=1 da los envíos por hechos sin llamar a la API (benchmarks).
+"""
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+WHATSAPP_API_VERSION = 'v22.0'
+
+WHATSAPP_ENVIOS_POR_SEGUNDO = float(os.getenv('WHATSAPP_ENVIOS_POR_SEGUNDO', 80))
+WHATSAPP_HILOS_ENVIO = int(os.getenv('WHATSAPP_HILOS_ENVIO', 4))
+WHATSAPP_TIMEOUT_CONEXION = float(os.getenv('WHATSAPP_TIMEOUT_CONEXION', 3))
+WHATSAPP_TIMEOUT_LECTURA = float(os.getenv('WHATSAPP_TIMEOUT_LECTURA', 10))
+WHATSAPP_REINTENTOS = int(os.getenv('WHATSAPP_REINTENTOS', 3))
+WHATSAPP_BACKOFF_BASE_SEGUNDOS = 0.5
+WHATSAPP_BACKOFF_MAX_SEGUNDOS = 10.0
+
+# Envíos sin red: enviar() no llama a la API y devuelve True
+WHATSAPP_SIMULADO = os.getenv('WHATSAPP_SIMULADO') == '1'
+
+# Peor caso de un POST con sus reintentos: todos los intentos agotan los dos
+# timeouts y cada backoff es el más largo posible (el de 131056)
+_POST_MAX_SEGUNDOS = (WHATSAPP_REINTENTOS + 1) * (WHATSAPP_TIMEOUT_CONEXION + WHATSAPP_TIMEOUT_LECTURA) + sum(
+    min(WHATSAPP_BACKOFF_MAX_SEGUNDOS, WHATSAPP_BACKOFF_BASE_SEGUNDOS * 4 * 2 ** intento)
+    for intento in range(WHATSAPP_REINTENTOS)
+)
+# Peor caso de enviar(): el POST al número y otro a su variante
+WHATSAPP_ENVIO_MAX_SEGUNDOS = 2 * _POST_MAX_SEGUNDOS
+
+# Destinatarios con variante de número aprendida que se recuerdan
+MAX_VARIANTES = 10000
+
+# Códigos de error de Graph que indican throttling o falla temporal
+ERRORES_GRAPH_TRANSITORIOS = {
+    1,        # API unknown
+    2,        # API service
+    4,        # Límite de llamadas de la app
+    80007,    # Límite de la cuenta de WhatsApp Business
+    130429,   # Límite de throughput de la Cloud API
+    131000,   # Error genérico
+    131016,   # Servicio no disponible
+    131056,   # Demasiados mensajes al mismo destinatario
+}
+
+# "Recipient phone number not in allowed list"
+ERROR_NUMERO_NO_PERMITIDO = 131030
+
+
+class TokenBucket:
+    """Limitador de tasa: `tasa` fichas por segundo con ráfagas de hasta `capacidad`"""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = tasa
+        self.capacidad = capacidad or max(1.0, tasa)
+        self._fichas = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        """Toma una ficha, esperando lo necesario. Devuelve los segundos esperados"""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return esperado
+                falta = (1 - self._fichas) / self.tasa
+            time.sleep(falta)
+            esperado += falta
+
+
+def variante_numero(telefono: str):
+    """Otra forma del mismo número argentino (con o sin el 9 después del 54), o None"""
+    if telefono.startswith('549'):
+        return '54' + telefono[3:]
+    if telefono.startswith('54') and len(telefono) == 12:
+        return '549' + telefono[2:]
+    return None
+
+
+class _ErrorTransitorio(Exception):
+    pass
+
+
+class EnviadorWhatsApp:
+    """Envía mensajes de texto por la Graph API con las políticas del módulo"""
+
+    def __init__(self, token=None, phone_number_id=None, envios_por_segundo=WHATSAPP_ENVIOS_POR_SEGUNDO,
+                 hilos=WHATSAPP_HILOS_ENVIO):
+        self.token = token if token is not None else os.getenv('WHATSAPP_TOKEN')
+        self.phone_number_id = phone_number_id if phone_number_id is not None else os.getenv('WHATSAPP_PHONE_NUMBER_ID')
+        self.url = f"https://graph.facebook.com/{WHATSAPP_API_VERSION}/{self.phone_number_id}/messages"
+        self.limitador = TokenBucket(envios_por_segundo)
+
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max(hilos, 1))
+        self.sesion.mount('https://', adaptador)
+        self.sesion.headers.update({
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json"
+        })
+
+        self._variantes = OrderedDict()   # teléfono -> número que acepta la API
+        self._variantes_lock = threading.Lock()
+        self._contadores = {
+            'enviados': 0, 'fallidos': 0, 'inciertos': 0, 'reintentos': 0, 'variantes_usadas': 0, 'espera_limite_s': 0.0
+        }
+        self._contadores_lock = threading.Lock()
+
+        self._hilos = hilos
+        self._colas = []
+        self._iniciar_lock = threading.Lock()
+
+    def configurado(self) -> bool:
+        return bool(self.token and self.phone_number_id)
+
+    def _contar(self, clave, valor=1):
+        with self._contadores_lock:
+            self._contadores[clave] += valor
+
+    # --- Variantes de número ---
+
+    def _destino(self, telefono):
+        with self._variantes_lock:
+            destino = self._variantes.get(telefono)
+            if destino:
+                self._variantes.move_to_end(telefono)
+            return destino or telefono
+
+    def _recordar_variante(self, telefono, destino):
+        with self._variantes_lock:
+            if destino == telefono:
+                self._variantes.pop(telefono, None)
+                return
+            self._variantes[telefono] = destino
+            self._variantes.move_to_end(telefono)
+            while len(self._variantes) > MAX_VARIANTES:
+                self._variantes.popitem(last=False)
+
+    # --- Envío ---
+
+    def _post(self, destino, texto):
+        """
+        Un POST con reintentos. Devuelve (ok, código de error de Graph o None);
+        ok es None si el resultado es incierto (timeout de lectura)
+        """
+        data = {
+            "messaging_product": "whatsapp",
+            "to": destino,
+            "type": "text",
+            "text": {"body": texto}
+        }
+        for intento in range(WHATSAPP_REINTENTOS + 1):
+            self._contar('espera_limite_s', self.limitador.tomar())
+            try:
+                response = self.sesion.post(
+                    self.url, json=data, timeout=(WHATSAPP_TIMEOUT_CONEXION, WHATSAPP_TIMEOUT_LECTURA)
+                )
+                if response.ok:
+                    return True, None
+                try:
+                    codigo = response.json().get('error', {}).get('code')
+                except ValueError:
+                    codigo = None
+                print(f"Error sending WhatsApp message: {response.status_code} - {response.text}")
+                if not (response.status_code == 429 or response.status_code >= 500 or codigo in ERRORES_GRAPH_TRANSITORIOS):
+                    return False, codigo
+            except requests.exceptions.ReadTimeout as e:
+                # El mensaje pudo haber llegado: reintentar podría duplicarlo
+                print(f"Timeout de lectura enviando WhatsApp a {destino}: {e}")
+                return None, None
+            except requests.exceptions.RequestException as e:
+                print(f"Exception sending WhatsApp message: {e}")
+                codigo = None
+            if intento < WHATSAPP_REINTENTOS:
+                self._contar('reintentos')
+                # Límite por destinatario (131056): esperar más que con el resto
+                base = WHATSAPP_BACKOFF_BASE_SEGUNDOS * (4 if codigo == 131056 else 1)
+                time.sleep(random.uniform(0, min(WHATSAPP_BACKOFF_MAX_SEGUNDOS, base * 2 ** intento)))
+        return False, codigo
+
+    def enviar(self, telefono, texto):
+        """
+        Envía el mensaje y espera el resultado
+
+        Returns:
+            True si salió, False si falló, None si no se sabe (pudo haber salido)
+        """
+        if WHATSAPP_SIMULADO:
+            self._contar('enviados')
+            return True
+        if not self.configurado():
+            print("Error: WhatsApp credentials not configured")
+            return False
+
+        destino = self._destino(telefono)
+        ok, codigo = self._post(destino, texto)
+        if ok is False and codigo == ERROR_NUMERO_NO_PERMITIDO:
+            # Se prueba la otra forma del número (o la original si falló la aprendida)
+            alternativo = telefono if destino != telefono else variante_numero(telefono)
+            if alternativo:
+                print(f"DEBUG: Reintentando con número alternativo: {alternativo}")
+                ok, codigo = self._post(alternativo, texto)
+                if ok:
+                    self._recordar_variante(telefono, alternativo)
+        if ok and destino != telefono:
+            self._contar('variantes_usadas')
+        self._contar('enviados' if ok else 'inciertos' if ok is None else 'fallidos')
+        return ok
+
+    # --- Cola en segundo plano ---
+
+    def _iniciar(self):
+        with self._iniciar_lock:
+            if not self._colas:
+                for n in range(self._hilos):
+                    cola = queue.Queue()
+                    threading.Thread(target=self._trabajar, args=(cola,), name=f'envios-whatsapp-{n}', daemon=True).start()
+                    self._colas.append(cola)
+        return self._colas
+
+    def _trabajar(self, cola):
+        while True:
+            tarea = cola.get()
+            if tarea is None:
+                cola.task_done()
+                return
+            telefono, texto, futuro = tarea
+            if not futuro.set_running_or_notify_cancel():
+                # Quien lo encoló dejó de esperarlo y lo canceló: no sale
+                cola.task_done()
+                continue
+            try:
+                futuro.set_result(self.enviar(telefono, texto))
+            except Exception as e:
+                futuro.set_exception(e)
+            finally:
+                cola.task_done()
+
+    def encolar(self, telefono, texto) -> Future:
+        """Encola el envío sin bloquear; el Future resuelve a True/False/None (como enviar)"""
+        colas = self._iniciar()
+        futuro = Future()
+        # Mismo destinatario, mismo hilo: los mensajes salen en orden
+        colas[zlib.crc32(telefono.encode()) % len(colas)].put((telefono, texto, futuro))
+        return futuro
+
+    def detener(self, timeout=30):
+        """Espera a que salgan los envíos encolados (al apagar un worker)"""
+        limite = time.monotonic() + timeout
+        for cola in list(self._colas):
+            cola.put(None)
+        for cola in list(self._colas):
+            while cola.unfinished_tasks and time.monotonic() < limite:
+                time.sleep(0.05)
+        self._colas = []
+
+    def estadisticas(self) -> dict:
+        with self._contadores_lock:
+            contadores = dict(self._contadores)
+        contadores['espera_limite_s'] = round(contadores['espera_limite_s'], 2)
+        with self._variantes_lock:
+            contadores['variantes_aprendidas'] = len(self._variantes)
+        contadores['pendientes'] = sum(cola.qsize() for cola in self._colas)
+        contadores['envios_por_segundo'] = self.limitador.tasa
+        return contadores
+
+
+_enviador = None
+_enviador_lock = threading.Lock()
+
+
+def obtener_enviador() -> EnviadorWhatsApp:
+    """Enviador compartido del proceso (se crea en el primer uso)"""
+    global _enviador
+    with _enviador_lock:
+        if _enviador is None:
+            _enviador = EnviadorWhatsApp()
+        return _enviador
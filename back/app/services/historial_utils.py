@@ -1,11 +1,69 @@
 """
 Utilidades para gestionar el historial de conversaciones
+
+El asistente recibe el resumen acumulado de los mensajes viejos del usuario
+(ResumenConversacion) más los últimos mensajes textuales, dentro de
+HISTORIAL_TOKENS_MAX. El resumen se actualiza en segundo plano cada
+RESUMEN_MIN_PENDIENTES mensajes nuevos.
 """
-from app.models import db, Conversacion
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+from app.models import db, Conversacion, ResumenConversacion
+from app.services.ai import send_prompt
 from datetime import datetime
 
 
-def guardar_mensaje(usuario: str, rol: str, mensaje: str):
+HISTORIAL_RESUMEN = os.getenv('HISTORIAL_RESUMEN', '1') == '1'
+
+# Presupuesto de tokens del historial que recibe el asistente (resumen + últimos mensajes)
+HISTORIAL_TOKENS_MAX = int(os.getenv('HISTORIAL_TOKENS_MAX', 1200))
+
+# Mensajes más nuevos que siempre quedan textuales, fuera del resumen
+HISTORIAL_RECIENTES = int(os.getenv('HISTORIAL_RECIENTES', 6))
+
+# Mensajes sin resumir (además de los recientes) que disparan una actualización del resumen
+RESUMEN_MIN_PENDIENTES = int(os.getenv('RESUMEN_MIN_PENDIENTES', 6))
+
+RESUMEN_TOKENS_MAX = 250
+
+# Llamadas a herramientas y sus resultados también se guardan, para que el
+# modelo no vuelva a consultar lo que ya sabe (ej: los IDs de las reservas listadas)
+HISTORIAL_HERRAMIENTAS = os.getenv('HISTORIAL_HERRAMIENTAS', '1') == '1'
+
+# Tope de cada resultado de herramienta guardado
+HISTORIAL_HERRAMIENTA_CARACTERES = int(os.getenv('HISTORIAL_HERRAMIENTA_CARACTERES', 1500))
+
+ROL_LLAMADA_HERRAMIENTA = 'llamada_herramienta'
+ROL_HERRAMIENTA = 'herramienta'
+ROLES_TEXTO = ('user', 'assistant')
+
+# Cada mensaje se recorta al pasarlo al resumidor (listas de reservas, datos de pago)
+RESUMEN_CARACTERES_MENSAJE = 500
+
+RESUMEN_INSTRUCCIONES = (
+    "Resumís conversaciones entre un cliente y el asistente de reservas de un complejo de pádel. "
+    "Actualizá el resumen anterior con los mensajes nuevos. Conservá solo lo útil para seguir "
+    "atendiendo al cliente: su nombre, preferencias (cancha, días, horarios), reservas hechas o "
+    "canceladas con su número, pedidos pendientes y datos que ya dio. Omití saludos, listados "
+    f"completos y datos bancarios. Respondé solo con el resumen, en menos de {RESUMEN_TOKENS_MAX * 3 // 4} palabras."
+)
+
+_resumenes = ThreadPoolExecutor(max_workers=2, thread_name_prefix='resumenes')
+_en_curso = set()
+_lock = threading.Lock()
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación de tokens (~4 caracteres por token en español)"""
+    return len(texto or '') // 4 + 1
+
+
+def guardar_mensaje(usuario: str, rol: str, mensaje: str, commit: bool = True):
     """
     Guarda un mensaje en el historial de conversaciones
     
@@ -13,6 +71,7 @@ def guardar_mensaje(usuario: str, rol: str, mensaje: str):
         usuario: Número de teléfono o '99999999' para local
         rol: 'user' o 'assistant'
         mensaje: Contenido del mensaje
+        commit: False para dejarlo en la transacción actual (el llamador hace el commit)
     """
     try:
         nueva_conversacion = Conversacion(
@@ -21,7 +80,8 @@ def guardar_mensaje(usuario: str, rol: str, mensaje: str):
             mensaje=mensaje
         )
         db.session.add(nueva_conversacion)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return True
     except Exception as e:
         print(f"Error guardando mensaje: {e}")
@@ -29,32 +89,241 @@ def guardar_mensaje(usuario: str, rol: str, mensaje: str):
         return False
 
 
-def obtener_historial(usuario: str, limite: int = 10):
+def _compactar_resultado(contenido: str) -> str:
+    """JSON sin espacios y recortado a HISTORIAL_HERRAMIENTA_CARACTERES"""
+    try:
+        contenido = json.dumps(json.loads(contenido), ensure_ascii=False, separators=(',', ':'))
+    except (TypeError, ValueError):
+        contenido = str(contenido)
+    if len(contenido) > HISTORIAL_HERRAMIENTA_CARACTERES:
+        contenido = contenido[:HISTORIAL_HERRAMIENTA_CARACTERES] + '…[recortado]'
+    return contenido
+
+
+def guardar_mensajes_herramientas(usuario: str, mensajes: list[dict], commit: bool = True):
+    """
+    Guarda las llamadas a herramientas y sus resultados de un turno en una sola transacción
+    
+    Args:
+        usuario: Número de teléfono o '99999999' para local
+        mensajes: Mensajes intermedios del asistente en formato OpenAI
+            ('assistant' con tool_calls y 'tool'), en orden
+        commit: False para dejarlos en la transacción actual (el llamador hace el commit)
+    """
+    if not HISTORIAL_HERRAMIENTAS or not mensajes:
+        return True
+    try:
+        filas = []
+        for mensaje in mensajes:
+            if mensaje.get('role') == 'assistant' and mensaje.get('tool_calls'):
+                llamadas = [
+                    {'id': c['id'], 'name': c['function']['name'], 'arguments': c['function']['arguments']}
+                    for c in mensaje['tool_calls']
+                ]
+                texto = json.dumps(llamadas, ensure_ascii=False, separators=(',', ':'))
+                filas.append(Conversacion(usuario=usuario, rol=ROL_LLAMADA_HERRAMIENTA, mensaje=texto))
+            elif mensaje.get('role') == 'tool':
+                resultado = {
+                    'id': mensaje['tool_call_id'],
+                    'name': mensaje.get('name'),
+                    'content': _compactar_resultado(mensaje.get('content'))
+                }
+                texto = json.dumps(resultado, ensure_ascii=False, separators=(',', ':'))
+                filas.append(Conversacion(usuario=usuario, rol=ROL_HERRAMIENTA, mensaje=texto))
+        db.session.add_all(filas)
+        if commit:
+            db.session.commit()
+        return True
+    except Exception as e:
+        print(f"Error guardando mensajes de herramientas: {e}")
+        db.session.rollback()
+        return False
+
+
+def _sin_huerfanos(mensajes: list[dict]) -> list[dict]:
+    """
+    Quita resultados de herramientas cuya llamada quedó fuera de la ventana y
+    llamadas sin todos sus resultados: la API rechaza ambos casos
+    """
+    limpios = []
+    i = 0
+    while i < len(mensajes):
+        mensaje = mensajes[i]
+        if mensaje['role'] == 'tool':
+            i += 1
+            continue
+        if mensaje['role'] == 'assistant' and mensaje.get('tool_calls'):
+            j = i + 1
+            while j < len(mensajes) and mensajes[j]['role'] == 'tool':
+                j += 1
+            ids = {c['id'] for c in mensaje['tool_calls']}
+            if {r['tool_call_id'] for r in mensajes[i + 1:j]} == ids:
+                limpios.extend(mensajes[i:j])
+            i = j
+            continue
+        limpios.append(mensaje)
+        i += 1
+    return limpios
+
+
+def obtener_historial(usuario: str, limite: int = 10, incluir_herramientas: bool = False):
     """
     Obtiene los últimos N mensajes de un usuario
     
     Args:
         usuario: Número de teléfono o '99999999' para local
         limite: Cantidad de mensajes a recuperar (default: 10)
+        incluir_herramientas: Incluir llamadas a herramientas y sus resultados
     
     Returns:
         Lista de diccionarios con formato OpenAI: [{'role': 'user', 'content': '...'}, ...]
     """
     try:
-        mensajes = Conversacion.query.filter_by(usuario=usuario)\
-            .order_by(Conversacion.fecha.desc())\
+        query = Conversacion.query.filter_by(usuario=usuario)
+        if not incluir_herramientas:
+            query = query.filter(Conversacion.rol.in_(ROLES_TEXTO))
+        
+        # Por id: los mensajes de un mismo turno suelen compartir el segundo de 'fecha'
+        mensajes = query.order_by(Conversacion.id.desc())\
             .limit(limite)\
             .all()
         
         # Invertir el orden para que los más antiguos estén primero
         mensajes.reverse()
         
-        return [msg.to_dict() for msg in mensajes]
+        historial = [msg.to_dict() for msg in mensajes]
+        return _sin_huerfanos(historial) if incluir_herramientas else historial
     except Exception as e:
         print(f"Error obteniendo historial: {e}")
         return []
 
 
+def obtener_historial_resumido(usuario: str, limite: int = 10, tokens_max: int = HISTORIAL_TOKENS_MAX,
+                               incluir_herramientas: bool = HISTORIAL_HERRAMIENTAS):
+    """
+    Historial para el asistente: resumen de los mensajes viejos más los últimos
+    mensajes todavía no resumidos, sin pasar de tokens_max
+    
+    Args:
+        usuario: Número de teléfono o '99999999' para local
+        limite: Máximo de mensajes textuales (default: 10); las llamadas a
+            herramientas y sus resultados no cuentan para el límite
+        tokens_max: Presupuesto de tokens del historial completo
+        incluir_herramientas: Incluir llamadas a herramientas y sus resultados
+    
+    Returns:
+        Lista de diccionarios con formato OpenAI; el resumen va como mensaje 'system'
+    """
+    try:
+        resumen = ResumenConversacion.query.filter_by(usuario=usuario).first() if HISTORIAL_RESUMEN else None
+        
+        query = Conversacion.query.filter(Conversacion.usuario == usuario)
+        if resumen:
+            query = query.filter(Conversacion.id > resumen.ultimo_mensaje_id)
+        if not incluir_herramientas:
+            query = query.filter(Conversacion.rol.in_(ROLES_TEXTO))
+        mensajes = query.order_by(Conversacion.id.desc()).limit(limite * 3 if incluir_herramientas else limite).all()
+        
+        contexto = []
+        presupuesto = tokens_max
+        if resumen and resumen.resumen:
+            texto = f"Resumen de la conversación anterior con este cliente:\n{resumen.resumen}"
+            contexto.append({'role': 'system', 'content': texto})
+            presupuesto -= estimar_tokens(texto)
+        
+        # Del más nuevo al más viejo mientras entren en el presupuesto (el último siempre va)
+        recientes = []
+        textos = 0
+        for msg in mensajes:
+            es_texto = msg.rol in ROLES_TEXTO
+            if es_texto and textos == limite:
+                break
+            tokens = estimar_tokens(msg.mensaje)
+            if recientes and tokens > presupuesto:
+                break
+            recientes.append(msg.to_dict())
+            presupuesto -= tokens
+            textos += es_texto
+        recientes.reverse()
+        
+        return contexto + _sin_huerfanos(recientes)
+    except Exception as e:
+        print(f"Error obteniendo historial resumido: {e}")
+        return []
+
+
+def _linea_resumen(mensaje) -> str:
+    if mensaje.rol == ROL_HERRAMIENTA:
+        resultado = mensaje.to_dict()
+        return f"Resultado de {resultado['name']}: {resultado['content'][:RESUMEN_CARACTERES_MENSAJE]}"
+    return f"{'Cliente' if mensaje.rol == 'user' else 'Asistente'}: {mensaje.mensaje[:RESUMEN_CARACTERES_MENSAJE]}"
+
+
+def _resumir(resumen_anterior: str, mensajes) -> str:
+    # Las llamadas no aportan al resumen: sus resultados sí (IDs de reservas, disponibilidad)
+    lineas = '\n'.join(_linea_resumen(m) for m in mensajes if m.rol != ROL_LLAMADA_HERRAMIENTA)
+    prompt = f"Resumen anterior:\n{resumen_anterior or '(sin resumen)'}\n\nMensajes nuevos:\n{lineas}"
+    return send_prompt(prompt, RESUMEN_INSTRUCCIONES)[:RESUMEN_TOKENS_MAX * 4]
+
+
+def actualizar_resumen(usuario: str):
+    """
+    Agrega al resumen del usuario los mensajes sin resumir, salvo los
+    HISTORIAL_RECIENTES más nuevos. Solo llama al LLM si hay al menos
+    RESUMEN_MIN_PENDIENTES mensajes para compactar.
+    
+    Returns:
+        True si el resumen se actualizó
+    """
+    try:
+        resumen = ResumenConversacion.query.filter_by(usuario=usuario).first()
+        
+        pendientes = Conversacion.query.filter(
+            Conversacion.usuario == usuario,
+            Conversacion.id > (resumen.ultimo_mensaje_id if resumen else 0)
+        ).order_by(Conversacion.id.asc()).all()
+        
+        a_resumir = pendientes[:len(pendientes) - HISTORIAL_RECIENTES]
+        if len(a_resumir) < RESUMEN_MIN_PENDIENTES:
+            return False
+        
+        texto = _resumir(resumen.resumen if resumen else '', a_resumir)
+        
+        if resumen is None:
+            resumen = ResumenConversacion(usuario=usuario)
+            db.session.add(resumen)
+        resumen.resumen = texto
+        resumen.ultimo_mensaje_id = a_resumir[-1].id
+        resumen.actualizado = datetime.now()
+        db.session.commit()
+        return True
+    except Exception as e:
+        print(f"Error actualizando resumen: {e}")
+        db.session.rollback()
+        return False
+
+
+def programar_resumen(usuario: str):
+    """Actualiza el resumen del usuario en segundo plano (uno a la vez por usuario)"""
+    if not HISTORIAL_RESUMEN or not has_app_context():
+        return
+    with _lock:
+        if usuario in _en_curso:
+            return
+        _en_curso.add(usuario)
+    app = current_app._get_current_object()
+    
+    def tarea():
+        try:
+            with app.app_context():
+                actualizar_resumen(usuario)
+        finally:
+            with _lock:
+                _en_curso.discard(usuario)
+    
+    _resumenes.submit(tarea)
+
+
 def limpiar_historial_antiguo(usuario: str, mantener_ultimos: int = 50):
     """
     Limpia mensajes antiguos manteniendo solo los últimos N
@@ -66,7 +335,7 @@ def limpiar_historial_antiguo(usuario: str, mantener_ultimos: int = 50):
     try:
         # Obtener el ID del mensaje N-ésimo más reciente
         mensajes = Conversacion.query.filter_by(usuario=usuario)\
-            .order_by(Conversacion.fecha.desc())\
+            .order_by(Conversacion.id.desc())\
             .limit(mantener_ultimos)\
             .all()
         
@@ -74,6 +343,11 @@ def limpiar_historial_antiguo(usuario: str, mantener_ultimos: int = 50):
             # Hay más de N mensajes, eliminar los antiguos
             ultimo_id_a_mantener = mensajes[-1].id
             
+            # Los mensajes que todavía no entraron en el resumen no se borran
+            if HISTORIAL_RESUMEN:
+                resumen = ResumenConversacion.query.filter_by(usuario=usuario).first()
+                ultimo_id_a_mantener = min(ultimo_id_a_mantener, (resumen.ultimo_mensaje_id if resumen else 0) + 1)
+            
             Conversacion.query.filter(
                 Conversacion.usuario == usuario,
                 Conversacion.id < ultimo_id_a_mantener
@@ -98,7 +372,9 @@ def obtener_estadisticas_usuario(usuario: str):
         Dict con estadísticas
     """
     try:
-        total_mensajes = Conversacion.query.filter_by(usuario=usuario).count()
+        total_mensajes = Conversacion.query.filter(
+            Conversacion.usuario == usuario, Conversacion.rol.in_(ROLES_TEXTO)
+        ).count()
         mensajes_usuario = Conversacion.query.filter_by(usuario=usuario, rol='user').count()
         mensajes_asistente = Conversacion.query.filter_by(usuario=usuario, rol='assistant').count()
         
@@ -0,0 +1,78 @@
+"""
+Deduplicación de mensajes entrantes de WhatsApp por message_id (wamid).
+
+Meta reentrega un mensaje si el webhook tarda o falla, y cada reentrega
+volvía a correr el asistente (y podía duplicar una reserva). El webhook
+registra el message_id en la misma transacción que encola el trabajo: la
+restricción UNIQUE hace que una reentrega, aunque llegue en paralelo, no
+encole nada. El worker guarda la respuesta del asistente en el registro en
+la misma transacción que el historial, y lo marca como respondido recién
+cuando el envío sale: un reintento del trabajo reenvía la respuesta guardada
+sin volver a correr el asistente, y uno con el mensaje ya enviado no hace nada.
+
+Los registros vencen a los DEDUP_TTL_HORAS (Meta reintenta hasta 7 días).
+"""
+import os
+from datetime import datetime, timedelta
+
+from app.models import db, MensajeProcesado
+
+
+DEDUP_TTL_HORAS = int(os.getenv('DEDUP_TTL_HORAS', 7 * 24))
+
+
+def ya_recibido(message_id: str) -> bool:
+    return db.session.query(
+        MensajeProcesado.query.filter_by(message_id=message_id).exists()
+    ).scalar()
+
+
+def registrar_recibido(message_id: str, usuario: str):
+    """Agrega el registro a la transacción actual (IntegrityError al hacer commit si ya existía)"""
+    ahora = datetime.now()
+    db.session.add(MensajeProcesado(
+        message_id=message_id,
+        usuario=usuario,
+        recibido=ahora,
+        expira=ahora + timedelta(hours=DEDUP_TTL_HORAS)
+    ))
+
+
+def ya_respondido(message_id: str) -> bool:
+    return db.session.query(
+        MensajeProcesado.query.filter(
+            MensajeProcesado.message_id == message_id,
+            MensajeProcesado.respondido.isnot(None)
+        ).exists()
+    ).scalar()
+
+
+def respuesta_pendiente(message_id: str):
+    """Respuesta ya generada para el mensaje que todavía no se envió, o None"""
+    return db.session.query(MensajeProcesado.respuesta).filter(
+        MensajeProcesado.message_id == message_id,
+        MensajeProcesado.respondido.is_(None)
+    ).scalar()
+
+
+def guardar_respuesta(message_id: str, respuesta: str):
+    """Guarda la respuesta del asistente en la transacción actual (sin commit)"""
+    MensajeProcesado.query.filter_by(message_id=message_id).update(
+        {'respuesta': respuesta}, synchronize_session=False
+    )
+
+
+def marcar_respondido(message_id: str):
+    """Marca el mensaje como respondido en la transacción actual (sin commit)"""
+    MensajeProcesado.query.filter_by(message_id=message_id).update(
+        {'respondido': datetime.now()}, synchronize_session=False
+    )
+
+
+def purgar_vencidos():
+    """Borra los registros vencidos; devuelve cuántos borró"""
+    borrados = MensajeProcesado.query.filter(
+        MensajeProcesado.expira < datetime.now()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borrados
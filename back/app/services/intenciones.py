@@ -0,0 +1,348 @@
+"""
+Camino rápido del asistente sin LLM.
+
+Un extractor por reglas reconoce las consultas más comunes ("mis reservas",
+"quiero cancelar", "cuánto sale la cancha", "¿hay lugar mañana a las 18?"),
+ejecuta la misma herramienta que pediría el modelo y responde con una
+plantilla. Si el mensaje es ambiguo, pide algo que el camino rápido no
+resuelve o falta algún dato, la confianza queda por debajo de
+FAST_PATH_CONFIANZA_MIN y el mensaje sigue al LLM.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from app.services.ai import _normalize_args, _ejecutar_herramienta
+from app.services.catalogo import obtener_catalogo
+from app.services.slots import _normalizar_hora, es_horario_valido
+
+
+FAST_PATH = os.getenv('FAST_PATH', '1') == '1'
+FAST_PATH_CONFIANZA_MIN = float(os.getenv('FAST_PATH_CONFIANZA_MIN', 0.8))
+
+# Los mensajes largos suelen traer más de un pedido: esos van al LLM
+FAST_PATH_MAX_PALABRAS = 16
+
+Intencion = namedtuple('Intencion', 'nombre args confianza')
+
+# Patrones sobre el texto en minúsculas y sin tildes
+_PATRONES = {
+    'mis_reservas': [
+        r'\bmis (reservas|turnos)\b',
+        r'\bque (reservas|turnos) tengo\b',
+        r'\btengo (alguna |algun )?(reserva|turno)s?\b',
+    ],
+    'cancelar': [
+        r'\b(quiero|quisiera|necesito|puedo|como) cancelar\b',
+        r'^cancelar\b',
+        r'\bcancel(ar|a|ame) (mi|la|el|una|un) (reserva|turno)\b',
+    ],
+    'precio': [
+        r'\bprecios?\b',
+        r'\bcuanto (sale|cuesta|vale|esta|cobran)\b',
+        r'\btarifas?\b',
+    ],
+    'disponibilidad': [
+        r'\b(hay|tenes|tienen|queda|quedan) (lugar|turnos?|canchas?|algo)\b',
+        r'\bdisponib',
+        r'\blibres?\b',
+        r'\bse puede jugar\b',
+    ],
+}
+
+# Pedidos que el camino rápido no resuelve: reservar, modificar, turnos fijos, confirmaciones
+_EXCLUSIONES = re.compile(
+    r'\b(reserv(ar|ame|amela|ala|alo|o|es)|agend\w*|anot\w*|cambi\w*|mov(er|e|eme)|pas(ar|ame|amela)'
+    r'|modific\w*|fij[oa]s?|todas las semanas)\b'
+    r'|^(si|no|dale|ok|okey|listo|confirmo|perfecto)\b'
+)
+
+# Intenciones que suelen aparecer juntas y se responden con una sola plantilla
+_COMBINADAS = {
+    frozenset({'mis_reservas', 'cancelar'}): 'cancelar',
+    frozenset({'precio', 'disponibilidad'}): 'disponibilidad',
+}
+
+_FECHA = re.compile(
+    r'\b(hoy|pasado manana|manana'
+    r'|(el )?(lunes|martes|miercoles|jueves|viernes|sabado|domingo)'
+    r'|\d{1,2}/\d{1,2}(/\d{2,4})?'
+    r'|(el )?\d{1,2} de (enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre))\b'
+)
+_HORA = re.compile(
+    r'\b(?:a las|a la|las|tipo|desde las)\s+(\d{1,2})(?:[:.](\d{2}))?\b'
+    r'|\b(\d{1,2})[:.](\d{2})\b'
+    r'|\b(\d{1,2})\s*(?:hs|h)\b'
+)
+
+
+def _sin_tildes(texto: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+
+def _hora_de(match):
+    horas = match.group(1) or match.group(3) or match.group(5)
+    minutos = match.group(2) or match.group(4) or '00'
+    horas = int(horas)
+    # "a las 7" en un complejo que abre de 8 a 23 es a la tarde
+    if horas < 8:
+        horas += 12
+    if horas > 23 or int(minutos) > 59:
+        return None
+    return f'{horas:02d}:{minutos}'
+
+
+def _extraer_horas(texto: str) -> list[str]:
+    """Horas de inicio "HH:MM" mencionadas en el texto, sin repetir y en orden (None si una no es válida)"""
+    horas = []
+    for match in _HORA.finditer(_FECHA.sub(' ', texto)):
+        hora = _hora_de(match)
+        if hora not in horas:
+            horas.append(hora)
+    return horas
+
+
+def _extraer_fechas(texto: str) -> list[str]:
+    """Fechas mencionadas en el texto (tal como aparecen), sin repetir y en orden"""
+    fechas = []
+    for match in _FECHA.finditer(texto):
+        fecha = re.sub(r'^el ', '', match.group(0))
+        if fecha not in fechas:
+            fechas.append(fecha)
+    return fechas
+
+
+def _extraer_cancha(texto: str, canchas: list[dict]):
+    # Nombre completo como palabra ("cancha 10" no es "Cancha 1"); gana el más largo
+    for cancha in sorted(canchas, key=lambda c: len(c['nombre']), reverse=True):
+        nombre = re.escape(_sin_tildes(cancha['nombre'].lower()))
+        if re.search(rf'(?<!\w){nombre}(?!\w)', texto):
+            return cancha['nombre']
+    return None
+
+
+def detectar_intencion(mensaje: str, canchas: list[dict]) -> Intencion:
+    """
+    Clasifica el mensaje y extrae sus datos.
+
+    Returns:
+        Intencion con la confianza (0 a 1); nombre None si ninguna regla aplica
+    """
+    texto = _sin_tildes(mensaje.lower()).strip()
+    texto = re.sub(r'[¿?¡!,;]', ' ', texto)
+    texto = re.sub(r'\s+', ' ', texto).strip()
+
+    candidatas = [nombre for nombre, patrones in _PATRONES.items() if any(re.search(p, texto) for p in patrones)]
+    if not candidatas:
+        return Intencion(None, {}, 0.0)
+
+    # "¿Cancelo y cambio de horario?": dos pedidos distintos van al LLM
+    nombre = candidatas[0] if len(candidatas) == 1 else _COMBINADAS.get(frozenset(candidatas))
+    confianza = 1.0
+    if nombre is None:
+        nombre, confianza = candidatas[0], 0.3
+    if _EXCLUSIONES.search(texto):
+        confianza = min(confianza, 0.2)
+    if len(texto.split()) > FAST_PATH_MAX_PALABRAS:
+        confianza = min(confianza, 0.5)
+
+    args = {}
+    cancha = _extraer_cancha(texto, canchas)
+    if cancha:
+        args['cancha_nombre'] = cancha
+
+    if nombre == 'cancelar' and re.search(r'\d', texto):
+        # Cancelar una reserva puntual es una escritura: la confirma el LLM
+        confianza = min(confianza, 0.4)
+
+    if nombre == 'disponibilidad':
+        fechas = _extraer_fechas(texto)
+        horas = _extraer_horas(texto)
+        if len(fechas) > 1 or len(horas) > 1:
+            # "¿Hay lugar a las 18 o a las 20?": varias opciones las compara el LLM
+            confianza = min(confianza, 0.4)
+        fecha = fechas[0] if fechas else None
+        hora = horas[0] if horas else None
+        if fecha and hora:
+            if fecha == 'pasado manana':
+                # dateparser no lo reconoce
+                fecha = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
+            args.update(_normalize_args({'fecha': fecha, 'hora': hora}))
+        if not re.match(r'^\d{4}-\d{2}-\d{2}$', args.get('fecha', '')):
+            confianza = min(confianza, 0.4)
+        elif not es_horario_valido(_normalizar_hora(args.get('hora', ''))):
+            # Horario fuera de la grilla: el LLM explica las opciones
+            confianza = min(confianza, 0.4)
+        elif args['fecha'] < datetime.now().strftime('%Y-%m-%d'):
+            confianza = min(confianza, 0.4)
+
+    return Intencion(nombre, args, confianza)
+
+
+def _linea_reserva(reserva: dict) -> str:
+    if reserva.get('turno_fijo_id'):
+        return f"• Turno fijo – {reserva['cancha']}, {reserva['fecha']} {reserva['hora']} (${reserva['monto']})"
+    return f"• #{reserva['id']} – {reserva['cancha']}, {reserva['fecha']} {reserva['hora']} (${reserva['monto']})"
+
+
+def _responder_mis_reservas(intencion, usuario, funcs, canchas):
+    resultado = _ejecutar_herramienta('listar_reservas_usuario', {}, usuario, funcs)
+    if not resultado or not resultado.get('exito'):
+        return None
+    reservas = resultado.get('reservas') or []
+    if not reservas:
+        return resultado.get('mensaje') or 'No tenés reservas pendientes.'
+    lineas = '\n'.join(_linea_reserva(r) for r in reservas)
+    return f"Tenés {len(reservas)} reserva(s) pendiente(s):\n{lineas}"
+
+
+def _responder_cancelar(intencion, usuario, funcs, canchas):
+    resultado = _ejecutar_herramienta('listar_reservas_usuario', {}, usuario, funcs)
+    if not resultado or not resultado.get('exito'):
+        return None
+    reservas = resultado.get('reservas') or []
+    if not reservas:
+        return 'No tenés reservas pendientes para cancelar.'
+    lineas = '\n'.join(_linea_reserva(r) for r in reservas)
+    return f"Estas son tus reservas pendientes:\n{lineas}\n¿Cuál querés cancelar? Indicame el número de reserva (o la fecha, si es un turno fijo)."
+
+
+def _responder_precio(intencion, usuario, funcs, canchas):
+    if not canchas:
+        return None
+    nombre = intencion.args.get('cancha_nombre')
+    if nombre:
+        cancha = next(c for c in canchas if c['nombre'] == nombre)
+        return f"La {cancha['nombre']} sale ${cancha['precio']} el turno."
+    lineas = '\n'.join(f"• {c['nombre']}: ${c['precio']}" for c in canchas)
+    return f"Estos son los precios por turno:\n{lineas}"
+
+
+def _responder_disponibilidad(intencion, usuario, funcs, canchas):
+    args = intencion.args
+    fecha_texto = datetime.strptime(args['fecha'], '%Y-%m-%d').strftime('%d/%m/%Y')
+    hora = _normalizar_hora(args['hora'])
+
+    if args.get('cancha_nombre'):
+        resultado = _ejecutar_herramienta('verificar_disponibilidad', {
+            'cancha_nombre': args['cancha_nombre'], 'fecha': args['fecha'], 'hora': hora
+        }, usuario, funcs)
+        # Si no está libre, el LLM busca alternativas y lo explica mejor
+        if not resultado or not resultado.get('disponible'):
+            return None
+        cancha = next(c for c in canchas if c['nombre'] == args['cancha_nombre'])
+        respuesta = f"¡Sí! La {cancha['nombre']} está libre el {fecha_texto} de {hora.replace('-', ' a ')} (${cancha['precio']})."
+        if resultado.get('retenida_hasta'):
+            respuesta += f" Te la guardo hasta las {resultado['retenida_hasta']}."
+        return respuesta + ' ¿Querés que te la reserve?'
+
+    resultado = _ejecutar_herramienta('consultar_disponibilidad_rango', {
+        'fecha_desde': args['fecha'], 'horas': [hora]
+    }, usuario, funcs)
+    if not resultado or not resultado.get('exito'):
+        return None
+    libres = [nombre for nombre, fechas in resultado.get('libres', {}).items() if hora in fechas.get(args['fecha'], [])]
+    if not libres:
+        return None
+    precios = {c['nombre']: c['precio'] for c in canchas}
+    lineas = '\n'.join(f"• {nombre} (${precios.get(nombre, '-')})" for nombre in libres)
+    return f"El {fecha_texto} de {hora.replace('-', ' a ')} hay lugar en:\n{lineas}\n¿Cuál querés reservar?"
+
+
+_RESPUESTAS = {
+    'mis_reservas': _responder_mis_reservas,
+    'cancelar': _responder_cancelar,
+    'precio': _responder_precio,
+    'disponibilidad': _responder_disponibilidad,
+}
+
+
+class EstadisticasFastPath:
+    """Tasa de aciertos del camino rápido y latencia ahorrada (por proceso)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._mensajes = 0
+            self._aciertos = {}
+            self._derivados = {}
+            self._segundos_rapido = 0.0
+            self._llm_mensajes = 0
+            self._segundos_llm = 0.0
+
+    def registrar_acierto(self, intencion: str, segundos: float):
+        with self._lock:
+            self._mensajes += 1
+            self._aciertos[intencion] = self._aciertos.get(intencion, 0) + 1
+            self._segundos_rapido += segundos
+
+    def registrar_derivado(self, intencion: str):
+        with self._lock:
+            self._mensajes += 1
+            clave = intencion or 'sin_intencion'
+            self._derivados[clave] = self._derivados.get(clave, 0) + 1
+
+    def registrar_llm(self, segundos: float):
+        """Duración de un mensaje respondido por el LLM (referencia para el ahorro)"""
+        with self._lock:
+            self._llm_mensajes += 1
+            self._segundos_llm += segundos
+
+    def resumen(self) -> dict:
+        with self._lock:
+            aciertos = sum(self._aciertos.values())
+            promedio_rapido = self._segundos_rapido / aciertos if aciertos else 0.0
+            promedio_llm = self._segundos_llm / self._llm_mensajes if self._llm_mensajes else None
+            return {
+                'habilitado': FAST_PATH,
+                'mensajes': self._mensajes,
+                'aciertos': aciertos,
+                'tasa_aciertos': round(aciertos / self._mensajes, 4) if self._mensajes else 0.0,
+                'aciertos_por_intencion': dict(self._aciertos),
+                'derivados_al_llm': dict(self._derivados),
+                'latencia_promedio_ms': {
+                    'camino_rapido': round(promedio_rapido * 1000, 1),
+                    'llm': round(promedio_llm * 1000, 1) if promedio_llm is not None else None
+                },
+                'segundos_ahorrados': round(aciertos * (promedio_llm - promedio_rapido), 2) if promedio_llm is not None else None
+            }
+
+
+ESTADISTICAS = EstadisticasFastPath()
+
+
+def responder_sin_llm(user_message: str, usuario: str = None, funcs: dict = None):
+    """
+    Responde el mensaje con reglas y plantillas si la intención es clara.
+
+    Returns:
+        Texto de la respuesta, o None si el mensaje tiene que ir al LLM
+    """
+    if not FAST_PATH or not user_message:
+        return None
+
+    inicio = time.perf_counter()
+    canchas = obtener_catalogo()['canchas']
+    intencion = detectar_intencion(user_message, canchas)
+    if intencion.nombre is None or intencion.confianza < FAST_PATH_CONFIANZA_MIN:
+        ESTADISTICAS.registrar_derivado(intencion.nombre)
+        return None
+
+    try:
+        respuesta = _RESPUESTAS[intencion.nombre](intencion, usuario, funcs or {}, canchas)
+    except Exception as e:
+        print(f"Error en camino rápido ({intencion.nombre}): {e}")
+        respuesta = None
+
+    if respuesta is None:
+        ESTADISTICAS.registrar_derivado(intencion.nombre)
+        return None
+    ESTADISTICAS.registrar_acierto(intencion.nombre, time.perf_counter() - inicio)
+    return respuesta
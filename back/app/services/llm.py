@@ -0,0 +1,340 @@
+"""
+Backend del LLM del asistente.
+
+LLM_BACKEND elige de dónde salen las respuestas del modelo:
+    - 'openai': cliente real (requiere OPENAI_API_KEY)
+    - 'fake': guion local con reglas que emite llamadas a herramientas, sin red
+    - 'record': cliente real que además graba cada intercambio en LLM_CASETE
+    - 'replay': reproduce las respuestas grabadas en LLM_CASETE, sin red
+
+Todos exponen la misma interfaz que el SDK de OpenAI
+(cliente.chat.completions.create(...), con o sin stream=True) y devuelven sus
+mismos tipos, así ai.py no distingue el backend. El cliente se crea en el
+primer uso: la app arranca sin OPENAI_API_KEY en los modos sin red.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+LLM_CASETE = os.getenv('LLM_CASETE', 'llm_casete.jsonl')
+
+# Guion del backend 'fake' (JSON con una lista de pasos, ver GUION_PREDETERMINADO)
+LLM_FAKE_GUION = os.getenv('LLM_FAKE_GUION')
+
+# Latencia simulada por llamada en los modos sin red, para benchmarks realistas
+LLM_FAKE_LATENCIA_MS = int(os.getenv('LLM_FAKE_LATENCIA_MS', 0))
+
+BACKENDS = ('openai', 'fake', 'record', 'replay')
+
+# Cada paso: si el último mensaje del usuario coincide con 'patron', pide la
+# herramienta con esos argumentos o, si no tiene herramienta, responde 'respuesta'.
+# En los argumentos, {hoy} y {manana} se reemplazan por la fecha YYYY-MM-DD.
+GUION_PREDETERMINADO = [
+    {'patron': r'mis (reservas|turnos)|cancel', 'herramienta': 'listar_reservas_usuario', 'argumentos': {}},
+    {'patron': r'reserv|lugar|disponib|libre|turno', 'herramienta': 'consultar_disponibilidad_rango',
+     'argumentos': {'fecha_desde': '{manana}'}},
+    {'patron': r'.', 'respuesta': '¡Hola! Soy el asistente de prueba. ¿En qué te puedo ayudar?'},
+]
+
+
+class CaseteNoEncontradoError(RuntimeError):
+    """El modo replay no tiene una respuesta grabada para la conversación"""
+
+
+def _como_dict(mensaje):
+    if isinstance(mensaje, dict):
+        return mensaje
+    return mensaje.model_dump(exclude_none=True)
+
+
+def clave_conversacion(mensajes) -> str:
+    """
+    Clave de un pedido para el casete: la forma de la conversación sin el
+    system prompt (lleva la fecha actual) ni los resultados de las herramientas
+    (dependen de la base). La misma charla del usuario se reproduce cualquier día.
+    """
+    forma = []
+    for mensaje in map(_como_dict, mensajes):
+        rol = mensaje.get('role')
+        if rol == 'system':
+            continue
+        if rol == 'user':
+            forma.append(['user', mensaje.get('content')])
+        elif rol == 'assistant':
+            forma.append(['assistant', [c['function']['name'] for c in mensaje.get('tool_calls') or []] or mensaje.get('content')])
+        elif rol == 'tool':
+            forma.append(['tool', mensaje.get('name')])
+    return hashlib.sha256(json.dumps(forma, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+
+def _completion(modelo, contenido=None, tool_calls=None, usage=None) -> dict:
+    completion = {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:24]}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': modelo,
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'tool_calls' if tool_calls else 'stop',
+            'message': {'role': 'assistant', 'content': contenido, 'tool_calls': tool_calls or None}
+        }]
+    }
+    if usage:
+        completion['usage'] = usage
+    return completion
+
+
+def _usage_estimado(mensajes, completion: dict) -> dict:
+    """Uso de tokens aproximado (~4 caracteres por token) para los modos sin red"""
+    prompt = sum(len(json.dumps(_como_dict(m), ensure_ascii=False, default=str)) for m in mensajes) // 4
+    salida = len(json.dumps(completion['choices'][0]['message'], ensure_ascii=False)) // 4
+    return {'prompt_tokens': prompt, 'completion_tokens': salida, 'total_tokens': prompt + salida}
+
+
+def _chunks(completion: dict) -> list[dict]:
+    """Parte una respuesta completa en chunks como los de stream=True"""
+    mensaje = completion['choices'][0]['message']
+    base = {'id': completion['id'], 'object': 'chat.completion.chunk', 'created': completion['created'], 'model': completion['model']}
+    deltas = [{'role': 'assistant', 'content': palabra} for palabra in re.findall(r'\S+\s*', mensaje.get('content') or '')]
+    deltas += [
+        {'tool_calls': [dict(llamada, index=i)]}
+        for i, llamada in enumerate(mensaje.get('tool_calls') or [])
+    ]
+    chunks = [dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': None}]) for delta in deltas]
+    chunks.append(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': completion['choices'][0]['finish_reason']}]))
+    if completion.get('usage'):
+        chunks.append(dict(base, choices=[], usage=completion['usage']))
+    return chunks
+
+
+def _respuesta(completion: dict, stream: bool):
+    if stream:
+        return iter([ChatCompletionChunk.model_validate(c) for c in _chunks(completion)])
+    return ChatCompletion.model_validate(completion)
+
+
+class _Completions:
+    """Adaptador con la forma cliente.chat.completions.create del SDK"""
+
+    def __init__(self, crear):
+        self.create = crear
+
+
+class BackendFalso:
+    """Responde con un guion de reglas y pide herramientas como lo haría el modelo"""
+
+    def __init__(self, guion=None, latencia_ms=LLM_FAKE_LATENCIA_MS):
+        self.guion = guion or GUION_PREDETERMINADO
+        self.latencia_ms = latencia_ms
+        self.chat = SimpleNamespace(completions=_Completions(self.create))
+
+    def _responder(self, modelo, mensajes, tools) -> dict:
+        ultimo = _como_dict(mensajes[-1])
+
+        # Después de ejecutar herramientas: resumir el resultado
+        if ultimo.get('role') == 'tool':
+            try:
+                resultado = json.loads(ultimo.get('content') or '{}')
+            except ValueError:
+                resultado = {}
+            texto = resultado.get('mensaje') or resultado.get('error') if isinstance(resultado, dict) else None
+            return _completion(modelo, texto or 'Listo, ya lo consulté.')
+
+        texto_usuario = ultimo.get('content') or ''
+        disponibles = {t['function']['name'] for t in tools or []}
+        hoy = datetime.now().date()
+        for paso in self.guion:
+            if not re.search(paso['patron'], texto_usuario, re.IGNORECASE):
+                continue
+            herramienta = paso.get('herramienta')
+            if herramienta and herramienta in disponibles:
+                argumentos = json.dumps(paso.get('argumentos') or {}, ensure_ascii=False).replace(
+                    '{hoy}', hoy.isoformat()).replace('{manana}', (hoy + timedelta(days=1)).isoformat())
+                return _completion(modelo, tool_calls=[{
+                    'id': f'call_{uuid.uuid4().hex[:24]}',
+                    'type': 'function',
+                    'function': {'name': herramienta, 'arguments': argumentos}
+                }])
+            if paso.get('respuesta'):
+                return _completion(modelo, paso['respuesta'])
+        return _completion(modelo, 'No entendí tu consulta.')
+
+    def create(self, model=None, messages=None, tools=None, stream=False, **kwargs):
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+        completion = self._responder(model, messages, tools)
+        completion['usage'] = _usage_estimado(messages, completion)
+        return _respuesta(completion, stream)
+
+
+class Casete:
+    """Archivo JSONL de intercambios grabados: una línea por llamada al modelo"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._respuestas = None   # clave -> [completion, ...]
+        self._usos = {}
+
+    def grabar(self, mensajes, completion: dict):
+        linea = {
+            'clave': clave_conversacion(mensajes),
+            'mensajes': [_como_dict(m) for m in mensajes if _como_dict(m).get('role') != 'system'],
+            'respuesta': completion
+        }
+        with self._lock:
+            with open(self.ruta, 'a', encoding='utf-8') as archivo:
+                archivo.write(json.dumps(linea, ensure_ascii=False, default=str) + '\n')
+
+    def _cargar(self):
+        respuestas = {}
+        if os.path.exists(self.ruta):
+            with open(self.ruta, encoding='utf-8') as archivo:
+                for linea in archivo:
+                    if linea.strip():
+                        registro = json.loads(linea)
+                        respuestas.setdefault(registro['clave'], []).append(registro['respuesta'])
+        return respuestas
+
+    def buscar(self, mensajes) -> dict:
+        """Respuesta grabada para la conversación; si se grabó varias veces, rota entre ellas"""
+        clave = clave_conversacion(mensajes)
+        with self._lock:
+            if self._respuestas is None:
+                self._respuestas = self._cargar()
+            grabadas = self._respuestas.get(clave)
+            if not grabadas:
+                raise CaseteNoEncontradoError(f'No hay respuesta grabada en {self.ruta} para la conversación {clave}')
+            uso = self._usos.get(clave, 0)
+            self._usos[clave] = uso + 1
+            return grabadas[uso % len(grabadas)]
+
+
+class BackendGrabador:
+    """Cliente real que graba cada respuesta (completa o en stream) en el casete"""
+
+    def __init__(self, cliente, casete):
+        self._cliente = cliente
+        self._casete = casete
+        self.chat = SimpleNamespace(completions=_Completions(self.create))
+
+    def create(self, messages=None, stream=False, **kwargs):
+        mensajes = list(messages)
+        respuesta = self._cliente.chat.completions.create(messages=messages, stream=stream, **kwargs)
+        if not stream:
+            self._casete.grabar(mensajes, respuesta.model_dump())
+            return respuesta
+        return self._grabar_stream(mensajes, respuesta)
+
+    def _grabar_stream(self, mensajes, stream):
+        # Se reconstruye la respuesta completa a partir de los chunks para grabarla
+        contenido, llamadas, base, fin, usage = [], {}, None, 'stop', None
+        for chunk in stream:
+            yield chunk
+            base = base or chunk
+            usage = chunk.usage or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            fin = chunk.choices[0].finish_reason or fin
+            if delta.content:
+                contenido.append(delta.content)
+            for parcial in delta.tool_calls or []:
+                llamada = llamadas.setdefault(parcial.index, {'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''}})
+                llamada['id'] = parcial.id or llamada['id']
+                if parcial.function and parcial.function.name:
+                    llamada['function']['name'] += parcial.function.name
+                if parcial.function and parcial.function.arguments:
+                    llamada['function']['arguments'] += parcial.function.arguments
+        if base is None:
+            return
+        completion = _completion(base.model, ''.join(contenido) or None, [llamadas[i] for i in sorted(llamadas)],
+                                 usage.model_dump() if usage else None)
+        completion['choices'][0]['finish_reason'] = fin
+        self._casete.grabar(mensajes, completion)
+
+
+class BackendReproductor:
+    """Devuelve las respuestas grabadas en el casete, sin red"""
+
+    def __init__(self, casete, latencia_ms=LLM_FAKE_LATENCIA_MS):
+        self._casete = casete
+        self.latencia_ms = latencia_ms
+        self.chat = SimpleNamespace(completions=_Completions(self.create))
+
+    def create(self, messages=None, stream=False, **kwargs):
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+        return _respuesta(self._casete.buscar(messages), stream)
+
+
+class _ClienteAsync:
+    """Interfaz async sobre un backend sin red: corre el create sincrónico en un hilo"""
+
+    def __init__(self, backend):
+        async def crear(**kwargs):
+            return await asyncio.to_thread(backend.chat.completions.create, **kwargs)
+        self.chat = SimpleNamespace(completions=_Completions(crear))
+
+
+_clientes = {}
+_lock = threading.Lock()
+
+
+def _api_key():
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise RuntimeError('Missing required environment variable: OPENAI_API_KEY (o usar LLM_BACKEND=fake/replay)')
+    return api_key
+
+
+# Los clientes de OpenAI se crean sin reintentos propios: los reintentos con
+# backoff y el circuit breaker están en app.services.resiliencia
+def _crear_cliente(tipo, timeout=None):
+    if LLM_BACKEND not in BACKENDS:
+        raise RuntimeError(f'LLM_BACKEND inválido: {LLM_BACKEND}. Opciones: {", ".join(BACKENDS)}')
+    if LLM_BACKEND == 'fake':
+        backend = BackendFalso(json.load(open(LLM_FAKE_GUION, encoding='utf-8')) if LLM_FAKE_GUION else None)
+    elif LLM_BACKEND == 'replay':
+        backend = BackendReproductor(Casete(LLM_CASETE))
+    elif LLM_BACKEND == 'record':
+        backend = BackendGrabador(OpenAI(api_key=_api_key(), timeout=timeout, max_retries=0), Casete(LLM_CASETE))
+    elif tipo == 'async':
+        return AsyncOpenAI(api_key=_api_key(), timeout=timeout, max_retries=0)
+    else:
+        return OpenAI(api_key=_api_key(), timeout=timeout, max_retries=0)
+    return _ClienteAsync(backend) if tipo == 'async' else backend
+
+
+def obtener_cliente(timeout=None):
+    """Cliente sincrónico del backend configurado (se crea en el primer uso)"""
+    with _lock:
+        if 'sync' not in _clientes:
+            _clientes['sync'] = _crear_cliente('sync', timeout)
+        return _clientes['sync']
+
+
+def obtener_cliente_async(timeout=None):
+    """
+    Cliente async del backend configurado. El de OpenAI queda atado al event
+    loop donde se usa por primera vez: usarlo siempre desde el mismo loop.
+    """
+    with _lock:
+        if 'async' not in _clientes:
+            _clientes['async'] = _crear_cliente('async', timeout)
+        return _clientes['async']
@@ -0,0 +1,130 @@
+"""
+Métricas por mensaje del asistente: tokens de cada llamada al LLM, vueltas
+del loop, duración de cada herramienta y tiempo total. Se guarda una fila
+compacta por mensaje en MetricaTurno y se agrega por día, usuario y
+herramienta con percentiles calculados en el servidor.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+
+from app.models import db, MetricaTurno
+
+
+# Rango máximo de las consultas agregadas
+MAX_DIAS_METRICAS = 92
+
+PERCENTILES = (50, 95, 99)
+
+
+class MedicionTurno:
+    """Acumula las métricas de un mensaje mientras se procesa"""
+
+    def __init__(self, modelo=None):
+        self.inicio = time.perf_counter()
+        self.modelo = modelo
+        self.llamadas = []       # [(tokens_prompt, tokens_completion)]
+        self.herramientas = []   # [(nombre, ms)]
+        self.resultado = 'ok'
+
+    def registrar_llamada(self, usage):
+        """Agrega una llamada al LLM con su usage (None si el backend no lo informa)"""
+        self.llamadas.append((
+            getattr(usage, 'prompt_tokens', 0) or 0,
+            getattr(usage, 'completion_tokens', 0) or 0
+        ))
+
+    def registrar_herramienta(self, nombre, segundos):
+        # Las herramientas en paralelo agregan desde varios hilos: append es atómico
+        self.herramientas.append((nombre, round(segundos * 1000)))
+
+    def a_registro(self, usuario, origen):
+        return MetricaTurno(
+            fecha=datetime.now(),
+            usuario=str(usuario or ''),
+            origen=origen,
+            modelo=self.modelo,
+            resultado=self.resultado,
+            vueltas=len(self.llamadas),
+            tokens_prompt=sum(p for p, _ in self.llamadas),
+            tokens_completion=sum(c for _, c in self.llamadas),
+            llamadas=json.dumps(self.llamadas, separators=(',', ':')) if self.llamadas else None,
+            herramientas=json.dumps(self.herramientas, separators=(',', ':'), ensure_ascii=False) if self.herramientas else None,
+            duracion_ms=round((time.perf_counter() - self.inicio) * 1000)
+        )
+
+
+def guardar_medicion(medicion, usuario, origen):
+    """Guarda la métrica del mensaje; un error acá nunca afecta la respuesta"""
+    try:
+        db.session.add(medicion.a_registro(usuario, origen))
+        db.session.commit()
+    except Exception as e:
+        print(f"Error guardando métrica: {e}")
+        db.session.rollback()
+
+
+def percentiles(valores):
+    """p50/p95/p99 por rango más cercano"""
+    if not valores:
+        return {f'p{p}': None for p in PERCENTILES}
+    ordenados = sorted(valores)
+    return {f'p{p}': ordenados[min(len(ordenados) - 1, max(0, -(-len(ordenados) * p // 100) - 1))] for p in PERCENTILES}
+
+
+def _filas(desde, hasta, usuario=None):
+    if (hasta - desde).days + 1 > MAX_DIAS_METRICAS:
+        raise ValueError(f'El rango no puede superar los {MAX_DIAS_METRICAS} días')
+    query = db.session.query(
+        MetricaTurno.fecha, MetricaTurno.usuario, MetricaTurno.origen, MetricaTurno.resultado,
+        MetricaTurno.vueltas, MetricaTurno.tokens_prompt, MetricaTurno.tokens_completion,
+        MetricaTurno.herramientas, MetricaTurno.duracion_ms
+    ).filter(
+        MetricaTurno.fecha >= datetime.combine(desde, datetime.min.time()),
+        MetricaTurno.fecha < datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+    )
+    if usuario:
+        query = query.filter(MetricaTurno.usuario == usuario)
+    return query.all()
+
+
+def _resumir(filas):
+    duraciones = [f.duracion_ms for f in filas]
+    return {
+        'mensajes': len(filas),
+        'sin_llm': sum(1 for f in filas if f.origen == 'rapido'),
+        'errores': sum(1 for f in filas if f.resultado != 'ok'),
+        'llamadas_llm': sum(f.vueltas for f in filas),
+        'vueltas_promedio': round(sum(f.vueltas for f in filas) / len(filas), 2) if filas else 0,
+        'tokens_prompt': sum(f.tokens_prompt for f in filas),
+        'tokens_completion': sum(f.tokens_completion for f in filas),
+        'duracion_ms': percentiles(duraciones)
+    }
+
+
+def metricas_por_dia(desde, hasta, usuario=None):
+    por_dia = {}
+    for fila in _filas(desde, hasta, usuario):
+        por_dia.setdefault(fila.fecha.strftime('%Y-%m-%d'), []).append(fila)
+    return [{'fecha': dia, **_resumir(filas)} for dia, filas in sorted(por_dia.items())]
+
+
+def metricas_por_usuario(desde, hasta, limite=50):
+    """Usuarios ordenados por tokens consumidos"""
+    por_usuario = {}
+    for fila in _filas(desde, hasta):
+        por_usuario.setdefault(fila.usuario, []).append(fila)
+    usuarios = [{'usuario': usuario, **_resumir(filas)} for usuario, filas in por_usuario.items()]
+    usuarios.sort(key=lambda u: u['tokens_prompt'] + u['tokens_completion'], reverse=True)
+    return usuarios[:limite]
+
+
+def metricas_por_herramienta(desde, hasta):
+    duraciones = {}
+    for fila in _filas(desde, hasta):
+        for nombre, ms in json.loads(fila.herramientas or '[]'):
+            duraciones.setdefault(nombre, []).append(ms)
+    return [
+        {'herramienta': nombre, 'llamadas': len(valores), 'duracion_ms': percentiles(valores)}
+        for nombre, valores in sorted(duraciones.items(), key=lambda h: -len(h[1]))
+    ]
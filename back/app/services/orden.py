@@ -0,0 +1,158 @@
+"""
+Orden de procesamiento por usuario.
+
+Dos mensajes seguidos del mismo usuario ("18hs" y enseguida "no, 19hs") no
+pueden procesarse a la vez: los dos leerían el mismo historial y las
+respuestas (y reservas) se pisarían. bloqueo_usuario serializa los turnos
+de un mismo usuario entre el chat web y el worker de WhatsApp; usuarios
+distintos siguen en paralelo.
+
+El bloqueo tiene dos niveles: un lock por usuario dentro del proceso y, en
+MySQL, GET_LOCK sobre una conexión propia para cubrir varios procesos (los
+workers de la cola y los de la app web). Mientras dura el turno esa conexión
+queda tomada: sale de un pool aparte de BLOQUEO_CONEXIONES por proceso, así los
+turnos largos no agotan el pool de la app (sesión del pedido y herramientas).
+Si se acaban, el turno espera una conexión como si esperara el bloqueo.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.models import db
+
+
+# Espera máxima por el turno anterior del mismo usuario
+BLOQUEO_USUARIO_SEGUNDOS = int(os.getenv('BLOQUEO_USUARIO_SEGUNDOS', 90))
+
+# Conexiones para GET_LOCK por proceso: turnos con el bloqueo tomado a la vez
+BLOQUEO_CONEXIONES = int(os.getenv('BLOQUEO_CONEXIONES', 20))
+
+
+class BloqueoOcupadoError(RuntimeError):
+    """El usuario tiene otro turno en curso que no terminó dentro del timeout"""
+
+
+# usuario -> [lock, referencias]; se borra cuando nadie lo usa
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+# URL de la base -> engine de los bloqueos
+_motores = {}
+_motores_lock = threading.Lock()
+
+
+def _motor_bloqueos():
+    """Engine con su propio pool para las conexiones que sostienen GET_LOCK"""
+    url = db.engine.url
+    clave = url.render_as_string(hide_password=False)
+    with _motores_lock:
+        motor = _motores.get(clave)
+        if motor is None:
+            motor = create_engine(
+                url,
+                pool_size=BLOQUEO_CONEXIONES,
+                max_overflow=0,
+                pool_timeout=BLOQUEO_USUARIO_SEGUNDOS,
+                pool_recycle=3600,
+                pool_pre_ping=True
+            )
+            _motores[clave] = motor
+        return motor
+
+
+def _nombre_bloqueo(usuario: str) -> str:
+    # GET_LOCK admite nombres de hasta 64 caracteres
+    return f'padelpro:u:{usuario}'[:64]
+
+
+class BloqueoUsuario:
+    """Bloqueo de los turnos de un usuario; usar con `with` o adquirir()/liberar()"""
+
+    def __init__(self, usuario: str, timeout: float = BLOQUEO_USUARIO_SEGUNDOS):
+        self.usuario = str(usuario)
+        self.timeout = timeout
+        self._entrada = None
+        self._conexion = None
+
+    def adquirir(self):
+        limite = time.monotonic() + self.timeout
+        with _locks_lock:
+            self._entrada = _locks.setdefault(self.usuario, [threading.Lock(), 0])
+            self._entrada[1] += 1
+        if not self._entrada[0].acquire(timeout=self.timeout):
+            self._soltar_referencia()
+            raise BloqueoOcupadoError(f'El usuario {self.usuario} tiene otro mensaje en proceso')
+        try:
+            self._adquirir_bd(max(0, limite - time.monotonic()))
+        except Exception:
+            self._entrada[0].release()
+            self._soltar_referencia()
+            raise
+        return self
+
+    def _adquirir_bd(self, timeout):
+        if db.engine.dialect.name != 'mysql':
+            return
+        try:
+            conexion = _motor_bloqueos().connect()
+        except PoolTimeoutError:
+            raise BloqueoOcupadoError(f'No hay conexiones libres para bloquear al usuario {self.usuario}')
+        try:
+            obtenido = conexion.execute(
+                text('SELECT GET_LOCK(:nombre, :timeout)'),
+                {'nombre': _nombre_bloqueo(self.usuario), 'timeout': math.ceil(timeout)}
+            ).scalar()
+        except Exception:
+            # No se sabe si el lock quedó tomado: se descarta la conexión en lugar de devolverla al pool
+            conexion.invalidate()
+            conexion.close()
+            raise
+        if obtenido != 1:
+            conexion.close()
+            raise BloqueoOcupadoError(f'El usuario {self.usuario} tiene otro mensaje en proceso')
+        self._conexion = conexion
+
+    def liberar(self):
+        if self._entrada is None:
+            return
+        try:
+            if self._conexion is not None:
+                try:
+                    self._conexion.execute(text('SELECT RELEASE_LOCK(:nombre)'), {'nombre': _nombre_bloqueo(self.usuario)})
+                except Exception:
+                    # El lock es de la sesión de MySQL y close() solo devuelve la conexión
+                    # al pool: hay que descartarla para que el servidor lo libere
+                    self._conexion.invalidate()
+                    raise
+                finally:
+                    self._conexion.close()
+                    self._conexion = None
+        finally:
+            self._entrada[0].release()
+            self._soltar_referencia()
+
+    def _soltar_referencia(self):
+        with _locks_lock:
+            self._entrada[1] -= 1
+            if self._entrada[1] == 0:
+                _locks.pop(self.usuario, None)
+            self._entrada = None
+
+    def __enter__(self):
+        return self.adquirir()
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+@contextmanager
+def bloqueo_usuario(usuario: str, timeout: float = BLOQUEO_USUARIO_SEGUNDOS):
+    """Serializa los turnos de `usuario` (en este proceso y, con MySQL, entre procesos)"""
+    with BloqueoUsuario(usuario, timeout) as bloqueo:
+        yield bloqueo
@@ -0,0 +1,205 @@
+"""
+Reintentos con backoff y circuit breaker para las llamadas al LLM.
+
+Cada intento tiene su propio timeout, acotado por el plazo total del pedido
+(LLM_PLAZO_SEGUNDOS), y solo se reintentan los errores transitorios
+(timeout, conexión, 429 y 5xx) con espera exponencial con jitter. Si en la
+ventana reciente la tasa de errores transitorios supera el umbral, el
+circuito se abre: durante CIRCUITO_ABIERTO_SEGUNDOS las llamadas fallan al
+instante con CircuitoAbiertoError (el asistente contesta un mensaje fijo) en
+lugar de ocupar un worker esperando. Después deja pasar una llamada de prueba
+y se cierra si responde.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+
+LLM_REINTENTOS = int(os.getenv('LLM_REINTENTOS', 2))
+LLM_BACKOFF_BASE_SEGUNDOS = float(os.getenv('LLM_BACKOFF_BASE_SEGUNDOS', 0.5))
+LLM_BACKOFF_MAX_SEGUNDOS = 8.0
+
+# Plazo total de una llamada al LLM, reintentos incluidos
+LLM_PLAZO_SEGUNDOS = float(os.getenv('LLM_PLAZO_SEGUNDOS', 45))
+
+# Llamadas al LLM por mensaje como máximo (ej: verificar -> reservar -> responder)
+LLM_MAX_VUELTAS = 5
+
+CIRCUITO_VENTANA_SEGUNDOS = int(os.getenv('CIRCUITO_VENTANA_SEGUNDOS', 60))
+CIRCUITO_MIN_LLAMADAS = int(os.getenv('CIRCUITO_MIN_LLAMADAS', 10))
+CIRCUITO_UMBRAL_ERRORES = float(os.getenv('CIRCUITO_UMBRAL_ERRORES', 0.5))
+CIRCUITO_ABIERTO_SEGUNDOS = int(os.getenv('CIRCUITO_ABIERTO_SEGUNDOS', 30))
+
+ERRORES_TRANSITORIOS = (
+    openai.APIConnectionError,   # incluye APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+    TimeoutError,
+)
+
+
+class CircuitoAbiertoError(RuntimeError):
+    """El circuito está abierto: la llamada no se intenta"""
+
+
+class CircuitBreaker:
+    """Circuit breaker por tasa de errores en una ventana de tiempo"""
+
+    CERRADO = 'cerrado'
+    ABIERTO = 'abierto'
+    SEMIABIERTO = 'semiabierto'
+
+    def __init__(self, nombre, ventana=CIRCUITO_VENTANA_SEGUNDOS, min_llamadas=CIRCUITO_MIN_LLAMADAS,
+                 umbral=CIRCUITO_UMBRAL_ERRORES, abierto_segundos=CIRCUITO_ABIERTO_SEGUNDOS):
+        self.nombre = nombre
+        self.ventana = ventana
+        self.min_llamadas = min_llamadas
+        self.umbral = umbral
+        self.abierto_segundos = abierto_segundos
+        self._lock = threading.Lock()
+        self._resultados = deque()   # (instante, exito)
+        self._estado = self.CERRADO
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self._aperturas = 0
+        self._ultimo_error = None
+
+    def _purgar(self, ahora):
+        while self._resultados and ahora - self._resultados[0][0] > self.ventana:
+            self._resultados.popleft()
+
+    def _abrir(self, ahora):
+        self._estado = self.ABIERTO
+        self._abierto_desde = ahora
+        self._prueba_en_curso = False
+        self._aperturas += 1
+
+    def permitir(self) -> bool:
+        """Indica si se puede intentar una llamada (en semiabierto, solo una de prueba a la vez)"""
+        with self._lock:
+            ahora = time.monotonic()
+            if self._estado == self.ABIERTO:
+                if ahora - self._abierto_desde < self.abierto_segundos:
+                    return False
+                self._estado = self.SEMIABIERTO
+            if self._estado == self.SEMIABIERTO:
+                if self._prueba_en_curso:
+                    return False
+                self._prueba_en_curso = True
+            return True
+
+    def registrar_exito(self):
+        with self._lock:
+            ahora = time.monotonic()
+            if self._estado == self.SEMIABIERTO:
+                self._estado = self.CERRADO
+                self._prueba_en_curso = False
+                self._resultados.clear()
+            self._resultados.append((ahora, True))
+            self._purgar(ahora)
+
+    def registrar_fallo(self, error):
+        with self._lock:
+            ahora = time.monotonic()
+            self._ultimo_error = f'{type(error).__name__}: {error}'[:200]
+            if self._estado == self.SEMIABIERTO:
+                self._abrir(ahora)
+                return
+            self._resultados.append((ahora, False))
+            self._purgar(ahora)
+            fallos = sum(1 for _, exito in self._resultados if not exito)
+            if (
+                self._estado == self.CERRADO
+                and len(self._resultados) >= self.min_llamadas
+                and fallos / len(self._resultados) >= self.umbral
+            ):
+                self._abrir(ahora)
+
+    def estado(self) -> dict:
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            fallos = sum(1 for _, exito in self._resultados if not exito)
+            abierto = self._estado == self.ABIERTO
+            return {
+                'nombre': self.nombre,
+                'estado': self._estado,
+                'llamadas_ventana': len(self._resultados),
+                'errores_ventana': fallos,
+                'tasa_errores': round(fallos / len(self._resultados), 3) if self._resultados else 0.0,
+                'reintento_en_segundos': round(max(0, self.abierto_segundos - (ahora - self._abierto_desde)), 1) if abierto else None,
+                'aperturas': self._aperturas,
+                'ultimo_error': self._ultimo_error
+            }
+
+
+CIRCUITO_LLM = CircuitBreaker('llm')
+
+
+def _espera(intento: int) -> float:
+    """Backoff exponencial con jitter completo"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SEGUNDOS, LLM_BACKOFF_BASE_SEGUNDOS * 2 ** intento))
+
+
+def llamar_con_reintentos(funcion, timeout, circuito=CIRCUITO_LLM, reintentos=LLM_REINTENTOS, plazo=LLM_PLAZO_SEGUNDOS):
+    """
+    Llama a funcion(timeout_del_intento) con reintentos y circuit breaker
+
+    Raises:
+        CircuitoAbiertoError: si el circuito está abierto
+        El último error si se agotan los reintentos o el plazo
+    """
+    limite = time.monotonic() + plazo
+    intento = 0
+    while True:
+        if not circuito.permitir():
+            raise CircuitoAbiertoError(f'Circuito {circuito.nombre} abierto')
+        try:
+            resultado = funcion(max(0.1, min(timeout, limite - time.monotonic())))
+        except ERRORES_TRANSITORIOS as e:
+            circuito.registrar_fallo(e)
+            espera = _espera(intento)
+            if intento >= reintentos or time.monotonic() + espera >= limite:
+                raise
+            print(f"Reintentando llamada al LLM en {espera:.2f}s ({type(e).__name__})")
+            intento += 1
+            time.sleep(espera)
+            continue
+        except Exception:
+            # El servicio respondió (ej: 400): no es un problema de disponibilidad
+            circuito.registrar_exito()
+            raise
+        circuito.registrar_exito()
+        return resultado
+
+
+async def llamar_con_reintentos_async(funcion, timeout, circuito=CIRCUITO_LLM, reintentos=LLM_REINTENTOS, plazo=LLM_PLAZO_SEGUNDOS):
+    """Igual que llamar_con_reintentos para una corrutina: await funcion(timeout_del_intento)"""
+    limite = time.monotonic() + plazo
+    intento = 0
+    while True:
+        if not circuito.permitir():
+            raise CircuitoAbiertoError(f'Circuito {circuito.nombre} abierto')
+        timeout_intento = max(0.1, min(timeout, limite - time.monotonic()))
+        try:
+            resultado = await asyncio.wait_for(funcion(timeout_intento), timeout_intento)
+        except ERRORES_TRANSITORIOS as e:
+            circuito.registrar_fallo(e)
+            espera = _espera(intento)
+            if intento >= reintentos or time.monotonic() + espera >= limite:
+                raise
+            print(f"Reintentando llamada al LLM en {espera:.2f}s ({type(e).__name__})")
+            intento += 1
+            await asyncio.sleep(espera)
+            continue
+        except Exception:
+            circuito.registrar_exito()
+            raise
+        circuito.registrar_exito()
+        return resultado
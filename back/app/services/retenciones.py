@@ -0,0 +1,172 @@
+"""
+Retenciones temporales de turnos.
+
+Cuando el asistente verifica un turno libre para un cliente, el turno queda
+retenido (estado 'retenida') durante unos minutos. La confirmación posterior
+promueve esa misma fila a 'iniciada' con un único UPDATE, sin volver a pasar
+por todo el circuito de disponibilidad. Las retenciones vencidas se borran
+con un barrido periódico y, puntualmente, antes de insertar sobre un turno.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Reserva, Estado
+
+
+# Duración de una retención en minutos
+RETENCION_MINUTOS = int(os.getenv('RETENCION_MINUTOS', 10))
+
+# Retenciones simultáneas por cliente: al superar el límite se libera la más antigua
+MAX_RETENCIONES_POR_CLIENTE = int(os.getenv('MAX_RETENCIONES_POR_CLIENTE', 3))
+
+# Intervalo mínimo entre barridos globales dentro de un mismo proceso
+BARRIDO_SEGUNDOS = 30
+
+ESTADO_RETENIDA = 'retenida'
+
+_estado_ids = {}
+_ultimo_barrido = 0.0
+_barrido_lock = threading.Lock()
+
+
+def id_estado(nombre: str):
+    """Id de un estado por nombre. Los estados son fijos, se cachean por proceso"""
+    estado_id = _estado_ids.get(nombre)
+    if estado_id is None:
+        estado = Estado.query.filter_by(nombre=nombre).first()
+        if not estado:
+            return None
+        estado_id = _estado_ids[nombre] = estado.id
+    return estado_id
+
+
+def liberar_retenciones_vencidas(cancha_id=None, fecha=None, hora=None):
+    """
+    Borra las retenciones vencidas, opcionalmente solo las de un turno puntual.
+    Una retención no confirmada nunca fue una reserva: no queda como 'cancelada'
+    en los listados ni en los reportes. No hace commit: queda a cargo de quien llama.
+
+    Returns:
+        Cantidad de retenciones liberadas
+    """
+    retenida_id = id_estado(ESTADO_RETENIDA)
+    if not retenida_id:
+        return 0
+
+    query = Reserva.query.filter(Reserva.estado_id == retenida_id, Reserva.expira < datetime.now())
+    if cancha_id is not None:
+        query = query.filter(Reserva.cancha_id == cancha_id, Reserva.fecha == fecha, Reserva.hora == hora)
+    return query.delete(synchronize_session=False)
+
+
+def barrer_retenciones(forzar: bool = False):
+    """Barrido global de retenciones vencidas, como máximo una vez cada BARRIDO_SEGUNDOS"""
+    global _ultimo_barrido
+    ahora = time.monotonic()
+    if not forzar and ahora - _ultimo_barrido < BARRIDO_SEGUNDOS:
+        return 0
+    with _barrido_lock:
+        if not forzar and ahora - _ultimo_barrido < BARRIDO_SEGUNDOS:
+            return 0
+        _ultimo_barrido = ahora
+    try:
+        liberadas = liberar_retenciones_vencidas()
+        db.session.commit()
+        return liberadas
+    except Exception as e:
+        print(f"Error liberando retenciones vencidas: {e}")
+        db.session.rollback()
+        return 0
+
+
+def buscar_retencion(cancha_id, fecha, hora, cliente_id):
+    """Retención vigente de un cliente sobre un turno, o None"""
+    retenida_id = id_estado(ESTADO_RETENIDA)
+    if not retenida_id:
+        return None
+    return Reserva.query.filter(
+        Reserva.cancha_id == cancha_id,
+        Reserva.fecha == fecha,
+        Reserva.hora == hora,
+        Reserva.cliente_id == cliente_id,
+        Reserva.estado_id == retenida_id,
+        Reserva.expira >= datetime.now()
+    ).first()
+
+
+def retener_turno(cancha_id, fecha, hora, cliente, monto):
+    """
+    Retiene un turno libre a nombre de un cliente (o renueva su retención vigente).
+
+    Returns:
+        datetime de vencimiento, o None si otro cliente tomó el turno
+    """
+    retenida_id = id_estado(ESTADO_RETENIDA)
+    if not retenida_id:
+        return None
+    expira = datetime.now() + timedelta(minutes=RETENCION_MINUTOS)
+
+    existente = buscar_retencion(cancha_id, fecha, hora, cliente.id)
+    if existente:
+        existente.expira = expira
+        db.session.commit()
+        return expira
+
+    # Respetar el máximo de retenciones por cliente borrando las más antiguas
+    vigentes = (
+        Reserva.query
+        .filter(Reserva.cliente_id == cliente.id, Reserva.estado_id == retenida_id, Reserva.expira >= datetime.now())
+        .order_by(Reserva.expira)
+        .all()
+    )
+    for vieja in vigentes[:max(0, len(vigentes) - MAX_RETENCIONES_POR_CLIENTE + 1)]:
+        db.session.delete(vieja)
+
+    liberar_retenciones_vencidas(cancha_id, fecha, hora)
+    db.session.add(Reserva(
+        fecha=fecha,
+        hora=hora,
+        cancha_id=cancha_id,
+        cliente_id=cliente.id,
+        estado_id=retenida_id,
+        monto=monto,
+        expira=expira
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return expira
+
+
+def confirmar_retencion(cancha_id, fecha, hora, cliente_id):
+    """
+    Promueve la retención vigente del cliente a reserva 'iniciada'.
+
+    Returns:
+        La Reserva confirmada, o None si no había retención vigente
+    """
+    iniciada_id = id_estado('iniciada')
+    retenida_id = id_estado(ESTADO_RETENIDA)
+    if not iniciada_id or not retenida_id:
+        return None
+
+    actualizadas = Reserva.query.filter(
+        Reserva.cancha_id == cancha_id,
+        Reserva.fecha == fecha,
+        Reserva.hora == hora,
+        Reserva.cliente_id == cliente_id,
+        Reserva.estado_id == retenida_id,
+        Reserva.expira >= datetime.now()
+    ).update({Reserva.estado_id: iniciada_id, Reserva.expira: None}, synchronize_session=False)
+    if not actualizadas:
+        return None
+    db.session.commit()
+    return Reserva.query.filter_by(
+        cancha_id=cancha_id, fecha=fecha, hora=hora, cliente_id=cliente_id, estado_id=iniciada_id
+    ).order_by(Reserva.id.desc()).first()
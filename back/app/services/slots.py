@@ -0,0 +1,105 @@
+"""
+Modelo interno de turnos.
+
+Cada rango diario "HH:MM-HH:MM" se mapea a un índice entero chico y la ocupación
+de una cancha en un día se representa como una máscara de bits (bit i = turno i).
+El string sigue siendo el formato de borde (BD, API y prompts); internamente
+"turnos libres" es aritmética de bits en lugar de comparar strings.
+"""
+import threading
+
+
+# Horarios válidos del sistema (rangos)
+HORARIOS_VALIDOS = ['08:00-09:00', '10:00-11:00', '12:00-13:00', '14:00-15:00',
+                    '16:00-17:00', '18:00-19:00', '20:00-21:00', '22:00-23:00']
+
+
+class IndiceSlots:
+    """
+    Registro de rangos horarios a índices de bit.
+
+    Los índices son estables durante la vida del proceso: un rango nuevo
+    (por ejemplo uno cargado desde la tabla Horario) se agrega al final.
+    """
+
+    def __init__(self, rangos=()):
+        self._lock = threading.Lock()
+        self._rangos = []      # índice -> rango
+        self._inicios = []     # índice -> minuto del día en que empieza el turno
+        self._indices = {}     # rango -> índice
+        self._orden = []       # índices ordenados cronológicamente
+        for rango in rangos:
+            self.registrar(rango)
+
+    def registrar(self, rango: str) -> int:
+        """Devuelve el índice del rango, registrándolo si es nuevo"""
+        indice = self._indices.get(rango)
+        if indice is not None:
+            return indice
+        with self._lock:
+            indice = self._indices.get(rango)
+            if indice is None:
+                indice = len(self._rangos)
+                self._rangos.append(rango)
+                self._inicios.append(_minutos(rango.split('-')[0]))
+                # "HH:MM" con ceros a la izquierda ordena bien como string
+                self._orden = sorted(range(len(self._rangos)), key=self._rangos.__getitem__)
+                self._indices[rango] = indice
+            return indice
+
+    def indice(self, rango: str):
+        """Índice de un rango ya registrado, o None"""
+        return self._indices.get(rango)
+
+    def rango(self, indice: int) -> str:
+        return self._rangos[indice]
+
+    def inicio_minutos(self, indice: int) -> int:
+        return self._inicios[indice]
+
+    def mascara(self, rangos) -> int:
+        """Máscara con los bits de los rangos indicados (los registra si hace falta)"""
+        mascara = 0
+        for rango in rangos:
+            mascara |= 1 << self.registrar(rango)
+        return mascara
+
+    def indices(self, mascara: int):
+        """Índices presentes en la máscara, en orden cronológico"""
+        return [i for i in self._orden if mascara >> i & 1]
+
+    def rangos(self, mascara: int):
+        """Rangos presentes en la máscara, en orden cronológico"""
+        return [self._rangos[i] for i in self._orden if mascara >> i & 1]
+
+
+def _minutos(hora: str) -> int:
+    """Minutos desde la medianoche de un "HH:MM" (0 si el formato no es válido)"""
+    try:
+        horas, minutos = hora.strip().split(':')
+        return int(horas) * 60 + int(minutos)
+    except ValueError:
+        return 0
+
+
+# Mapeo de date.weekday() (0=Lunes) al nombre usado en Horario.dia
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+_DIA_A_WEEKDAY = {dia: i for i, dia in enumerate(DIAS_SEMANA)}
+
+SLOTS = IndiceSlots(HORARIOS_VALIDOS)
+MASCARA_VALIDOS = SLOTS.mascara(HORARIOS_VALIDOS)
+
+_VALIDOS = frozenset(HORARIOS_VALIDOS)
+_RANGO_POR_INICIO = {rango.split('-')[0]: rango for rango in HORARIOS_VALIDOS}
+
+
+def _normalizar_hora(hora: str):
+    # Si es exactamente un rango válido o una hora de inicio "08:00", resolver por diccionario
+    if hora in _VALIDOS:
+        return hora
+    # Si no se encuentra, retornar tal cual para que falle la validación
+    return _RANGO_POR_INICIO.get(hora, hora)
+
+
+def es_horario_valido(hora: str) -> bool:
+    return hora in _VALIDOS
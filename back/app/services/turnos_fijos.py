@@ -0,0 +1,277 @@
+"""
+Turnos fijos: reservas semanales recurrentes.
+
+Un turno fijo es una regla (cancha, día de la semana, horario y vigencia) y no
+genera filas en reserva. La disponibilidad, la grilla de /cancelar y los
+listados expanden las ocurrencias solo para la ventana consultada. Una fecha
+se materializa como Reserva recién cuando se cobra o se modifica; a partir de
+ahí queda registrada como excepción de la regla, igual que una semana omitida.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Reserva, Estado, TurnoFijo, TurnoFijoExcepcion
+from app.services.slots import SLOTS, HORARIOS_VALIDOS, DIAS_SEMANA, _DIA_A_WEEKDAY, _normalizar_hora, es_horario_valido
+
+
+ESTADO_TURNO_FIJO = 'turno_fijo'
+
+MOTIVO_OMITIDA = 'omitida'
+MOTIVO_MATERIALIZADA = 'materializada'
+
+# Semanas hacia adelante que se muestran en los listados del cliente
+SEMANAS_LISTADO = 4
+
+
+def _primera_ocurrencia(turno, desde):
+    """Primera fecha >= desde que cae en el día del turno"""
+    inicio = max(desde, turno.fecha_desde)
+    return inicio + timedelta(days=(_DIA_A_WEEKDAY[turno.dia] - inicio.weekday()) % 7)
+
+
+def es_ocurrencia(turno, fecha):
+    """True si la regla (sin contar excepciones) cae en esa fecha"""
+    return (
+        turno.activo
+        and fecha.weekday() == _DIA_A_WEEKDAY.get(turno.dia)
+        and turno.fecha_desde <= fecha
+        and (turno.fecha_hasta is None or fecha <= turno.fecha_hasta)
+    )
+
+
+def expandir_turnos_fijos(desde, hasta, cancha_ids=None, cliente_id=None, mascara_horas=None):
+    """
+    Ocurrencias de los turnos fijos vigentes en [desde, hasta], sin las excepciones.
+    Usa dos consultas (reglas y excepciones) sin importar el largo de la ventana.
+
+    Returns:
+        Lista de (turno, fecha) ordenada por fecha y hora
+    """
+    query = TurnoFijo.query.filter(
+        TurnoFijo.activo.is_(True),
+        TurnoFijo.fecha_desde <= hasta,
+        or_(TurnoFijo.fecha_hasta.is_(None), TurnoFijo.fecha_hasta >= desde)
+    )
+    if cancha_ids is not None:
+        query = query.filter(TurnoFijo.cancha_id.in_(cancha_ids))
+    if cliente_id is not None:
+        query = query.filter(TurnoFijo.cliente_id == cliente_id)
+    if mascara_horas is not None:
+        query = query.filter(TurnoFijo.hora.in_(SLOTS.rangos(mascara_horas)))
+    turnos = query.all()
+    if not turnos:
+        return []
+
+    excepciones = set(
+        db.session.query(TurnoFijoExcepcion.turno_fijo_id, TurnoFijoExcepcion.fecha)
+        .filter(
+            TurnoFijoExcepcion.turno_fijo_id.in_([t.id for t in turnos]),
+            TurnoFijoExcepcion.fecha >= desde,
+            TurnoFijoExcepcion.fecha <= hasta
+        )
+        .all()
+    )
+
+    ocurrencias = []
+    for turno in turnos:
+        if turno.dia not in _DIA_A_WEEKDAY:
+            continue
+        ultima = min(hasta, turno.fecha_hasta) if turno.fecha_hasta else hasta
+        fecha = _primera_ocurrencia(turno, desde)
+        while fecha <= ultima:
+            if (turno.id, fecha) not in excepciones:
+                ocurrencias.append((turno, fecha))
+            fecha += timedelta(days=7)
+    ocurrencias.sort(key=lambda o: (o[1], o[0].hora))
+    return ocurrencias
+
+
+def buscar_ocurrencia(cancha_id, fecha, hora):
+    """Turno fijo que ocupa un turno puntual (sin excepción para esa fecha), o None"""
+    ocurrencias = expandir_turnos_fijos(fecha, fecha, cancha_ids=[cancha_id])
+    return next((turno for turno, _ in ocurrencias if turno.hora == hora), None)
+
+
+def serializar_turno_fijo(turno):
+    return {
+        'id': turno.id,
+        'cancha_id': turno.cancha_id,
+        'cancha': turno.cancha.nombre if turno.cancha else None,
+        'cliente_id': turno.cliente_id,
+        'cliente': f"{turno.cliente.nombre} {turno.cliente.apellido}".strip() if turno.cliente else None,
+        'telefono': turno.cliente.telefono if turno.cliente else None,
+        'dia': turno.dia,
+        'hora': turno.hora,
+        'fecha_desde': turno.fecha_desde.strftime('%Y-%m-%d'),
+        'fecha_hasta': turno.fecha_hasta.strftime('%Y-%m-%d') if turno.fecha_hasta else None,
+        'monto': turno.monto,
+        'activo': turno.activo
+    }
+
+
+def serializar_ocurrencia(turno, fecha, formato_fecha='%Y-%m-%d'):
+    return {
+        'turno_fijo_id': turno.id,
+        'fecha': fecha.strftime(formato_fecha),
+        'hora': turno.hora,
+        'cancha': turno.cancha.nombre if turno.cancha else None,
+        'cliente': f"{turno.cliente.nombre} {turno.cliente.apellido}".strip() if turno.cliente else None,
+        'estado': ESTADO_TURNO_FIJO,
+        'monto': turno.monto
+    }
+
+
+def _conflictos(cancha_id, dia, hora, desde, hasta):
+    """Reglas y reservas activas que chocan con un turno fijo nuevo"""
+    conflictos = []
+    reglas = TurnoFijo.query.filter(
+        TurnoFijo.cancha_id == cancha_id,
+        TurnoFijo.dia == dia,
+        TurnoFijo.hora == hora,
+        TurnoFijo.activo.is_(True),
+        or_(TurnoFijo.fecha_hasta.is_(None), TurnoFijo.fecha_hasta >= desde)
+    )
+    if hasta is not None:
+        reglas = reglas.filter(TurnoFijo.fecha_desde <= hasta)
+    for regla in reglas.all():
+        conflictos.append(f'Turno fijo #{regla.id} desde el {regla.fecha_desde.strftime("%Y-%m-%d")}')
+
+    reservas = (
+        db.session.query(Reserva.fecha)
+        .join(Estado, Reserva.estado_id == Estado.id)
+        .filter(
+            Reserva.cancha_id == cancha_id,
+            Reserva.hora == hora,
+            Reserva.fecha >= desde,
+            Estado.nombre != 'cancelada',
+            or_(Reserva.expira.is_(None), Reserva.expira >= datetime.now())
+        )
+    )
+    if hasta is not None:
+        reservas = reservas.filter(Reserva.fecha <= hasta)
+    weekday = _DIA_A_WEEKDAY[dia]
+    for (fecha,) in reservas.order_by(Reserva.fecha).all():
+        if fecha.weekday() == weekday:
+            conflictos.append(f'Reserva del {fecha.strftime("%Y-%m-%d")}')
+    return conflictos
+
+
+def crear_turno_fijo(cancha_id, cliente_id, dia, hora, fecha_desde, fecha_hasta=None, monto=0.0):
+    """
+    Crea un turno fijo si no choca con otra regla ni con reservas ya tomadas
+
+    Returns:
+        Dict con 'exito' y 'turno_fijo', o 'error' y 'conflictos'
+    """
+    dia = (dia or '').strip().capitalize()
+    if dia not in _DIA_A_WEEKDAY:
+        return {'exito': False, 'error': f'Día "{dia}" no válido. Días permitidos: {", ".join(DIAS_SEMANA)}'}
+    hora_norm = _normalizar_hora(hora)
+    if not es_horario_valido(hora_norm):
+        return {'exito': False, 'error': f'Horario "{hora}" no válido. Horarios permitidos: {", ".join(HORARIOS_VALIDOS)}'}
+    if fecha_hasta is not None and fecha_hasta < fecha_desde:
+        return {'exito': False, 'error': 'fecha_hasta no puede ser anterior a fecha_desde'}
+
+    conflictos = _conflictos(cancha_id, dia, hora_norm, fecha_desde, fecha_hasta)
+    if conflictos:
+        return {'exito': False, 'error': 'El turno fijo choca con turnos ya tomados', 'conflictos': conflictos}
+
+    turno = TurnoFijo(
+        cancha_id=cancha_id,
+        cliente_id=cliente_id,
+        dia=dia,
+        hora=hora_norm,
+        fecha_desde=fecha_desde,
+        fecha_hasta=fecha_hasta,
+        monto=monto or 0.0,
+        activo=True
+    )
+    db.session.add(turno)
+    db.session.commit()
+    return {'exito': True, 'turno_fijo': serializar_turno_fijo(turno)}
+
+
+def finalizar_turno_fijo(turno, fecha_hasta=None):
+    """Corta la regla en fecha_hasta (por defecto ayer): las ocurrencias posteriores quedan libres"""
+    fecha_hasta = fecha_hasta or date.today() - timedelta(days=1)
+    if fecha_hasta < turno.fecha_desde:
+        turno.activo = False
+    else:
+        turno.fecha_hasta = min(fecha_hasta, turno.fecha_hasta) if turno.fecha_hasta else fecha_hasta
+    db.session.commit()
+    return {'exito': True, 'turno_fijo': serializar_turno_fijo(turno)}
+
+
+def omitir_ocurrencia(turno, fecha):
+    """Saltea una semana: la ocurrencia deja de ocupar el turno"""
+    if not es_ocurrencia(turno, fecha):
+        return {'exito': False, 'error': f'El turno fijo no tiene ocurrencia el {fecha.strftime("%Y-%m-%d")}'}
+    db.session.add(TurnoFijoExcepcion(turno_fijo_id=turno.id, fecha=fecha, motivo=MOTIVO_OMITIDA))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return {'exito': False, 'error': 'Esa fecha ya fue omitida o materializada'}
+    return {
+        'exito': True,
+        'mensaje': f'Turno fijo de la cancha {turno.cancha.nombre} del {fecha.strftime("%d/%m/%Y")} a las {turno.hora} cancelado. El resto de las semanas sigue vigente'
+    }
+
+
+def restaurar_ocurrencia(turno, fecha):
+    """Deshace una semana omitida (no aplica a las materializadas)"""
+    excepcion = TurnoFijoExcepcion.query.filter_by(turno_fijo_id=turno.id, fecha=fecha).first()
+    if not excepcion:
+        return {'exito': False, 'error': 'Esa fecha no tiene excepción'}
+    if excepcion.motivo != MOTIVO_OMITIDA:
+        return {'exito': False, 'error': 'La ocurrencia ya es una reserva; modificala desde reservas'}
+    if buscar_ocupacion_reserva(turno.cancha_id, fecha, turno.hora):
+        return {'exito': False, 'error': 'El turno ya fue tomado por otra reserva'}
+    db.session.delete(excepcion)
+    db.session.commit()
+    return {'exito': True}
+
+
+def buscar_ocupacion_reserva(cancha_id, fecha, hora):
+    """True si hay una reserva no cancelada (y no vencida) en el turno"""
+    return db.session.query(Reserva.id).join(Estado, Reserva.estado_id == Estado.id).filter(
+        Reserva.cancha_id == cancha_id,
+        Reserva.fecha == fecha,
+        Reserva.hora == hora,
+        Estado.nombre != 'cancelada',
+        or_(Reserva.expira.is_(None), Reserva.expira >= datetime.now())
+    ).first() is not None
+
+
+def materializar_ocurrencia(turno, fecha, estado_nombre='iniciada', monto=None):
+    """
+    Convierte una ocurrencia en una Reserva real (al cobrarla o modificarla).
+    La reserva y la excepción se guardan en la misma transacción.
+    """
+    if not es_ocurrencia(turno, fecha):
+        return {'exito': False, 'error': f'El turno fijo no tiene ocurrencia el {fecha.strftime("%Y-%m-%d")}'}
+    estado = Estado.query.filter_by(nombre=estado_nombre).first()
+    if not estado or estado.nombre == 'cancelada':
+        return {'exito': False, 'error': f'Estado "{estado_nombre}" no válido'}
+
+    reserva = Reserva(
+        fecha=fecha,
+        hora=turno.hora,
+        cancha_id=turno.cancha_id,
+        cliente_id=turno.cliente_id,
+        monto=turno.monto if monto is None else monto
+    )
+    reserva.cambiar_estado(estado)
+    db.session.add(reserva)
+    try:
+        db.session.flush()
+        db.session.add(TurnoFijoExcepcion(
+            turno_fijo_id=turno.id, fecha=fecha, motivo=MOTIVO_MATERIALIZADA, reserva_id=reserva.id
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return {'exito': False, 'error': 'La ocurrencia ya fue omitida o materializada, o el turno está ocupado'}
+    return {'exito': True, 'reserva_id': reserva.id}
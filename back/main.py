@@ -12,6 +12,11 @@ from app.blueprints.cancelar.routes import cancelar_bp
 from app.blueprints.whatsapp.routes import wsp_bp
 from app.blueprints.admin.routes import admin_bp
 from app.blueprints.historial.routes import historial_bp
+from app.blueprints.turnos_fijos.routes import turnos_fijos_bp
+from app.blueprints.cierres.routes import cierres_bp
+from app.blueprints.metricas.routes import metricas_bp
+from app.blueprints.salud.routes import salud_bp
+from app.blueprints.cola.routes import cola_bp
 
 app = Flask(__name__)
 
@@ -29,6 +34,11 @@ app.register_blueprint(cancelar_bp)
 app.register_blueprint(wsp_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(historial_bp)
+app.register_blueprint(turnos_fijos_bp)
+app.register_blueprint(cierres_bp)
+app.register_blueprint(metricas_bp)
+app.register_blueprint(salud_bp)
+app.register_blueprint(cola_bp)
 
 # Ruta a la carpeta front/pages
 FRONT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'front', 'pages')
@@ -0,0 +1,112 @@
+"""
+Benchmark de la cola con orden por usuario: encola mensajes de varios
+usuarios por el webhook, los procesa con varios workers en paralelo y mide
+el throughput. Verifica además que cada usuario reciba sus mensajes en orden
+y con la respuesta de cada uno antes del siguiente.
+
+Con un solo usuario los workers quedan esperando (todo es secuencial); con
+tantos usuarios como workers o más, el throughput debería escalar con los
+workers.
+
+Con MySQL cada turno en curso sostiene GET_LOCK en una conexión del pool de
+bloqueos (BLOQUEO_CONEXIONES por proceso, 20 por defecto), además de las que
+usa del pool de la app (5 + 10 de desborde por defecto) para el pedido y las
+herramientas. Con más workers por proceso que BLOQUEO_CONEXIONES, los que
+sobran esperan una conexión y el throughput deja de escalar. Con la base
+SQLite del benchmark el bloqueo es solo el del proceso.
+
+Uso:
+    python scripts/bench_orden_usuarios.py --mensajes 120 --workers 8 --usuarios 1,4,16
+    LLM_FAKE_LATENCIA_MS=300 python scripts/bench_orden_usuarios.py
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault('LLM_FAKE_LATENCIA_MS', '100')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhook import crear_app, poblar, payload
+
+from app.models import Conversacion, TrabajoCola
+from app.services.cola import procesar_siguiente, PENDIENTE, EN_PROCESO
+from app.services.orden import BLOQUEO_CONEXIONES
+
+
+def trabajar(app, worker):
+    with app.app_context():
+        while True:
+            if procesar_siguiente(worker):
+                continue
+            # Puede haber trabajos esperando a que termine el anterior de su usuario
+            if not TrabajoCola.query.filter(TrabajoCola.estado.in_((PENDIENTE, EN_PROCESO))).count():
+                return
+            time.sleep(0.005)
+
+
+def verificar_orden(app, enviados):
+    """Usuarios cuyos mensajes no quedaron en orden o sin respuesta intercalada"""
+    errores = []
+    with app.app_context():
+        for telefono, textos in enviados.items():
+            filas = Conversacion.query.filter(
+                Conversacion.usuario == telefono, Conversacion.rol.in_(('user', 'assistant'))
+            ).order_by(Conversacion.id).all()
+            roles = [f.rol for f in filas]
+            recibidos = [f.mensaje for f in filas if f.rol == 'user']
+            # limpiar_historial_antiguo borra los más viejos: se comparan los que quedan
+            if not recibidos or recibidos != textos[-len(recibidos):] or roles != ['user', 'assistant'] * len(recibidos):
+                errores.append(telefono)
+    return errores
+
+
+def escenario(mensajes, usuarios, workers):
+    app = crear_app()
+    with app.app_context():
+        poblar(4)
+    cliente = app.test_client()
+
+    enviados = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for n in range(mensajes):
+            telefono = f'549221{n % usuarios:07d}'
+            texto = f'mensaje {n // usuarios + 1} de {telefono}'
+            enviados.setdefault(telefono, []).append(texto)
+            cliente.post('/api/whatsapp/webhook', json=payload(telefono, texto, f'{usuarios}.{n}'))
+
+        inicio = time.perf_counter()
+        hilos = [threading.Thread(target=trabajar, args=(app, f'bench-{i}')) for i in range(workers)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        total = time.perf_counter() - inicio
+
+    return total, verificar_orden(app, enviados)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mensajes', type=int, default=96)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--usuarios', default='1,4,16', help='Cantidades de usuarios a comparar, separadas por coma')
+    args = parser.parse_args()
+
+    print(f"\nLatencia del LLM simulada: {os.environ['LLM_FAKE_LATENCIA_MS']} ms, "
+          f"{args.mensajes} mensajes, {args.workers} workers\n")
+    if args.workers > BLOQUEO_CONEXIONES:
+        print(f"Aviso: con MySQL solo {BLOQUEO_CONEXIONES} turnos por proceso pueden tener el bloqueo "
+              f"a la vez (BLOQUEO_CONEXIONES); el resto espera una conexión\n")
+    print(f"{'usuarios':>9} {'segundos':>9} {'mensajes/s':>11} {'orden':>8}")
+    for usuarios in (int(u) for u in args.usuarios.split(',')):
+        total, errores = escenario(args.mensajes, usuarios, args.workers)
+        orden = 'ok' if not errores else f'{len(errores)} mal'
+        print(f"{usuarios:>9} {total:>9.2f} {args.mensajes / total:>11.1f} {orden:>8}")
+
+
+if __name__ == '__main__':
+    main()
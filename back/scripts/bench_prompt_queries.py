@@ -0,0 +1,123 @@
+"""
+Benchmark de consultas a la base por mensaje del asistente.
+
+Compara la preparación del prompt anterior (catálogo armado con N+1 sobre
+CanchaHorario/Horario, cinco consultas de Configuracion y un DISTINCT de Horario
+por mensaje) con el catálogo y prompt cacheados por versión. Cuenta las
+sentencias SQL ejecutadas por mensaje y el tiempo de armado.
+
+Uso:
+    python scripts/bench_prompt_queries.py --canchas 12 --mensajes 50
+    BENCH_DATABASE_URI=mysql+pymysql://... python scripts/bench_prompt_queries.py
+
+Por defecto usa una base SQLite en memoria con canchas de grilla semanal completa.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+
+from flask import Flask
+from sqlalchemy import event
+
+from app.models import db, crear_tablas, Cancha, CanchaHorario, Horario, Configuracion
+from app.services.ai import build_system_prompt
+from app.services.catalogo import obtener_catalogo, marcar_catalogo_modificado
+
+
+class ContadorConsultas:
+    def __init__(self, engine):
+        self.total = 0
+        event.listen(engine, 'before_cursor_execute', self._contar)
+
+    def _contar(self, *args, **kwargs):
+        self.total += 1
+
+
+def poblar(cantidad_canchas):
+    horarios = Horario.query.all()
+    while Cancha.query.count() < cantidad_canchas:
+        n = Cancha.query.count() + 1
+        cancha = Cancha(nombre=f'Cancha {n}', cantidad=4, precio=8000 + 500 * (n % 5), descripcion='Blindex')
+        db.session.add(cancha)
+        db.session.flush()
+        db.session.add_all([CanchaHorario(cancha_id=cancha.id, horario_id=h.id) for h in horarios])
+    marcar_catalogo_modificado()
+    db.session.commit()
+
+
+def mensaje_anterior():
+    """Preparación del prompt tal como se hacía antes del catálogo cacheado"""
+    canchas_info = []
+    for cancha in Cancha.query.all():
+        horarios_cancha = []
+        for ch in CanchaHorario.query.filter_by(cancha_id=cancha.id).all():
+            horario = Horario.query.get(ch.horario_id)
+            if horario:
+                horarios_cancha.append({'dia': horario.dia, 'hora': horario.hora})
+        canchas_info.append({
+            'nombre': cancha.nombre,
+            'descripcion': cancha.descripcion or '',
+            'cantidad': cancha.cantidad,
+            'precio': cancha.precio,
+            'horarios': horarios_cancha
+        })
+    Horario.query.with_entities(Horario.hora).distinct().all()
+    for clave in ('cbu', 'alias', 'business_name', 'business_kind', 'business_address'):
+        Configuracion.query.filter_by(clave=clave).first()
+    return canchas_info
+
+
+def mensaje_actual():
+    return build_system_prompt()
+
+
+def medir(nombre, funcion, mensajes, contador):
+    db.session.expunge_all()
+    inicio_consultas = contador.total
+    inicio = time.perf_counter()
+    for _ in range(mensajes):
+        funcion()
+        # Cada mensaje es un request nuevo: sin identity map compartido
+        db.session.expunge_all()
+    duracion = time.perf_counter() - inicio
+    consultas = (contador.total - inicio_consultas) / mensajes
+    print(f"{nombre:<32} {consultas:>10.1f} consultas/mensaje {duracion / mensajes * 1000:>10.2f} ms/mensaje")
+    return consultas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--canchas', type=int, default=12)
+    parser.add_argument('--mensajes', type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('BENCH_DATABASE_URI', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    crear_tablas(app)
+
+    with app.app_context():
+        poblar(args.canchas)
+        contador = ContadorConsultas(db.engine)
+        print(f"\n{args.canchas} canchas, {Horario.query.count()} horarios por cancha, {args.mensajes} mensajes\n")
+
+        antes = medir('Antes (N+1 + config)', mensaje_anterior, args.mensajes, contador)
+        obtener_catalogo()
+        build_system_prompt()
+        despues = medir('Después (cache versionado)', mensaje_actual, args.mensajes, contador)
+
+        # Un cambio en canchas invalida el cache: el mensaje siguiente recarga
+        marcar_catalogo_modificado()
+        db.session.commit()
+        recarga = medir('Después, tras cambiar canchas', mensaje_actual, 1, contador)
+
+        print(f"\nReducción: {antes:.0f} -> {despues:.0f} consultas por mensaje ({recarga:.0f} al recargar)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark del webhook de WhatsApp de punta a punta, sin red.
+
+Manda mensajes al endpoint POST /api/whatsapp/webhook con el test client de
+Flask y procesa la cola en el mismo proceso (como un worker de
+scripts/worker_cola.py): historial, camino rápido, loop del asistente,
+herramientas y base reales; el LLM sale del backend configurado con LLM_BACKEND (por defecto
+'fake', o 'replay' con un casete grabado con LLM_BACKEND=record). El envío a
+la API de Meta es simulado (WHATSAPP_SIMULADO=1).
+
+Uso:
+    python scripts/bench_webhook.py --mensajes 200 --usuarios 20
+    LLM_FAKE_LATENCIA_MS=800 python scripts/bench_webhook.py
+    LLM_BACKEND=replay LLM_CASETE=casete.jsonl python scripts/bench_webhook.py --guion conversaciones.txt
+
+Por defecto usa una base SQLite en un archivo temporal (BENCH_DATABASE_URI
+para otra): la de memoria es una sola conexión y la comparten los hilos de
+segundo plano (resúmenes), que chocan con el worker.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LLM_BACKEND', 'fake')
+os.environ['WHATSAPP_SIMULADO'] = '1'
+
+from flask import Flask
+
+from app.models import db, crear_tablas, Cancha, CanchaHorario, Horario
+from app.services.catalogo import marcar_catalogo_modificado
+from app.services.cola import procesar_pendientes
+from app.services.intenciones import ESTADISTICAS
+
+
+MENSAJES_PREDETERMINADOS = [
+    'Hola',
+    'mis reservas',
+    '¿Hay lugar mañana a las 18?',
+    '¿Cuánto sale la Cancha 1?',
+    'Quiero reservar un turno para mañana',
+    'quiero cancelar',
+    '¿Qué turnos libres hay esta semana?',
+]
+
+
+def crear_app():
+    from main import app as app_principal
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('BENCH_DATABASE_URI') or 'sqlite:///' + tempfile.mkstemp(suffix='.db')[1]
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    for blueprint in app_principal.blueprints.values():
+        app.register_blueprint(blueprint)
+    crear_tablas(app)
+    return app
+
+
+def poblar(cantidad_canchas):
+    horarios = Horario.query.all()
+    while Cancha.query.count() < cantidad_canchas:
+        n = Cancha.query.count() + 1
+        cancha = Cancha(nombre=f'Cancha {n}', cantidad=4, precio=8000 + 500 * (n % 5))
+        db.session.add(cancha)
+        db.session.flush()
+        db.session.add_all([CanchaHorario(cancha_id=cancha.id, horario_id=h.id) for h in horarios])
+    marcar_catalogo_modificado()
+    db.session.commit()
+
+
+def payload(telefono, texto, n):
+    return {'entry': [{'changes': [{'value': {'messages': [{
+        'from': telefono,
+        'id': f'wamid.bench.{n}',
+        'type': 'text',
+        'text': {'body': texto}
+    }]}}]}]}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mensajes', type=int, default=100)
+    parser.add_argument('--usuarios', type=int, default=10)
+    parser.add_argument('--canchas', type=int, default=4)
+    parser.add_argument('--guion', help='Archivo con un mensaje por línea (default: mensajes de ejemplo)')
+    args = parser.parse_args()
+
+    textos = MENSAJES_PREDETERMINADOS
+    if args.guion:
+        with open(args.guion, encoding='utf-8') as archivo:
+            textos = [linea.strip() for linea in archivo if linea.strip()]
+
+    app = crear_app()
+    with app.app_context():
+        poblar(args.canchas)
+    cliente = app.test_client()
+
+    acuses = []
+    duraciones = []
+    errores = 0
+    inicio = time.perf_counter()
+    for n in range(args.mensajes):
+        telefono = f'549221{n % args.usuarios:07d}'
+        t0 = time.perf_counter()
+        # Los prints de depuración del pipeline no cuentan para la medición
+        with contextlib.redirect_stdout(io.StringIO()):
+            respuesta = cliente.post('/api/whatsapp/webhook', json=payload(telefono, textos[n % len(textos)], n))
+            acuses.append(time.perf_counter() - t0)
+            with app.app_context():
+                procesar_pendientes()
+        duraciones.append(time.perf_counter() - t0)
+        errores += respuesta.status_code != 200
+    total = time.perf_counter() - inicio
+
+    print(f"\nBackend LLM: {os.environ['LLM_BACKEND']}, {args.mensajes} mensajes, {args.usuarios} usuarios\n")
+    print(f"Throughput:  {args.mensajes / total:.1f} mensajes/s")
+    print(f"Acuse (200): p50 {percentil(acuses, 50) * 1000:.1f} ms, "
+          f"p99 {percentil(acuses, 99) * 1000:.1f} ms")
+    print(f"Latencia:    p50 {percentil(duraciones, 50) * 1000:.1f} ms, "
+          f"p95 {percentil(duraciones, 95) * 1000:.1f} ms, "
+          f"p99 {percentil(duraciones, 99) * 1000:.1f} ms, "
+          f"media {statistics.mean(duraciones) * 1000:.1f} ms")
+    print(f"Errores:     {errores}")
+    print(f"Camino rápido: {ESTADISTICAS.resumen()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Control del tamaño del prompt de sistema del asistente.
+
+Arma un catálogo realista (4 canchas con grilla semanal completa de 15 turnos,
+una de ellas con horario reducido el fin de semana), renderiza el prompt en modo
+compacto y detallado y cuenta los tokens. Falla (exit 1) si el modo compacto
+supera el presupuesto, para detectar regresiones en el tamaño del prompt.
+
+Cuenta con tiktoken si está instalado; si no, estima 1 token cada 4 caracteres.
+
+Uso:
+    python scripts/check_prompt_budget.py --presupuesto 1400
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-budget')
+
+from flask import Flask
+
+from app.models import db, crear_tablas, Cancha, CanchaHorario, Horario
+from app.services import ai
+from app.services.catalogo import marcar_catalogo_modificado
+
+CANCHAS = [
+    ('Cancha 1', 'Blindex, techada', 12000),
+    ('Cancha 2', 'Blindex, techada', 12000),
+    ('Cancha 3', 'Cemento, descubierta', 9000),
+    ('Cancha 4', 'Césped sintético', 10000),
+]
+
+
+def contar_tokens(texto):
+    try:
+        import tiktoken
+        try:
+            codificador = tiktoken.encoding_for_model(ai.model)
+        except KeyError:
+            codificador = tiktoken.get_encoding('o200k_base')
+        return len(codificador.encode(texto)), 'tiktoken'
+    except ImportError:
+        return len(texto) // 4, 'estimado (caracteres / 4)'
+
+
+def poblar():
+    horarios = Horario.query.all()
+    for nombre, descripcion, precio in CANCHAS:
+        cancha = Cancha(nombre=nombre, descripcion=descripcion, cantidad=4, precio=precio)
+        db.session.add(cancha)
+        db.session.flush()
+        for h in horarios:
+            # La cancha descubierta cierra temprano el fin de semana
+            if nombre == 'Cancha 3' and h.dia in ('Sábado', 'Domingo') and h.hora >= '14:00':
+                continue
+            db.session.add(CanchaHorario(cancha_id=cancha.id, horario_id=h.id))
+    marcar_catalogo_modificado()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--presupuesto', type=int, default=int(os.getenv('PROMPT_TOKENS_MAX', 1400)),
+                        help='Máximo de tokens del prompt compacto')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    crear_tablas(app)
+
+    with app.app_context():
+        poblar()
+        tamanios = {}
+        for modo in ('detallado', 'compacto'):
+            ai.PROMPT_HORARIOS = modo
+            ai._prompt_cache['clave'] = None
+            prompt = ai.build_system_prompt()
+            tamanios[modo], metodo = contar_tokens(prompt)
+            print(f"{modo:<10} {tamanios[modo]:>6} tokens  {len(prompt):>6} caracteres")
+
+    print(f"\nConteo: {metodo}. Presupuesto del modo compacto: {args.presupuesto} tokens")
+    if tamanios['compacto'] > args.presupuesto:
+        print(f"FALLA: el prompt compacto usa {tamanios['compacto']} tokens")
+        sys.exit(1)
+    print(f"OK: {tamanios['detallado'] - tamanios['compacto']} tokens menos por llamada que el modo detallado")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+"""
+Barrido de retenciones vencidas: borra las reservas en estado
+'retenida' cuyo vencimiento ya pasó. Pensado para ejecutarse desde cron, ej:
+
+    * * * * * cd /root/padelpro/back && .venv/bin/python3 scripts/liberar_retenciones.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from app.services.retenciones import barrer_retenciones
+
+with app.app_context():
+    liberadas = barrer_retenciones(forzar=True)
+    print(f"Retenciones vencidas liberadas: {liberadas}")
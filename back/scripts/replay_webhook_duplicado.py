@@ -0,0 +1,92 @@
+"""
+Prueba de idempotencia del webhook de WhatsApp: manda el mismo payload
+(mismo message_id) varias veces en paralelo, como una reentrega de Meta,
+procesa la cola con varios workers a la vez y verifica que haya un solo
+trabajo, una sola respuesta del asistente y una sola reserva.
+
+El LLM es el backend 'fake' con un guion que reserva la Cancha 1 mañana a
+las 18:00 ante cualquier mensaje.
+
+Uso:
+    python scripts/replay_webhook_duplicado.py --reentregas 20 --workers 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+
+os.environ['LLM_BACKEND'] = 'fake'
+_guion = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8')
+json.dump([{
+    'patron': r'.',
+    'herramienta': 'crear_reserva',
+    'argumentos': {'cancha_nombre': 'Cancha 1', 'fecha': '{manana}', 'hora': '18:00', 'cliente_nombre': 'Prueba'}
+}], _guion)
+_guion.close()
+os.environ['LLM_FAKE_GUION'] = _guion.name
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhook import crear_app, poblar, payload
+
+from app.models import Conversacion, Reserva, TrabajoCola
+from app.services.cola import procesar_pendientes
+
+
+TELEFONO = '5492215550000'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reentregas', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    app = crear_app()
+    with app.app_context():
+        poblar(2)
+
+    cuerpo = payload(TELEFONO, 'Reservame la cancha 1 mañana a las 18', 'duplicado')
+    estados = []
+
+    def reentregar():
+        estados.append(app.test_client().post('/api/whatsapp/webhook', json=cuerpo).status_code)
+
+    def trabajar():
+        with app.app_context():
+            procesar_pendientes()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for objetivo, cantidad in ((reentregar, args.reentregas), (trabajar, args.workers)):
+            hilos = [threading.Thread(target=objetivo) for _ in range(cantidad)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        # Una reentrega tardía, con el mensaje ya respondido
+        reentregar()
+        trabajar()
+
+    with app.app_context():
+        resultados = {
+            'webhooks con 200': (sum(e == 200 for e in estados), args.reentregas + 1),
+            'trabajos encolados': (TrabajoCola.query.count(), 1),
+            'respuestas del asistente': (Conversacion.query.filter_by(usuario=TELEFONO, rol='assistant').count(), 1),
+            'reservas': (Reserva.query.count(), 1),
+        }
+
+    fallos = 0
+    for nombre, (obtenido, esperado) in resultados.items():
+        ok = obtenido == esperado
+        fallos += not ok
+        print(f"{'✅' if ok else '❌'} {nombre}: {obtenido} (esperado {esperado})")
+    os.unlink(_guion.name)
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Prueba de concurrencia: dispara cientos de POST /api/reservas/ simultáneos
+contra un mismo turno y verifica que exactamente uno tenga éxito.
+
+Uso:
+    python scripts/stress_reservas.py --url http://localhost:8080 \\
+        --cancha "Cancha A" --fecha 2030-01-07 --hora 18:00-19:00 \\
+        --solicitudes 300 --hilos 50
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test de reservas concurrentes sobre un mismo turno')
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--cancha', default='Cancha A')
+    parser.add_argument('--fecha', required=True, help='Fecha del turno (YYYY-MM-DD), idealmente sin reservas previas')
+    parser.add_argument('--hora', default='18:00-19:00')
+    parser.add_argument('--solicitudes', type=int, default=300)
+    parser.add_argument('--hilos', type=int, default=50)
+    args = parser.parse_args()
+
+    endpoint = f"{args.url.rstrip('/')}/api/reservas/"
+    payload = {'cancha_nombre': args.cancha, 'fecha': args.fecha, 'hora': args.hora}
+
+    # Todos los hilos arrancan juntos para maximizar la contención
+    barrera = threading.Barrier(min(args.hilos, args.solicitudes))
+    local = threading.local()
+
+    def reservar(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            try:
+                barrera.wait(timeout=10)
+            except threading.BrokenBarrierError:
+                pass
+        inicio = time.perf_counter()
+        try:
+            response = local.session.post(endpoint, json=payload, timeout=30)
+            return response.status_code, response.json(), time.perf_counter() - inicio
+        except Exception as e:
+            return None, {'error': str(e)}, time.perf_counter() - inicio
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as executor:
+        resultados = list(executor.map(reservar, range(args.solicitudes)))
+    duracion_total = time.perf_counter() - inicio_total
+
+    exitos = [r for r in resultados if r[1].get('exito')]
+    no_disponibles = [r for r in resultados if r[1].get('disponible') is False]
+    errores = [r for r in resultados if not r[1].get('exito') and r[1].get('disponible') is not False]
+    latencias = sorted(r[2] for r in resultados)
+
+    print(f"Solicitudes: {len(resultados)} en {duracion_total:.2f}s con {args.hilos} hilos")
+    print(f"  Reservas creadas: {len(exitos)}")
+    print(f"  Rechazadas como no disponibles: {len(no_disponibles)}")
+    print(f"  Errores: {len(errores)}")
+    print(f"  Latencia p50={latencias[len(latencias) // 2] * 1000:.0f}ms "
+          f"p99={latencias[int(len(latencias) * 0.99) - 1] * 1000:.0f}ms")
+    for status, cuerpo, _ in errores[:5]:
+        print(f"    {status}: {cuerpo}")
+
+    if len(exitos) != 1 or errores:
+        print("FALLO: se esperaba exactamente una reserva y ningún error")
+        sys.exit(1)
+    print("OK: una sola reserva para el turno, el resto recibió 'no disponible'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Workers de la cola durable (tabla trabajo_cola): procesan los mensajes de
+WhatsApp que encola el webhook. Cada proceso toma trabajos de a uno con
+SELECT ... FOR UPDATE SKIP LOCKED, así se pueden correr varios procesos (o
+varias máquinas) contra la misma base.
+
+Uso:
+    python scripts/worker_cola.py --procesos 4
+    python scripts/worker_cola.py --una-vez      # drena la cola y termina (ej: cron)
+
+Ejemplo con systemd o supervisor: un servicio con
+    cd /root/padelpro/back && .venv/bin/python3 scripts/worker_cola.py --procesos 4
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Cada cuánto se purgan los trabajos terminados y los IDs de mensajes vencidos
+PURGA_CADA_SEGUNDOS = 3600
+
+
+def trabajar(espera_vacia, una_vez):
+    # La app se importa en cada proceso: registra los manejadores de la cola
+    from main import app
+    from app.services.cola import procesar_siguiente, purgar_terminados, nombre_worker
+    from app.services.idempotencia import purgar_vencidos
+    from app.services.envios_whatsapp import obtener_enviador
+
+    detener = []
+    signal.signal(signal.SIGTERM, lambda *_: detener.append(True))
+
+    worker = nombre_worker()
+    ultima_purga = 0
+    print(f"Worker {worker} iniciado")
+    with app.app_context():
+        while not detener:
+            try:
+                if time.monotonic() - ultima_purga > PURGA_CADA_SEGUNDOS:
+                    purgar_terminados()
+                    purgar_vencidos()
+                    ultima_purga = time.monotonic()
+                if procesar_siguiente(worker):
+                    continue
+            except Exception as e:
+                print(f"Error en worker {worker}: {e}")
+            if una_vez:
+                break
+            time.sleep(espera_vacia)
+    # Las respuestas se envían en segundo plano: esperar a que salgan antes de terminar
+    obtener_enviador().detener()
+    print(f"Worker {worker} detenido")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--procesos', type=int, default=int(os.getenv('COLA_WORKERS', 2)))
+    parser.add_argument('--espera', type=float, default=0.5, help='Segundos entre consultas con la cola vacía')
+    parser.add_argument('--una-vez', action='store_true', help='Drenar la cola y terminar')
+    args = parser.parse_args()
+
+    if args.procesos <= 1:
+        trabajar(args.espera, args.una_vez)
+        return
+
+    procesos = [
+        multiprocessing.Process(target=trabajar, args=(args.espera, args.una_vez), name=f'worker-cola-{n}')
+        for n in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        for proceso in procesos:
+            proceso.terminate()
+
+
+if __name__ == '__main__':
+    main()